@@ -0,0 +1,125 @@
+import functools
+import hashlib
+import time
+
+from email.utils import formatdate
+from email.utils import mktime_tz
+from email.utils import parsedate_tz
+
+import fanstatic
+
+from ckanext.ngds.common import base
+from ckanext.ngds.common import helpers as ckan_helpers
+
+# Pages are cached by whichever NGDS plugin owns the settings they are
+# rendered with: 'response_cache' stores them, see 'FragmentCache' in
+# ckanext.ngds.sysadmin.model.cache, and 'config_cache.version' identifies the
+# settings.  Until a plugin calls 'configure', pages are rendered every time.
+response_cache = None
+config_cache = None
+
+def configure(pages=None, settings=None):
+    """
+    Set where 'cached_page' keeps pages.
+
+    @param pages: cache with get(key) and put(key, page, ttl, tags) that
+                  drops its pages when the settings change
+    @param settings: object whose 'version' changes with the settings
+    @return: nothing
+    """
+    global response_cache, config_cache
+    response_cache = pages
+    config_cache = settings
+
+class CachedPage(object):
+    """
+    A rendered page, with the validators that conditional requests are
+    checked against and the fanstatic resources its templates needed, which
+    have to be needed again whenever the page is served from the cache.  The
+    ETag covers the settings version as well as the body, so that a client's
+    copy is never revalidated against pages rendered with other settings.
+    """
+    __slots__ = ('body', 'content_type', 'etag', 'last_modified', 'resources')
+
+    def __init__(self, body, content_type, resources, version=None):
+        self.body = body
+        self.content_type = content_type
+        digest = hashlib.md5(unicode(version).encode('utf-8'))
+        digest.update(body.encode('utf-8'))
+        self.etag = '"%s"' % digest.hexdigest()
+        self.last_modified = int(time.time())
+        self.resources = resources
+
+    def not_modified(self, request):
+        """
+        @param request: pylons request object
+        @return: True if the client's copy of the page is still current
+        """
+        if request.if_none_match:
+            return self.etag.strip('"') in request.if_none_match
+        since = request.headers.get('If-Modified-Since')
+        if since:
+            parsed = parsedate_tz(since)
+            return parsed is not None and mktime_tz(parsed) >= self.last_modified
+        return False
+
+def cacheable(request):
+    # Pages are only shared between anonymous users, and only if nothing in
+    # them is specific to this request: query strings and flash messages.
+    return request.method in ('GET', 'HEAD') and not base.c.user \
+        and not request.query_string and not base.session.get('_flash')
+
+def cached_page(ttl=3600, tags=()):
+    """
+    Decorator for controller actions that render the same page for every
+    anonymous user.  The page is rendered once and then served from
+    'response_cache' for 'ttl' seconds, or until the NGDS settings change or
+    one of 'tags' is invalidated.  Responses carry an ETag,
+    Last-Modified and Surrogate-Key headers, and conditional requests for a
+    page that hasn't changed are answered with 304 Not Modified.
+
+    @param ttl: seconds to keep the page
+    @param tags: names of events that make the page stale, also sent as
+                 surrogate keys for caching proxies
+    @return: decorator
+    """
+    def decorator(action):
+        @functools.wraps(action)
+        def wrapper(self, *args, **kwargs):
+            request = base.request
+            response = base.response
+            pages = response_cache
+            if pages is None or not cacheable(request):
+                return action(self, *args, **kwargs)
+
+            version = getattr(config_cache, 'version', None)
+            key = (request.path, ckan_helpers.lang())
+            page = pages.get(key)
+            if page is None:
+                body = action(self, *args, **kwargs)
+                if response.status_int != 200 or \
+                        not isinstance(body, basestring):
+                    return body
+                needed = fanstatic.get_needed()
+                page = CachedPage(unicode(body), response.content_type,
+                                  list(needed.resources()), version)
+                pages.put(key, page, ttl, tags)
+            else:
+                needed = fanstatic.get_needed()
+                for resource in page.resources:
+                    needed.need(resource)
+
+            response.headers['ETag'] = page.etag
+            response.headers['Last-Modified'] = formatdate(page.last_modified,
+                                                           usegmt=True)
+            response.headers['Surrogate-Key'] = ' '.join(('ngds-config',)
+                                                         + tuple(tags))
+            response.headers['Cache-Control'] = 'public, max-age=0, ' \
+                                                'must-revalidate'
+            if page.not_modified(request):
+                response.status_int = 304
+                return ''
+            response.content_type = page.content_type
+            return page.body
+        return wrapper
+    return decorator
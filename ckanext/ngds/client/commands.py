@@ -0,0 +1,378 @@
+import sys
+import time
+import logging
+
+from multiprocessing.pool import ThreadPool
+
+from ckan.lib.cli import CkanCommand
+
+log = logging.getLogger(__name__)
+
+# Version requested from each service type, the same defaults HandleWMS and
+# HandleWFS use.
+DEFAULT_VERSIONS = {'WMS': '1.1.1', 'WFS': '1.0.0'}
+
+class OGCCommand(CkanCommand):
+    """
+    Manage the cached capabilities of the catalog's OGC (WMS/WFS) services
+
+    Usage:
+        ngds-ogc warm [--workers=N] [--interval=SECONDS]
+            Refresh the capabilities of every service behind an active
+            resource, in parallel, and record each service's latency,
+            availability and layers.  With --interval, keep doing so every
+            SECONDS seconds; otherwise run once, e.g. from cron.
+
+        ngds-ogc report
+            List the services that failed their last check.
+
+        ngds-ogc seed RESOURCE_ID [--zoom=FROM-TO] [--layer=NAME] [--srs=SRS]
+            Fetch every tile of a WMS resource's layer at the given zoom
+            levels (default 0-4) into the tile cache.
+
+        ngds-ogc mirror RESOURCE_ID [--layer=NAME]
+            Copy every feature of a WFS resource's layer into the feature
+            mirror, which serves the layer from then on.
+
+        ngds-ogc unmirror RESOURCE_ID [--layer=NAME]
+            Stop mirroring a WFS resource's layer.
+
+        ngds-ogc mirror-refresh
+            Sync again every mirrored layer whose service's capabilities
+            changed, or that is older than ngds.ogc.feature_mirror_max_age.
+    """
+    summary = __doc__.split('\n')[0]
+    usage = __doc__
+    max_args = 2
+    min_args = 1
+
+    def __init__(self, name):
+        super(OGCCommand, self).__init__(name)
+        self.parser.add_option('-w', '--workers', dest='workers', type='int',
+                               default=8, help='Number of services to check '
+                                               'at the same time')
+        self.parser.add_option('-i', '--interval', dest='interval',
+                               type='int', default=0, help='Repeat every '
+                                                           'INTERVAL seconds')
+        self.parser.add_option('-z', '--zoom', dest='zoom', default='0-4',
+                               help='Zoom levels to seed, e.g. 0-4')
+        self.parser.add_option('-l', '--layer', dest='layer', default=None,
+                               help='Layer to seed or mirror, defaults to '
+                                    'the resource\'s layer')
+        self.parser.add_option('-s', '--srs', dest='srs', default='EPSG:4326',
+                               help='Tile grid to seed')
+
+    def command(self):
+        self._load_config()
+
+        cmd = self.args[0]
+        if cmd == 'warm':
+            while True:
+                self.warm()
+                if not self.options.interval:
+                    break
+                time.sleep(self.options.interval)
+        elif cmd == 'report':
+            self.report()
+        elif cmd == 'seed' and len(self.args) == 2:
+            self.seed(self.args[1])
+        elif cmd in ('mirror', 'unmirror') and len(self.args) == 2:
+            self.mirror(self.args[1], cmd == 'unmirror')
+        elif cmd == 'mirror-refresh':
+            self.mirror_refresh()
+        else:
+            print 'Command %s not recognized' % cmd
+            sys.exit(1)
+
+    def services(self):
+        """
+        Collect the distinct OGC services behind active resources.
+
+        @return: list of (service type, URL, version) tuples
+        """
+        import ckan.model as model
+        from ckanext.ngds.client.model import capabilities
+
+        services = {}
+        query = model.Session.query(model.Resource)\
+            .filter(model.Resource.state == 'active')
+        for resource in query.yield_per(500):
+            extras = resource.extras or {}
+            service_type = capabilities.detect_service_type(
+                resource.url, resource.format, extras.get('protocol'))
+            if service_type is None:
+                continue
+            version = DEFAULT_VERSIONS[service_type]
+            key = capabilities.capabilities_cache.make_key(
+                service_type, resource.url, version)
+            services.setdefault(key, (service_type, resource.url, version))
+        return services.values()
+
+    def warm(self):
+        from ckanext.ngds.client.model import capabilities
+
+        cache = capabilities.capabilities_cache
+        services = self.services()
+        print 'Refreshing capabilities of %s services' % len(services)
+
+        def check(service):
+            service_type, url, version = service
+            started = time.time()
+            try:
+                entry = cache.refresh(service_type, url, version)
+                layers = entry.summary.layer_names
+                result = (True, None, layers)
+            except Exception, e:
+                result = (False, str(e) or e.__class__.__name__, [])
+            return service, time.time() - started, result
+
+        pool = ThreadPool(self.options.workers)
+        try:
+            results = pool.map(check, services)
+        finally:
+            pool.close()
+            pool.join()
+
+        dead = 0
+        for (service_type, url, version), latency, result in results:
+            available, error, layers = result
+            if not available:
+                dead += 1
+                print '  DOWN %s %s (%.1fs): %s' % (service_type, url,
+                                                    latency, error)
+            if cache.store is not None:
+                key = cache.make_key(service_type, url, version)
+                cache.store.record_health(key, available, latency, error,
+                                          layers)
+
+        print '%s of %s services available' % (len(results) - dead,
+                                               len(results))
+
+    def report(self):
+        from ckanext.ngds.client.model import capabilities
+
+        store = capabilities.capabilities_cache.store
+        if store is None:
+            print 'No capabilities store is configured'
+            sys.exit(1)
+
+        dead = store.health_report(available=False)
+        for record in dead:
+            print '%s %s checked %s: %s' % (
+                record['service_type'], record['url'],
+                time.strftime('%Y-%m-%d %H:%M',
+                              time.localtime(record['checked'])),
+                record['error'])
+        print '%s services down' % len(dead)
+
+    def seed(self, resource_id):
+        import ckan.model as model
+        from ckanext.ngds.client.model import ogc
+        from ckanext.ngds.client.model import tiles
+
+        if tiles.tile_cache is None:
+            print 'No tile cache is configured'
+            sys.exit(1)
+
+        resource = model.Resource.get(resource_id)
+        if resource is None:
+            print 'Resource %s not found' % resource_id
+            sys.exit(1)
+        try:
+            first, _, last = self.options.zoom.partition('-')
+            zooms = range(int(first), int(last or first) + 1)
+        except ValueError:
+            print 'Invalid zoom levels %s' % self.options.zoom
+            sys.exit(1)
+
+        wms = ogc.HandleWMS(resource.url)
+        layer = self.options.layer or wms.do_layer_check(
+            {'resource': {'layer': (resource.extras or {}).get('layer')}})
+        print 'Seeding %s of %s at zoom levels %s-%s' % (layer, resource.url,
+                                                         zooms[0], zooms[-1])
+        failed = wms.seed_tiles(layer, zooms, self.options.srs.upper())
+        print '%s tiles could not be fetched' % failed
+
+    def mirror(self, resource_id, remove=False):
+        import ckan.model as model
+        from ckanext.ngds.client.model import mirror
+        from ckanext.ngds.client.model import ogc
+
+        if mirror.feature_mirror is None:
+            print 'No feature mirror is configured'
+            sys.exit(1)
+
+        resource = model.Resource.get(resource_id)
+        if resource is None:
+            print 'Resource %s not found' % resource_id
+            sys.exit(1)
+
+        wfs = ogc.HandleWFS(resource.url)
+        layer = self.options.layer or wfs.do_layer_check(
+            {'resource': {'layer': (resource.extras or {}).get('layer')}})
+        if remove:
+            mirror.feature_mirror.remove(resource.url, layer)
+            print 'No longer mirroring %s of %s' % (layer, resource.url)
+            return
+        started = time.time()
+        count = wfs.sync_mirror(layer)
+        print 'Mirrored %s features of %s of %s in %.1fs' % (
+            count, layer, resource.url, time.time() - started)
+
+    def mirror_refresh(self):
+        from ckanext.ngds.client.model import mirror
+        from ckanext.ngds.client.model import ogc
+
+        if mirror.feature_mirror is None:
+            print 'No feature mirror is configured'
+            sys.exit(1)
+
+        failed = 0
+        for record in mirror.feature_mirror.layers():
+            url, layer = record['url'], record['layer']
+            try:
+                wfs = ogc.HandleWFS(url)
+                if not mirror.feature_mirror.is_stale(
+                        url, layer, wfs.get_layer_token(layer),
+                        mirror.max_age):
+                    continue
+                started = time.time()
+                count = wfs.sync_mirror(layer)
+                print 'Mirrored %s features of %s of %s in %.1fs' % (
+                    count, layer, url, time.time() - started)
+            except Exception, e:
+                failed += 1
+                print '  FAILED %s of %s: %s' % (layer, url, e)
+        if failed:
+            print '%s layers could not be synced' % failed
+            sys.exit(1)
+
+class IndexCommand(CkanCommand):
+    """
+    Fill in the NGDS-specific search index fields
+
+    Usage:
+        ngds-index benchmark [--count=N]
+            Classify N synthetic datasets (default 20000) against the
+            content model keywords and report the throughput.
+
+        ngds-index rebuild [--batch-size=N] [--processes=N] [--resume]
+                           [--dry-run] [--checkpoint=PATH]
+            Reindex every active dataset with its NGDS fields.  Datasets are
+            read from the database in batches of N (default 500), turned
+            into Solr documents by a pool of processes and posted to Solr a
+            batch at a time, with a single commit at the end.  Progress is
+            saved after every batch, and --resume carries on from the last
+            saved batch.  With --dry-run, nothing is posted and only the
+            throughput is reported.
+    """
+    summary = __doc__.split('\n')[0]
+    usage = __doc__
+    max_args = 1
+    min_args = 1
+
+    def __init__(self, name):
+        super(IndexCommand, self).__init__(name)
+        self.parser.add_option('-n', '--count', dest='count', type='int',
+                               default=20000, help='Number of datasets')
+        self.parser.add_option('-b', '--batch-size', dest='batch_size',
+                               type='int', default=500,
+                               help='Datasets per batch')
+        self.parser.add_option('-p', '--processes', dest='processes',
+                               type='int', default=None,
+                               help='Worker processes, defaults to one per '
+                                    'CPU')
+        self.parser.add_option('-r', '--resume', dest='resume',
+                               action='store_true', default=False,
+                               help='Carry on from the saved checkpoint')
+        self.parser.add_option('-d', '--dry-run', dest='dry_run',
+                               action='store_true', default=False,
+                               help='Build the documents without posting '
+                                    'them')
+        self.parser.add_option('-k', '--checkpoint', dest='checkpoint',
+                               default=None, help='Checkpoint file')
+
+    def command(self):
+        self._load_config()
+
+        cmd = self.args[0]
+        if cmd == 'benchmark':
+            self.benchmark()
+        elif cmd == 'rebuild':
+            self.rebuild()
+        else:
+            print 'Command %s not recognized' % cmd
+            sys.exit(1)
+
+    def benchmark(self):
+        from ckanext.ngds.client.model import classifier
+
+        if classifier.content_model_classifier is None:
+            classifier.configure()
+        rate, classified = classifier.benchmark(
+            classifier.content_model_classifier, self.options.count)
+        print 'Classified %s datasets at %.0f datasets/s, %s matched a ' \
+              'content model' % (self.options.count, rate, classified)
+
+    def rebuild(self):
+        import multiprocessing
+        import os
+
+        import ckan.model as model
+        from pylons import config
+        from ckanext.ngds.client.model import indexing
+
+        path = self.options.checkpoint
+        if path is None:
+            path = os.path.join(config.get('cache_dir') or '.', 'ngds',
+                                'reindex.checkpoint')
+        checkpoint = indexing.Checkpoint(path)
+
+        after, indexed = None, 0
+        if self.options.resume:
+            saved = checkpoint.read()
+            if saved is None:
+                print 'No checkpoint at %s, starting from the beginning' % path
+            else:
+                after, indexed = saved['last_id'], saved['indexed']
+                print 'Resuming after package %s, %s already indexed' % (
+                    after, indexed)
+
+        updater = None
+        if not self.options.dry_run:
+            updater = indexing.SolrUpdater(config.get('solr_url'),
+                                           config.get('solr_user'),
+                                           config.get('solr_password'))
+
+        def report(stats):
+            print '%s datasets in %.0fs (%.1f datasets/s), %s failed' % (
+                stats['packages'], stats['seconds'],
+                stats['packages'] / max(stats['seconds'], 1e-6),
+                stats['failed'])
+
+        # The workers are forked with the configuration already loaded, but
+        # must not share the parent's database connections.
+        model.Session.remove()
+        model.meta.engine.dispose()
+        pool = multiprocessing.Pool(self.options.processes)
+        try:
+            batches = indexing.package_batches(model.Session, model.Package,
+                                               self.options.batch_size, after)
+            stats = indexing.rebuild(
+                batches, lambda batches: pool.imap(indexing.index_documents,
+                                                   batches),
+                updater, checkpoint, indexed, report)
+        except:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+
+        report(stats)
+        if self.options.dry_run:
+            print 'Dry run: %.1f MB of documents built, nothing posted' % (
+                stats['bytes'] / 1048576.0)
+        else:
+            print '%s datasets indexed and committed' % stats['indexed']
@@ -0,0 +1,139 @@
+import json
+
+from ckanext.ngds.common import plugins as p
+from ckanext.ngds.common import base
+from ckanext.ngds.common import model
+from ckanext.ngds.client.model import ogc
+
+_ = base._
+
+class FeatureController(base.BaseController):
+    """
+    Controller object for serving features from OGC WFS resources.
+    @param BaseController: Vanillan CKAN object for extending controllers.
+    """
+
+    def _feature_request(self, id):
+        """
+        Read the resource and the paging and subsetting parameters shared by
+        the feature endpoints.
+
+        @param id: resource id
+        @return: (HandleWFS, data_dict, page_size, max_features, query)
+        """
+        context = {'model': model, 'session': model.Session,
+                   'user': base.c.user}
+        try:
+            resource = p.toolkit.get_action('resource_show')(context,
+                                                             {'id': id})
+        except p.toolkit.ObjectNotFound:
+            base.abort(404, _('Resource not found'))
+        except p.toolkit.NotAuthorized:
+            base.abort(401, _('Not authorized to read resource %s') % id)
+
+        params = base.request.params
+        if params.get('layer'):
+            resource['layer'] = params.get('layer')
+        try:
+            page_size = min(int(params.get('page_size', 1000)), 10000)
+            max_features = int(params.get('max_features', 0)) or None
+        except ValueError:
+            base.abort(400, _('page_size and max_features must be integers'))
+
+        # Optional subsetting, all of which is evaluated by the WFS server:
+        # bbox=minx,miny,maxx,maxy in WGS84, properties=name,name and a JSON
+        # object of property names and values as filter.
+        query = {}
+        try:
+            if params.get('bbox'):
+                query['bbox'] = [float(x) for x in params['bbox'].split(',')]
+                assert len(query['bbox']) == 4
+            if params.get('properties'):
+                query['properties'] = params['properties'].split(',')
+            if params.get('filter'):
+                query['filter'] = json.loads(params['filter'])
+                assert isinstance(query['filter'], dict)
+        except (ValueError, AssertionError):
+            base.abort(400, _('Invalid bbox, properties or filter parameter'))
+
+        try:
+            wfs = ogc.HandleWFS(resource['url'], params.get('version', '1.0.0'))
+        except Exception, e:
+            base.abort(502, _('Could not read the capabilities of %s: %s') %
+                       (resource['url'], e))
+        return wfs, {'resource': resource}, page_size, max_features, query
+
+    def _stream(self, stream, data_dict, *args, **query):
+        """
+        Start streaming a response body.  The layer is looked up and the first
+        page of features fetched before the response is sent, so an unknown
+        layer or an unreachable service gets its own status instead of a 200
+        with a truncated body.
+
+        @param stream: HandleWFS.stream_geojson or HandleWFS.stream_recline
+        @return: iterator over chunks of the response body
+        """
+        layer = data_dict['resource'].get('layer')
+        try:
+            chunks = stream(data_dict, *args, **query)
+        except KeyError:
+            base.abort(404, _('Layer %s not found') % layer)
+        except (IOError, EnvironmentError), e:
+            base.abort(502, _('Could not read features of %s: %s') % (layer, e))
+        base.response.headers['Content-Type'] = 'application/json;charset=utf-8'
+        return chunks
+
+    def render_geojson(self, id):
+        """
+        Stream every feature of a WFS resource as a single GeoJSON
+        FeatureCollection.  Features are written out page by page as they
+        arrive from the service, so memory use doesn't grow with the size of
+        the layer.
+
+        @param id: resource id
+        @return: iterator over chunks of the response body
+        """
+        wfs, data_dict, page_size, max_features, query = \
+            self._feature_request(id)
+        return self._stream(wfs.stream_geojson, data_dict, page_size,
+                            max_features, **query)
+
+    def render_recline(self, id):
+        """
+        Stream the features of a WFS resource as a columnar Recline payload
+        (see 'recline.encode_columnar'), a fraction of the size of one
+        object per row, for the data preview.  Takes the same parameters as
+        'render_geojson', plus 'batch_size', the rows per columnar batch.
+
+        @param id: resource id
+        @return: iterator over chunks of the response body
+        """
+        wfs, data_dict, page_size, max_features, query = \
+            self._feature_request(id)
+        try:
+            batch_size = min(int(base.request.params.get('batch_size', 5000)),
+                             50000)
+        except ValueError:
+            base.abort(400, _('batch_size must be an integer'))
+        return self._stream(wfs.stream_recline, data_dict, page_size,
+                            max_features, batch_size, **query)
+
+    def render_schema(self, id):
+        """
+        Describe the layer of a WFS resource without fetching any features:
+        its name, WGS84 bounding box, fields and feature count, see
+        'HandleWFS.get_layer_stats'.  Answers are cached with the service's
+        capabilities, so previews can show columns and size straight away.
+
+        @param id: resource id
+        @return: JSON object with 'layer', 'bbox', 'fields' and 'count'
+        """
+        wfs, data_dict, page_size, max_features, query = \
+            self._feature_request(id)
+        try:
+            stats = wfs.get_layer_stats(data_dict)
+        except KeyError:
+            base.abort(404, _('Layer %s not found') %
+                       data_dict['resource'].get('layer'))
+        base.response.content_type = 'application/json'
+        return json.dumps(stats)
@@ -0,0 +1,39 @@
+import json
+
+from ckanext.ngds.common import base
+from ckanext.ngds.common import model
+from ckanext.ngds.client.model import classifier
+from ckanext.ngds.client.model import suggest
+
+_ = base._
+
+def build_index():
+    content_models = ()
+    if classifier.content_model_classifier is not None:
+        content_models = classifier.content_model_classifier.models
+    return suggest.PrefixIndex(suggest.catalog_entries(model, content_models))
+
+class SuggestController(base.BaseController):
+    """
+    Controller object for the typeahead of the NGDS search box.
+    @param BaseController: Vanillan CKAN object for extending controllers.
+    """
+
+    def suggest(self):
+        """
+        Suggest dataset titles, tags and content models starting with the
+        text typed so far.  Suggestions come from an in-memory prefix index
+        of the catalog, see 'suggest.SuggestionCache'.
+
+        @return: JSON list of objects with 'value', 'type' and 'name'
+        """
+        params = base.request.params
+        try:
+            limit = min(int(params.get('limit', 10)), 10)
+        except ValueError:
+            base.abort(400, _('limit must be an integer'))
+
+        index = suggest.suggestion_cache.get(build_index, model.Session.remove)
+        base.response.content_type = 'application/json'
+        base.response.headers['Cache-Control'] = 'public, max-age=60'
+        return json.dumps(index.suggest(params.get('q', ''), limit))
@@ -0,0 +1,156 @@
+from ckanext.ngds.common import plugins as p
+from ckanext.ngds.common import base
+from ckanext.ngds.common import model
+from ckanext.ngds.client.model import mvt
+from ckanext.ngds.client.model import ogc
+from ckanext.ngds.client.model import tiles
+
+_ = base._
+
+class TileController(base.BaseController):
+    """
+    Controller object for serving map tiles of OGC WMS resources, and vector
+    tiles of WFS resources, through the local tile cache.
+    @param BaseController: Vanillan CKAN object for extending controllers.
+    """
+
+    def _resource(self, id):
+        context = {'model': model, 'session': model.Session,
+                   'user': base.c.user}
+        try:
+            return p.toolkit.get_action('resource_show')(context, {'id': id})
+        except p.toolkit.ObjectNotFound:
+            base.abort(404, _('Resource not found'))
+        except p.toolkit.NotAuthorized:
+            base.abort(401, _('Not authorized to read resource %s') % id)
+
+    def _cache_control(self, resource):
+        # Tiles of public datasets may be kept by shared caches, those of
+        # private datasets only by the browser of the user who could read them.
+        package = model.Package.get(resource.get('package_id'))
+        if package is None or package.private:
+            return 'private, max-age=86400'
+        return 'public, max-age=86400'
+
+    def _tile(self, resource, layer, z, x, y, srs, format, version):
+        try:
+            wms = ogc.HandleWMS(resource['url'], version)
+            if not layer:
+                layer = wms.do_layer_check({'resource': resource})
+            content_type, data = wms.get_tile(layer, z, x, y, srs, format)
+        except KeyError:
+            base.abort(404, _('Layer %s not found') % layer)
+        except ValueError, e:
+            base.abort(400, str(e))
+        except (IOError, EnvironmentError), e:
+            base.abort(502, _('Could not fetch tile: %s') % e)
+
+        base.response.headers['Content-Type'] = str(content_type)
+        base.response.headers['Cache-Control'] = self._cache_control(resource)
+        return data
+
+    def render_tile(self, id, z, x, y):
+        """
+        Serve one tile of a WMS resource from a fixed tile grid, e.g. for a
+        Leaflet or OpenLayers XYZ layer.
+
+        @param id: resource id
+        @param z: zoom level
+        @param x: column, counted from the left
+        @param y: row, counted from the top
+        @return: image bytes
+        """
+        resource = self._resource(id)
+        params = base.request.params
+        srs = params.get('srs', 'EPSG:4326').upper()
+        if srs not in tiles.GRIDS:
+            base.abort(400, _('Tiles are not available in %s') % srs)
+        try:
+            z, x, y = int(z), int(x), int(y)
+        except ValueError:
+            base.abort(400, _('z, x and y must be integers'))
+        return self._tile(resource, params.get('layer', resource.get('layer')),
+                          z, x, y, srs, params.get('format', 'image/png'),
+                          params.get('version', '1.1.1'))
+
+    def render_getmap(self, id):
+        """
+        Answer a WMS GetMap request for a WMS resource, so that map clients
+        can use this URL in place of the remote service.  Only requests that
+        line up with a tile of one of the grids in 'tiles.GRIDS' are served,
+        which is what tiled WMS layers send.
+
+        @param id: resource id
+        @return: image bytes
+        """
+        resource = self._resource(id)
+        params = dict((key.upper(), value)
+                      for key, value in base.request.params.items())
+        if params.get('REQUEST', 'GetMap').lower() != 'getmap':
+            base.abort(400, _('Only GetMap requests are supported'))
+
+        version = params.get('VERSION', '1.1.1')
+        srs = params.get('CRS' if version == '1.3.0' else 'SRS',
+                         params.get('SRS', 'EPSG:4326')).upper()
+        grid = tiles.GRIDS.get(srs)
+        if grid is None:
+            base.abort(400, _('Tiles are not available in %s') % srs)
+        try:
+            bbox = [float(v) for v in params.get('BBOX', '').split(',')]
+            assert len(bbox) == 4
+            width, height = int(params['WIDTH']), int(params['HEIGHT'])
+        except (ValueError, KeyError, AssertionError):
+            base.abort(400, _('Invalid BBOX, WIDTH or HEIGHT parameter'))
+        if version == '1.3.0' and srs == 'EPSG:4326':
+            bbox = [bbox[1], bbox[0], bbox[3], bbox[2]]
+
+        tile = grid.tile_for_bbox(bbox, width, height)
+        if tile is None:
+            base.abort(400, _('Requests must be %sx%s tiles of the %s grid')
+                       % (grid.size, grid.size, srs))
+        layer = params.get('LAYERS', '').split(',')[0] or resource.get('layer')
+        return self._tile(resource, layer, tile[0], tile[1], tile[2], srs,
+                          params.get('FORMAT', 'image/png'), version)
+
+    def render_vector_tile(self, id, z, x, y):
+        """
+        Serve one Mapbox Vector Tile of a WFS resource's layer, e.g. for a
+        Mapbox GL or OpenLayers vector tile layer.  Tiles are cut from the
+        layer's features, see 'HandleWFS.get_vector_tile'.  Tiles that hold
+        more features than could be read are sent with an
+        'X-Features-Truncated: true' header.
+
+        @param id: resource id
+        @param z: zoom level
+        @param x: column, counted from the left
+        @param y: row, counted from the top
+        @return: protobuf bytes
+        """
+        resource = self._resource(id)
+        params = base.request.params
+        srs = params.get('srs', 'EPSG:3857').upper()
+        if srs not in tiles.GRIDS:
+            base.abort(400, _('Tiles are not available in %s') % srs)
+        try:
+            z, x, y = int(z), int(x), int(y)
+        except ValueError:
+            base.abort(400, _('z, x and y must be integers'))
+
+        layer = params.get('layer', resource.get('layer'))
+        try:
+            wfs = ogc.HandleWFS(resource['url'], params.get('version', '1.0.0'))
+            if not layer:
+                layer = wfs.do_layer_check({'resource': resource})
+            data, truncated = wfs.get_vector_tile(layer, z, x, y, srs)
+        except KeyError:
+            base.abort(404, _('Layer %s not found') % layer)
+        except ValueError, e:
+            base.abort(400, str(e))
+        except (IOError, EnvironmentError), e:
+            base.abort(502, _('Could not fetch features: %s') % e)
+
+        base.response.headers['Content-Type'] = mvt.CONTENT_TYPE
+        base.response.headers['Cache-Control'] = self._cache_control(resource)
+        if truncated:
+            base.response.headers['X-Features-Truncated'] = 'true'
+        return data
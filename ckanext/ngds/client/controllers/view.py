@@ -1,5 +1,6 @@
 from ckanext.ngds.common import plugins as p
 from ckanext.ngds.common import base
+from ckanext.ngds.caching import cached_page
 
 class ViewController(base.BaseController):
     """
@@ -7,11 +8,14 @@ class ViewController(base.BaseController):
     @param BaseController: Vanillan CKAN object for extending controllers.
     """
 
+    @cached_page()
     def render_developers(self):
         return p.toolkit.render('ngds/developers.html')
 
+    @cached_page()
     def render_help(self):
         return p.toolkit.render('ngds/help.html')
 
+    @cached_page()
     def render_contact(self):
         return p.toolkit.render('ngds/contact.html')
\ No newline at end of file
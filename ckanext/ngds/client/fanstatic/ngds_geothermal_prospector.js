@@ -1,24 +1,56 @@
 'use strict';
 
 ckan.module('ngds_geothermal_prospector', function ($, _) {
+  // Every Prospector button on a page shares one batch request, made as soon
+  // as the first button initializes, so that a click can usually open the
+  // link straight away.
+  var prefetched = null;
+
+  function prefetch() {
+    if (!prefetched) {
+      var ids = $('[data-module="ngds_geothermal_prospector"]').map(function () {
+        return $(this).attr('res_id');
+      }).get();
+
+      prefetched = $.ajax({
+        url: '/api/action/geothermal_prospector_urls',
+        type: 'POST',
+        data: JSON.stringify({'ids': ids})
+      });
+    }
+    return prefetched;
+  }
+
   return {
     initialize: function () {
       $.proxyAll(this, /_on/);
       this.el.on('click', this._onClick);
+      prefetch();
     },
     _onClick: function (event) {
       var id = $('#' + event.currentTarget.id)
         , resId = id.attr('res_id')
         ;
 
-      $.ajax({
-        url: '/api/action/geothermal_prospector_url',
-        type: 'POST',
-        data: JSON.stringify({'id': resId}),
-        success: function (data) {
-          window.open(data.result, '_blank');
+      function fetchOne() {
+        $.ajax({
+          url: '/api/action/geothermal_prospector_url',
+          type: 'POST',
+          data: JSON.stringify({'id': resId}),
+          success: function (data) {
+            window.open(data.result, '_blank');
+          }
+        });
+      }
+
+      prefetch().done(function (data) {
+        var url = data.result && data.result[resId];
+        if (url && url !== 'error') {
+          window.open(url, '_blank');
+        } else {
+          fetchOne();
         }
-      });
+      }).fail(fetchOne);
     }
   }
-});
\ No newline at end of file
+});
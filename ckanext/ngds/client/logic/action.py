@@ -1,17 +1,157 @@
+import json
+import threading
+
+from collections import OrderedDict
+
 from ckanext.ngds.common import plugins as p
 from ckanext.ngds.common import logic
+from ckanext.ngds.client.model import facets
 from ckanext.ngds.client.model import ogc
+from ckanext.ngds.client.model import spatial
+from ckanext.ngds.client.model import transport
+
+GTP_URL = 'https://maps-stage.nrel.gov/geothermal-prospector/#/'
+GTP_LAYER = '6'
+
+# Computed Prospector URLs by resource id, each stored with the resource 'url'
+# and 'revision_id' it was computed from so that editing the resource
+# invalidates it.
+_prospector_cache = OrderedDict()
+_prospector_lock = threading.Lock()
+PROSPECTOR_CACHE_SIZE = 1000
+
+def build_prospector_url(service_url):
+    wms = ogc.HandleWMS(service_url)
+    wms_info = wms.get_layer_info({})
+    url = GTP_URL + '?baselayer=' + GTP_LAYER + '&zoomlevel=3&wmsHost=' \
+          + wms_info['service_url'].replace('?', '') + '&wmsLayerName=' \
+          + wms_info['layer']
+    return url
+
+def resource_prospector_url(resource):
+    """
+    Return the Geothermal Prospector URL for a resource dictionary, computing
+    it only if the resource has changed since it was last computed.
+
+    @param resource: dictionary returned by 'resource_show'
+    @return: URL string
+    """
+    stamp = (resource.get('url'), resource.get('revision_id'))
+    with _prospector_lock:
+        cached = _prospector_cache.pop(resource['id'], None)
+        if cached is not None:
+            _prospector_cache[resource['id']] = cached
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    url = build_prospector_url(resource['url'])
+    with _prospector_lock:
+        _prospector_cache.pop(resource['id'], None)
+        _prospector_cache[resource['id']] = (stamp, url)
+        while len(_prospector_cache) > PROSPECTOR_CACHE_SIZE:
+            _prospector_cache.popitem(last=False)
+    return url
 
 def geothermal_prospector_url(context, data_dict):
     try:
         search = logic.action.get.resource_show(context, data_dict)
-        gtp_url = 'https://maps-stage.nrel.gov/geothermal-prospector/#/'
-        gtp_layer = '6'
-        wms = ogc.HandleWMS(search['url'])
-        wms_info = wms.get_layer_info({})
-        url = gtp_url + '?baselayer=' + gtp_layer + '&zoomlevel=3&wmsHost=' \
-              + wms_info['service_url'].replace('?', '') + '&wmsLayerName=' \
-              + wms_info['layer']
-        return url
+        return resource_prospector_url(search)
     except:
-        return 'error'
\ No newline at end of file
+        return 'error'
+
+def geothermal_prospector_urls(context, data_dict):
+    """
+    Batch version of 'geothermal_prospector_url' so that a dataset page can
+    prefetch the links for all of its WMS resources in one API call.  The
+    resources are read one after the other, but the WMS lookups for them run
+    concurrently on the shared OGC thread pool.
+
+    @param ids: list of resource ids
+    @return: dictionary of resource id to Prospector URL, or to 'error' for
+             resources that could not be resolved
+    """
+    ids = data_dict.get('ids') or []
+    if isinstance(ids, basestring):
+        ids = ids.split(',')
+
+    results = {}
+    resources = []
+    for id in ids:
+        try:
+            resource = logic.action.get.resource_show(dict(context), {'id': id})
+            resources.append((id, resource))
+        except:
+            results[id] = 'error'
+
+    def resolve(item):
+        id, resource = item
+        try:
+            return id, resource_prospector_url(resource)
+        except:
+            return id, 'error'
+
+    results.update(transport.http_client.map(resolve, resources))
+    return results
+
+def solr_query(params):
+    from ckan.lib.search.common import make_connection
+    conn = make_connection()
+    try:
+        return json.loads(conn.raw_query(**params))
+    finally:
+        conn.close()
+
+def ngds_facets(context, data_dict):
+    """
+    Count every facet of the NGDS facet tree (see facet-config.json) for a
+    dataset search, in one Solr request.  Counts are cached per search for a
+    short while.
+
+    @param q: Solr query, defaults to all datasets
+    @param fq: Solr filter query
+    @param facet.limit: number of values to list for each dynamic facet
+    @return: list of facet tree nodes with their counts
+    """
+    p.toolkit.check_access('package_search', context, data_dict)
+    if facets.facet_plan is None:
+        facets.configure()
+    if facets.facet_plan is None:
+        raise p.toolkit.ObjectNotFound('No NGDS facet configuration found')
+
+    fq = '%s +site_id:%s +state:active +capacity:public' % (
+        data_dict.get('fq', ''),
+        facets.solr_literal(p.toolkit.config.get('ckan.site_id')))
+    try:
+        limit = int(data_dict.get('facet.limit', 50))
+    except ValueError:
+        raise p.toolkit.ValidationError({'facet.limit': ['Must be an integer']})
+
+    return facets.count_facets(facets.facet_plan, solr_query,
+                               data_dict.get('q') or '*:*', fq.strip(), limit,
+                               facets.facet_cache)
+
+def ngds_bbox_search(context, data_dict):
+    """
+    Search datasets whose extent intersects a bounding box, best matching
+    extents first.  The intersection is answered by the spatial index of the
+    'spatial_geom' field and the ranking by a function of the indexed extent,
+    so the whole search is a single Solr query.
+
+    @param bbox: 'minx,miny,maxx,maxy' in WGS84 degrees
+    @param q: optional text query
+    @param fq: optional Solr filter query
+    @param rows: number of datasets to return
+    @param start: offset of the first dataset to return
+    @return: 'package_search' result
+    """
+    try:
+        bbox = spatial.parse_bbox(data_dict.get('bbox'))
+    except ValueError, e:
+        raise p.toolkit.ValidationError({'bbox': [str(e)]})
+
+    params = spatial.search_params(bbox)
+    search = dict((key, data_dict[key]) for key in ('q', 'rows', 'start')
+                  if key in data_dict)
+    search['fq'] = ('%s +%s' % (data_dict.get('fq', ''), params['fq'])).strip()
+    search['sort'] = params['sort']
+    return p.toolkit.get_action('package_search')(context, search)
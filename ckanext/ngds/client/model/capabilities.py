@@ -0,0 +1,508 @@
+import logging
+import threading
+import time
+import urllib
+import urlparse
+
+from collections import OrderedDict
+from cStringIO import StringIO
+from xml.etree.cElementTree import iterparse
+from owslib.wms import WebMapService
+from owslib.wfs import WebFeatureService
+from ckanext.ngds.client.model import store
+from ckanext.ngds.client.model import transport
+
+log = logging.getLogger(__name__)
+
+# Query string parameters that OWSLib adds itself when it builds a
+# GetCapabilities request, and therefore must not take part in the cache key.
+OWS_REQUEST_PARAMS = ('service', 'request', 'version')
+
+# Map each OGC service type to the OWSLib object that knows how to parse its
+# GetCapabilities document.
+SERVICE_PARSERS = {
+    'WMS': WebMapService,
+    'WFS': WebFeatureService
+}
+
+XLINK_HREF = '{http://www.w3.org/1999/xlink}href'
+
+def normalize_url(url):
+    """
+    Reduce a service URL to a canonical form so that the same endpoint
+    written in different ways shares one cache entry.  The scheme and host
+    are lowercased, the fragment is dropped, OWS request parameters are
+    removed and the remaining query parameters are sorted.
+
+    @param url: service URL as stored on a CKAN resource
+    @return: normalized URL string
+    """
+    scheme, netloc, path, query, fragment = urlparse.urlsplit(url.strip())
+    params = [(k, v) for (k, v) in urlparse.parse_qsl(query)
+              if k.lower() not in OWS_REQUEST_PARAMS]
+    return urlparse.urlunsplit((scheme.lower(), netloc.lower(), path,
+                                urllib.urlencode(sorted(params)), ''))
+
+def capabilities_url(service_type, url, version):
+    """
+    Build the GetCapabilities request URL for a service endpoint.
+
+    @param service_type: 'WMS' or 'WFS'
+    @param url: service URL
+    @param version: service version as a string
+    @return: GetCapabilities URL
+    """
+    base = normalize_url(url)
+    request = urllib.urlencode([('service', service_type),
+                                ('request', 'GetCapabilities'),
+                                ('version', version)])
+    if '?' in base:
+        return base + '&' + request
+    return base + '?' + request
+
+def fetch_capabilities(url, headers=None):
+    """
+    Perform a (possibly conditional) HTTP GET for a capabilities document
+    through the shared OGC HTTP client.
+
+    @param url: GetCapabilities URL
+    @param headers: extra request headers, e.g. If-None-Match
+    @return: tuple of (status code, body or None, response headers)
+    """
+    response = transport.http_client.get(url, headers)
+    if response.status_code == 304:
+        return 304, None, response.headers
+    response.raise_for_status()
+    return response.status_code, response.content, response.headers
+
+def summarize(service):
+    """
+    Boil a parsed OWSLib service down to the plain, JSON-serializable parts
+    that HandleWMS and HandleWFS actually use: identification, layers with
+    their CRS options and WGS84 bounding boxes, and the operation URLs and
+    formats.
+
+    @param service: OWSLib WebMapService or WebFeatureService
+    @return: dictionary
+    """
+    layers = []
+    for name in list(service.contents):
+        layer = service.contents[name]
+        layers.append({
+            'name': name,
+            'title': layer.title,
+            'bbox': layer.boundingBoxWGS84,
+            'crs': [getattr(crs, 'id', crs) for crs in layer.crsOptions or []]
+        })
+
+    operations = {}
+    for operation in service.operations:
+        operations[operation.name] = {
+            'methods': operation.methods,
+            'formats': operation.formatOptions,
+            'parameters': getattr(operation, 'parameters', {})
+        }
+
+    identification = service.identification
+    return {
+        'type': identification.type,
+        'version': identification.version,
+        'title': identification.title,
+        'abstract': identification.abstract,
+        'layers': layers,
+        'operations': operations
+    }
+
+def local_tag(tag):
+    return tag.rsplit('}', 1)[-1]
+
+def parse_wms_capabilities(xml, version):
+    """
+    Build the same summary as 'summarize' straight from a WMS 1.1.1 or 1.3.0
+    capabilities document, without going through OWSLib.  The document is
+    streamed through iterparse and only the Service block, the Request
+    operations and each layer's name, title, CRS and WGS84 bounding box are
+    read; styles, metadata and everything else are discarded as soon as they
+    have been parsed.  Layers inherit CRS options and bounding boxes from
+    their parents, as in OWSLib.
+
+    @param xml: capabilities document as a string
+    @param version: version that was requested from the service
+    @return: dictionary
+    """
+    summary = {'type': None, 'version': version, 'title': None,
+               'abstract': None, 'layers': [], 'operations': {}}
+    path = []
+    stack = []
+    ordered = []
+
+    for event, elem in iterparse(StringIO(xml), events=('start', 'end')):
+        tag = local_tag(elem.tag)
+        if event == 'start':
+            if not path and tag == 'ServiceExceptionReport':
+                raise ValueError('Service returned an exception report')
+            if tag == 'Layer':
+                parent = stack[-1] if stack else None
+                layer = {'name': None, 'title': None,
+                         'bbox': parent['bbox'] if parent else None,
+                         'crs': list(parent['crs']) if parent else []}
+                stack.append(layer)
+                ordered.append(layer)
+            path.append(tag)
+            continue
+
+        path.pop()
+        parent_tag = path[-1] if path else None
+        text = (elem.text or '').strip() or None
+
+        if tag == 'Layer':
+            stack.pop()
+            elem.clear()
+        elif parent_tag == 'Layer':
+            layer = stack[-1]
+            if tag == 'Name':
+                layer['name'] = text
+            elif tag == 'Title':
+                layer['title'] = text
+            elif tag in ('SRS', 'CRS') and text:
+                for crs in text.split():
+                    if crs not in layer['crs']:
+                        layer['crs'].append(crs)
+            elif tag == 'LatLonBoundingBox':
+                layer['bbox'] = tuple(float(elem.get(k)) for k in
+                                      ('minx', 'miny', 'maxx', 'maxy'))
+            elif tag == 'EX_GeographicBoundingBox':
+                edges = dict((local_tag(child.tag), float(child.text))
+                             for child in elem)
+                layer['bbox'] = (edges['westBoundLongitude'],
+                                 edges['southBoundLatitude'],
+                                 edges['eastBoundLongitude'],
+                                 edges['northBoundLatitude'])
+            elem.clear()
+        elif parent_tag == 'Service' and tag in ('Name', 'Title', 'Abstract'):
+            key = 'type' if tag == 'Name' else tag.lower()
+            summary[key] = text
+        elif parent_tag == 'Request':
+            methods = {}
+            for dcp in elem:
+                if local_tag(dcp.tag) != 'DCPType':
+                    continue
+                for verb in [v for http in dcp for v in http]:
+                    for resource in verb:
+                        if local_tag(resource.tag) == 'OnlineResource':
+                            methods[local_tag(verb.tag)] = \
+                                {'url': resource.get(XLINK_HREF)}
+            summary['operations'][tag] = {
+                'methods': methods,
+                'formats': [(child.text or '').strip() for child in elem
+                            if local_tag(child.tag) == 'Format'],
+                'parameters': {}
+            }
+            elem.clear()
+
+    summary['layers'] = [layer for layer in ordered if layer['name']]
+    return summary
+
+# Services parsed with a lightweight parser of our own unless the caller needs
+# the full OWSLib object.
+SUMMARY_PARSERS = {
+    'WMS': parse_wms_capabilities
+}
+
+class Capabilities(object):
+    """
+    Read-only view of a capabilities summary.  The case-insensitive layer
+    index is only built the first time a layer is looked up, and 'memo' lets
+    handlers keep results they derive from the summary, such as
+    HandleWMS.get_layer_info, for as long as the summary itself is cached.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.memo = {}
+        self._index = None
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    @property
+    def layer_names(self):
+        return [layer['name'] for layer in self.data['layers']]
+
+    def find_layer(self, name):
+        """
+        Look up a layer by name, ignoring case.
+
+        @param name: layer name
+        @return: layer summary dictionary, or None if there is no such layer
+        """
+        if self._index is None:
+            index = {}
+            for layer in self.data['layers']:
+                index.setdefault(layer['name'].lower(), layer)
+            self._index = index
+        return self._index.get((name or '').lower())
+
+class CapabilitiesEntry(object):
+    """
+    A capabilities summary, the parsed OWSLib service object it was built
+    from (None when the summary was read from disk) and the HTTP validators
+    needed to revalidate it once it goes stale.
+    """
+    __slots__ = ('service', 'summary', 'etag', 'last_modified', 'expires')
+
+    def __init__(self, service, summary, etag=None, last_modified=None,
+                 expires=0):
+        self.service = service
+        self.summary = summary
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+
+    def is_fresh(self, now=None):
+        return (now or time.time()) < self.expires
+
+    def validators(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+class CapabilitiesCache(object):
+    """
+    Thread-safe, size-bounded LRU cache of parsed GetCapabilities documents
+    keyed by (normalized URL, service type, version).  Entries are served
+    from memory until their TTL runs out; after that they are revalidated
+    with ETag/If-Modified-Since, and only re-parsed if the server reports that
+    the document actually changed.  If a CapabilitiesStore is attached, the
+    summaries are also written to disk and a cold process reads them from
+    there before going to the network.
+    """
+
+    def __init__(self, ttl=3600, max_size=128, fetch=fetch_capabilities,
+                 store=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.fetch = fetch
+        self.store = store
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def make_key(self, service_type, url, version):
+        return (normalize_url(url), service_type.upper(), version)
+
+    def get(self, service_type, url, version, parsed=False):
+        """
+        Return the cache entry for the given endpoint, going to the network
+        only if there is no fresh entry in memory or on disk.
+
+        @param service_type: 'WMS' or 'WFS'
+        @param url: service URL
+        @param version: service version as a string
+        @param parsed: if True, the entry must carry the full OWSLib object
+                       and not only its summary
+        @return: CapabilitiesEntry
+        """
+        key = self.make_key(service_type, url, version)
+        entry = self._lookup(key)
+        if self._usable(entry, parsed):
+            return entry
+
+        # Only one thread per key goes to the network; everyone else waits
+        # for it and then picks up the fresh entry.
+        with self._key_lock(key):
+            entry = self._lookup(key)
+            if self._usable(entry, parsed):
+                return entry
+            entry = self._load(key, entry, parsed)
+            self._store(key, entry)
+            return entry
+
+    def refresh(self, service_type, url, version):
+        """
+        Revalidate an endpoint right away, whether or not its entry is still
+        fresh.  Unlike 'get', a failure to reach the service is raised rather
+        than papered over with the stale entry.
+
+        @param service_type: 'WMS' or 'WFS'
+        @param url: service URL
+        @param version: service version as a string
+        @return: CapabilitiesEntry
+        """
+        key = self.make_key(service_type, url, version)
+        with self._key_lock(key):
+            stale = self._lookup(key)
+            if stale is None and self.store is not None:
+                stale = self._read_store(key)
+            entry = self._load(key, stale, strict=True)
+            self._store(key, entry)
+            return entry
+
+    def _usable(self, entry, parsed):
+        return entry is not None and entry.is_fresh() and \
+            (entry.service is not None or not parsed)
+
+    def invalidate(self, service_type=None, url=None, version=None):
+        """
+        Drop one entry, or every entry if called without arguments.
+        """
+        with self._lock:
+            if url is None:
+                self._entries.clear()
+            else:
+                key = self.make_key(service_type, url, version)
+                self._entries.pop(key, None)
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+            return entry
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_size:
+                evicted, _ = self._entries.popitem(last=False)
+                self._key_locks.pop(evicted, None)
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _load(self, key, stale=None, parsed=False, strict=False):
+        url, service_type, version = key
+
+        if stale is None and self.store is not None:
+            stale = self._read_store(key)
+            if self._usable(stale, parsed):
+                return stale
+
+        # A 304 is only useful if we already hold everything the caller
+        # asked for; a summary read from disk can't stand in for a full
+        # OWSLib object.
+        revalidate = stale is not None and \
+            (stale.service is not None or not parsed)
+        request_url = capabilities_url(service_type, url, version)
+        headers = stale.validators() if revalidate else {}
+
+        try:
+            status, body, info = self.fetch(request_url, headers)
+        except Exception, e:
+            if strict or not revalidate:
+                raise
+            # Keep serving the document we already have rather than failing
+            # a request because the upstream server hiccupped.
+            log.warning('Could not revalidate capabilities for %s: %s',
+                        url, e)
+            stale.expires = time.time() + self.ttl
+            return stale
+
+        if status == 304 and revalidate:
+            stale.expires = time.time() + self.ttl
+            self._touch_store(key)
+            return stale
+
+        if parsed or service_type not in SUMMARY_PARSERS:
+            service = SERVICE_PARSERS[service_type](url, version=version,
+                                                    xml=body)
+            summary = summarize(service)
+        else:
+            service = None
+            summary = SUMMARY_PARSERS[service_type](body, version)
+        entry = CapabilitiesEntry(service, Capabilities(summary),
+                                  etag=info.get('ETag'),
+                                  last_modified=info.get('Last-Modified'),
+                                  expires=time.time() + self.ttl)
+        self._write_store(key, entry)
+        return entry
+
+    # Disk access is an optimization only: any failure is logged and the
+    # request carries on as if there were no store.
+    def _read_store(self, key):
+        try:
+            record = self.store.get(key)
+        except Exception, e:
+            log.warning('Could not read capabilities store: %s', e)
+            return None
+        if record is None:
+            return None
+        return CapabilitiesEntry(None, Capabilities(record['summary']),
+                                 etag=record['etag'],
+                                 last_modified=record['last_modified'],
+                                 expires=record['fetched'] + self.ttl)
+
+    def _write_store(self, key, entry):
+        if self.store is None:
+            return
+        try:
+            self.store.put(key, entry.summary.data, entry.etag,
+                           entry.last_modified)
+        except Exception, e:
+            log.warning('Could not write capabilities store: %s', e)
+
+    def _touch_store(self, key):
+        if self.store is None:
+            return
+        try:
+            self.store.touch(key)
+        except Exception, e:
+            log.warning('Could not write capabilities store: %s', e)
+
+# The cache is shared by every HandleWMS/HandleWFS object in the process.
+capabilities_cache = CapabilitiesCache()
+
+def configure(ttl=None, max_size=None, store_path=None):
+    """
+    Apply settings from the CKAN config file to the shared cache.
+
+    @param ttl: seconds a capabilities document is served without revalidation
+    @param max_size: maximum number of capabilities documents held in memory
+    @param store_path: sqlite file to persist capability summaries in
+    @return: nothing
+    """
+    if ttl is not None:
+        capabilities_cache.ttl = int(ttl)
+    if max_size is not None:
+        capabilities_cache.max_size = int(max_size)
+    if store_path:
+        capabilities_cache.store = store.CapabilitiesStore(store_path)
+
+def detect_service_type(url, format=None, protocol=None):
+    """
+    Guess whether a resource points at a WMS or a WFS from its format, its
+    protocol or, failing both, its URL.
+
+    @param url: resource URL
+    @param format: resource format
+    @param protocol: resource protocol, as set on NGDS resources
+    @return: 'WMS', 'WFS' or None
+    """
+    for hint in (protocol, format):
+        hint = (hint or '').upper()
+        for service_type in ('WMS', 'WFS'):
+            if service_type in hint:
+                return service_type
+
+    url = (url or '').upper()
+    for service_type in ('WMS', 'WFS'):
+        if 'SERVICE=' + service_type in url or service_type + 'SERVER' in url:
+            return service_type
+    return None
+
+def get_summary(service_type, url, version):
+    return capabilities_cache.get(service_type, url, version).summary
+
+def get_service(service_type, url, version):
+    return capabilities_cache.get(service_type, url, version, parsed=True).service
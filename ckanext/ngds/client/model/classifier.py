@@ -0,0 +1,236 @@
+import csv
+import logging
+import math
+import os
+import random
+import re
+import time
+
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+# keywords.csv ships at the top of the source tree, so it is only there when
+# the extension runs from a checkout, e.g. after 'setup.py develop'.
+DEFAULT_KEYWORDS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', '..', '..', 'keywords.csv')
+
+TOKEN = re.compile(r'[a-z0-9]+')
+
+# Matches in the title and tags say more about a dataset than matches in
+# its description.
+FIELD_WEIGHTS = (('title', 3.0), ('tags', 2.0), ('notes', 1.0))
+
+def tokenize(text):
+    return TOKEN.findall(text.lower()) if text else []
+
+def load_keywords(path=DEFAULT_KEYWORDS):
+    """
+    Read the content model keyword list.
+
+    @param path: CSV file with a 'Content Models' column and a 'Keywords'
+                 column of pipe-delimited keywords
+    @return: list of (content model, [keyword, ...]) tuples
+    """
+    with open(path, 'rb') as f:
+        rows = csv.reader(f)
+        rows.next()
+        return [(row[0].strip(), [k.strip() for k in row[1].split('|')
+                                  if k.strip()])
+                for row in rows if len(row) >= 2 and row[0].strip()]
+
+class ContentModelClassifier(object):
+    """
+    Scores text against every USGIN content model at once.  All keywords are
+    compiled into one Aho-Corasick automaton over normalized tokens, so a
+    dataset is classified in a single pass over its tokens however many
+    keywords and content models there are.  Each distinct keyword a dataset
+    mentions adds its inverse document frequency (keywords shared by many
+    content models, like 'geothermal', count for little) times the weight of
+    the field it was found in to the score of every content model it belongs
+    to.
+    """
+
+    def __init__(self, keywords, min_score=4.0, max_models=3):
+        self.models = [model for model, _ in keywords]
+        self.min_score = min_score
+        self.max_models = max_models
+
+        phrases = {}
+        for index, (model, words) in enumerate(keywords):
+            for word in words:
+                phrase = tuple(tokenize(word))
+                if phrase:
+                    phrases.setdefault(phrase, set()).add(index)
+
+        # Trie of phrases: 'goto' holds one dict of token -> state per state,
+        # 'output' the phrases that end in each state.
+        self.goto = [{}]
+        self.output = [[]]
+        self.phrases = []
+        for phrase, models in sorted(phrases.items()):
+            state = 0
+            for token in phrase:
+                following = self.goto[state].get(token)
+                if following is None:
+                    following = len(self.goto)
+                    self.goto[state][token] = following
+                    self.goto.append({})
+                    self.output.append([])
+                state = following
+            idf = math.log(1.0 + float(len(self.models)) / len(models))
+            self.output[state].append(len(self.phrases))
+            self.phrases.append((phrase, tuple(sorted(models)), idf))
+
+        # Failure links, breadth first, merging outputs along the way so
+        # that every match is reported from the state it ends in.
+        self.fail = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, following in self.goto[state].iteritems():
+                queue.append(following)
+                fallback = self.fail[state]
+                while fallback and token not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(token, 0)
+                self.fail[following] = target if target != following else 0
+                self.output[following] = self.output[following] + \
+                    self.output[self.fail[following]]
+
+    @classmethod
+    def from_csv(cls, path=DEFAULT_KEYWORDS, **kwargs):
+        return cls(load_keywords(path), **kwargs)
+
+    def matches(self, tokens):
+        """
+        @param tokens: list of normalized tokens
+        @return: set of indexes of the phrases found in the tokens
+        """
+        goto, fail, output = self.goto, self.fail, self.output
+        found = set()
+        state = 0
+        for token in tokens:
+            while state and token not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(token, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
+
+    def score(self, package):
+        """
+        Score a dataset against every content model.
+
+        @param package: dictionary with 'title', 'notes' and 'tags', where
+                        tags are strings or dictionaries with a 'name'
+        @return: dictionary of content model names and scores, only for
+                 content models with at least one matching keyword
+        """
+        best = {}
+        for field, weight in FIELD_WEIGHTS:
+            value = package.get(field)
+            if field == 'tags':
+                # Match every tag on its own, so phrases can't span tags
+                value = [tag.get('name', '') if isinstance(tag, dict) else tag
+                         for tag in value or []]
+                found = set()
+                for tag in value:
+                    found.update(self.matches(tokenize(tag)))
+            else:
+                found = self.matches(tokenize(value))
+            for phrase in found:
+                if best.get(phrase, 0) < weight:
+                    best[phrase] = weight
+
+        scores = {}
+        for phrase, weight in best.iteritems():
+            tokens, models, idf = self.phrases[phrase]
+            for model in models:
+                scores[model] = scores.get(model, 0.0) + idf * weight
+        return dict((self.models[model], score)
+                    for model, score in scores.iteritems())
+
+    def classify(self, package):
+        """
+        @param package: dictionary with 'title', 'notes' and 'tags'
+        @return: names of the best matching content models, best first
+        """
+        scores = [(score, model) for model, score in
+                  self.score(package).iteritems() if score >= self.min_score]
+        scores.sort(key=lambda item: (-item[0], item[1]))
+        return [model for score, model in scores[:self.max_models]]
+
+    def classify_many(self, packages):
+        """
+        Classify a stream of datasets, e.g. while bulk indexing.
+
+        @param packages: iterable of dictionaries
+        @return: iterator of (package, content models) tuples
+        """
+        for package in packages:
+            yield package, self.classify(package)
+
+def synthetic_catalog(classifier, count, seed=0):
+    """
+    Generate datasets with realistic amounts of text, mixing content model
+    keywords with filler words, for benchmarking.
+
+    @param classifier: ContentModelClassifier whose keywords to use
+    @param count: number of datasets
+    @param seed: seed for the random generator
+    @return: iterator of dictionaries with 'title', 'notes' and 'tags'
+    """
+    rng = random.Random(seed)
+    keywords = [' '.join(tokens) for tokens, _, _ in classifier.phrases]
+    filler = ['data', 'county', 'report', 'survey', 'map', 'nevada', 'utah',
+              'sample', 'table', 'location', 'measured', 'results', 'study']
+
+    def words(count):
+        return ' '.join(rng.choice(keywords) if rng.random() < 0.2
+                        else rng.choice(filler) for _ in xrange(count))
+
+    for _ in xrange(count):
+        yield {'title': words(8),
+               'notes': words(120),
+               'tags': [rng.choice(keywords) for _ in xrange(5)]}
+
+def benchmark(classifier, count=20000, seed=0):
+    """
+    Classify a synthetic catalog and measure the throughput.
+
+    @param classifier: ContentModelClassifier
+    @param count: number of datasets
+    @param seed: seed for the synthetic catalog
+    @return: (datasets per second, number of datasets given a content model)
+    """
+    packages = list(synthetic_catalog(classifier, count, seed))
+    started = time.time()
+    classified = 0
+    for package, models in classifier.classify_many(packages):
+        if models:
+            classified += 1
+    elapsed = max(time.time() - started, 1e-6)
+    return count / elapsed, classified
+
+# The classifier is shared by every indexing call in the process; it is
+# compiled when the plugin is configured.
+content_model_classifier = None
+
+def configure(path=None):
+    """
+    Compile the shared classifier from a keyword list.
+
+    @param path: CSV file of content models and keywords, defaults to the
+                 keywords.csv at the top of the source tree; without either
+                 the classifier is disabled
+    @return: nothing
+    """
+    global content_model_classifier
+    if not path and not os.path.isfile(DEFAULT_KEYWORDS):
+        log.warning('%s not found and ngds.content_model_keywords not set; '
+                    'content models are not filled in' % DEFAULT_KEYWORDS)
+        content_model_classifier = None
+        return
+    content_model_classifier = ContentModelClassifier.from_csv(
+        path or DEFAULT_KEYWORDS)
@@ -0,0 +1,181 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from collections import namedtuple
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+# facet-config.json ships at the top of the source tree, so it is only there
+# when the extension runs from a checkout, e.g. after 'setup.py develop'.
+DEFAULT_FACET_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    '..', '..', '..', '..', 'facet-config.json')
+
+# One node of the compiled facet tree.  'keyword' nodes count the datasets
+# matching 'query', 'dynamic_keywords' nodes list the values of 'field', and
+# 'title' nodes only group their children.
+FacetNode = namedtuple('FacetNode', ['name', 'display_name', 'type', 'field',
+                                     'query', 'children'])
+
+def solr_literal(value):
+    return '"%s"' % unicode(value).replace('\\', '\\\\').replace('"', '\\"')
+
+def compile_node(config, field=None):
+    field = config.get('metadatafield', field)
+    name = config.get('facet') or config.get('display_name')
+    query = None
+    if config.get('type') == 'keyword' and field:
+        query = u'%s:%s' % (field, solr_literal(config.get('facet')))
+    children = tuple(compile_node(child, field)
+                     for child in config.get('subfacet', []))
+    return FacetNode(name, config.get('display_name') or name,
+                     config.get('type'), field, query, children)
+
+class FacetPlan(object):
+    """
+    The facet tree of facet-config.json, compiled once into the complete set
+    of 'facet.field' and 'facet.query' parameters it needs, so that the counts
+    for the whole tree come back from a single Solr request.  Keyword nodes
+    inherit the metadata field of their closest ancestor that names one.
+    """
+
+    def __init__(self, config):
+        self.tree = tuple(compile_node(node) for node in config)
+        fields, queries = [], []
+        for node in self.nodes():
+            if node.type == 'dynamic_keywords' and node.field and \
+                    node.field not in fields:
+                fields.append(node.field)
+            if node.query and node.query not in queries:
+                queries.append(node.query)
+        self.facet_fields = tuple(fields)
+        self.facet_queries = tuple(queries)
+
+    @classmethod
+    def from_json(cls, path=DEFAULT_FACET_CONFIG):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def nodes(self, nodes=None):
+        for node in self.tree if nodes is None else nodes:
+            yield node
+            for child in self.nodes(node.children):
+                yield child
+
+    def search_params(self, q='*:*', fq='', limit=50):
+        """
+        @param q: Solr query
+        @param fq: Solr filter query
+        @param limit: number of values to list for each dynamic facet
+        @return: dictionary of Solr parameters that count the whole tree
+        """
+        return {'q': q or '*:*', 'fq': fq, 'rows': 0, 'wt': 'json',
+                'facet': 'true', 'facet.mincount': 1, 'facet.limit': limit,
+                'facet.field': list(self.facet_fields),
+                'facet.query': list(self.facet_queries)}
+
+    def apply(self, facet_counts, nodes=None):
+        """
+        Map Solr's facet counts back onto the tree.
+
+        @param facet_counts: 'facet_counts' member of a Solr JSON response
+        @return: list of dictionaries with 'name', 'display_name', 'type',
+                 'field', 'children' and, for keyword nodes, 'count', or, for
+                 dynamic nodes, 'items' of names and counts
+        """
+        queries = facet_counts.get('facet_queries', {})
+        fields = facet_counts.get('facet_fields', {})
+        result = []
+        for node in self.tree if nodes is None else nodes:
+            item = {'name': node.name, 'display_name': node.display_name,
+                    'type': node.type, 'field': node.field,
+                    'children': self.apply(facet_counts, node.children)}
+            if node.query:
+                item['count'] = queries.get(node.query, 0)
+            elif node.type == 'dynamic_keywords':
+                values = fields.get(node.field, [])
+                item['items'] = [{'name': values[i], 'count': values[i + 1]}
+                                 for i in range(0, len(values) - 1, 2)]
+            result.append(item)
+        return result
+
+class FacetCountCache(object):
+    """
+    Facet trees already counted, by query signature, for 'ttl' seconds.
+    """
+
+    def __init__(self, ttl=60, max_size=256):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[1] <= time.time():
+                return None
+            self._entries[key] = entry
+            return entry[0]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, time.time() + self.ttl)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+def count_facets(plan, query, q='*:*', fq='', limit=50, cache=None):
+    """
+    Count the whole facet tree for a search with one Solr request.
+
+    @param plan: FacetPlan
+    @param query: function that sends a dictionary of parameters to Solr and
+                  returns the decoded JSON response
+    @param q: Solr query
+    @param fq: Solr filter query
+    @param limit: number of values to list for each dynamic facet
+    @param cache: optional FacetCountCache
+    @return: facet tree, see 'FacetPlan.apply'
+    """
+    key = (q, fq, limit)
+    tree = cache.get(key) if cache is not None else None
+    if tree is None:
+        response = query(plan.search_params(q, fq, limit))
+        tree = plan.apply(response.get('facet_counts', {}))
+        if cache is not None:
+            cache.put(key, tree)
+    return tree
+
+# The plan and the counts are shared by every search in the process; the plan
+# is compiled when the plugin is configured.
+facet_plan = None
+facet_cache = FacetCountCache()
+
+def configure(path=None, ttl=None):
+    """
+    Compile the shared facet plan.
+
+    @param path: facet configuration file, defaults to the facet-config.json
+                 at the top of the source tree; without either the
+                 'ngds_facets' action is disabled
+    @param ttl: seconds to reuse the counts of a search
+    @return: nothing
+    """
+    global facet_plan
+    if not path and not os.path.isfile(DEFAULT_FACET_CONFIG):
+        log.warning('%s not found and ngds.facet_config not set; facet '
+                    'counts are disabled' % DEFAULT_FACET_CONFIG)
+        facet_plan = None
+    else:
+        facet_plan = FacetPlan.from_json(path or DEFAULT_FACET_CONFIG)
+    facet_cache.clear()
+    if ttl is not None:
+        facet_cache.ttl = float(ttl)
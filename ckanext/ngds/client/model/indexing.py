@@ -0,0 +1,312 @@
+import base64
+import json
+import logging
+import os
+import tempfile
+import time
+import urllib2
+
+from ckanext.ngds.client.model import classifier
+from ckanext.ngds.client.model import spatial
+
+log = logging.getLogger(__name__)
+
+# Whether datasets without an extent in their metadata get the extent of their
+# WMS/WFS layers when they are indexed.  Off by default: looking them up can
+# mean a GetCapabilities request per resource in the middle of indexing.
+service_extents = False
+
+# Agent fields of the USGIN metadata in the 'md_package' extra that each
+# facet field is filled from, and the core field used when there are none.
+AGENT_FIELDS = (('author_string', 'author', 'citedSourceAgents'),
+                ('maintainer_string', 'maintainer', 'resourceContacts'))
+
+def _agent_name(agent):
+    role = agent.get('agentRole', agent) if isinstance(agent, dict) else None
+    if not isinstance(role, dict):
+        return None
+    individual = role.get('individual') or {}
+    for name in (individual.get('personName'), role.get('organizationName'),
+                 individual.get('organizationName')):
+        if isinstance(name, basestring) and name.strip():
+            return name.strip()
+    return None
+
+def agent_names(pkg_dict, field, md_field):
+    """
+    @param pkg_dict: dataset dictionary, as given to 'before_index'
+    @param field: core dataset field to fall back on, e.g. 'author'
+    @param md_field: list of agents in the USGIN metadata
+    @return: list of distinct names, in the order they are listed
+    """
+    md_package = spatial.extra_value(pkg_dict, 'md_package')
+    agents = []
+    if isinstance(md_package, dict):
+        description = md_package.get('resourceDescription') or {}
+        agents = description.get(md_field) or []
+    names = []
+    for name in filter(None, [_agent_name(agent) for agent in agents]) or \
+            [pkg_dict.get(field)]:
+        if isinstance(name, basestring) and name.strip() and \
+                name.strip() not in names:
+            names.append(name.strip())
+    return names
+
+def dataset_bbox(pkg_dict):
+    """
+    Find the extent of a dataset: the one in its metadata or, failing that,
+    the union of the extents of its WMS/WFS layers.
+
+    @param pkg_dict: dataset dictionary, as given to 'before_index'
+    @return: (minx, miny, maxx, maxy) in WGS84, or None
+    """
+    bbox = spatial.metadata_bbox(pkg_dict)
+    if bbox is not None or not service_extents:
+        return bbox
+
+    from ckanext.ngds.client.model import ogc
+    # 'before_index' only has the resources in the JSON of 'data_dict'
+    data_dict = pkg_dict.get('data_dict')
+    try:
+        resources = json.loads(data_dict).get('resources') if data_dict \
+            else pkg_dict.get('resources')
+    except ValueError:
+        resources = None
+    for resource in resources or []:
+        try:
+            bbox = spatial.union_bbox(bbox, ogc.resource_bbox(resource))
+        except Exception, e:
+            log.warning('No extent for resource %s: %s'
+                        % (resource.get('id'), e))
+    return spatial.normalize_bbox(bbox) if bbox else None
+
+def ngds_fields(pkg_dict):
+    """
+    Compute the NGDS-specific search index fields of a dataset.  Fields the
+    dataset already declares are left alone.
+
+    @param pkg_dict: dataset dictionary, as given to 'before_index'
+    @return: dictionary of 'res_content_model', 'author_string',
+             'maintainer_string' and the spatial fields, as far as they apply
+    """
+    fields = {}
+    if not pkg_dict.get('res_content_model') and \
+            classifier.content_model_classifier is not None:
+        fields['res_content_model'] = \
+            classifier.content_model_classifier.classify(pkg_dict)
+    for index_field, field, md_field in AGENT_FIELDS:
+        if not pkg_dict.get(index_field):
+            names = agent_names(pkg_dict, field, md_field)
+            if names:
+                fields[index_field] = names
+    bbox = dataset_bbox(pkg_dict)
+    if bbox is not None:
+        fields.update(spatial.index_fields(bbox))
+    return fields
+
+def configure(services=None):
+    """
+    @param services: whether to look up the extents of WMS/WFS layers for
+                     datasets whose metadata has none
+    @return: nothing
+    """
+    global service_extents
+    if services is not None:
+        service_extents = bool(services)
+
+class Checkpoint(object):
+    """
+    Progress of a bulk rebuild, kept in a small JSON file: the id of the last
+    package posted to Solr, and how many have been posted so far.  Packages
+    are rebuilt in id order, so a rebuild that was interrupted can carry on
+    after that id.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self):
+        """
+        @return: dictionary with 'last_id' and 'indexed', or None
+        """
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def write(self, last_id, indexed):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        handle, temp = tempfile.mkstemp(dir=directory or None,
+                                        prefix='.checkpoint')
+        with os.fdopen(handle, 'w') as f:
+            json.dump({'last_id': last_id, 'indexed': indexed,
+                       'written': time.time()}, f)
+        os.rename(temp, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def package_batches(session, package_class, batch_size=500, after=None):
+    """
+    Page through the ids of the active packages in id order.  Each page
+    starts after the last id of the one before, so every page is a single
+    index range scan however deep into the table it is.
+
+    @param session: SQLAlchemy session
+    @param package_class: the CKAN Package model class
+    @param batch_size: number of ids per batch
+    @param after: id to start after, e.g. from a checkpoint
+    @return: iterator of lists of package ids
+    """
+    while True:
+        query = session.query(package_class.id)\
+            .filter(package_class.state == 'active')
+        if after is not None:
+            query = query.filter(package_class.id > after)
+        ids = [row[0] for row in
+               query.order_by(package_class.id).limit(batch_size)]
+        if not ids:
+            return
+        yield ids
+        after = ids[-1]
+
+class BufferedConnection(object):
+    """
+    Stand-in for a Solr connection that keeps the documents CKAN sends it, so
+    that they can be posted to Solr in bulk instead of one at a time.  Offers
+    both the solrpy ('add_many') and pysolr ('add') methods CKAN has used.
+    """
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def add_many(self, docs, _commit=False):
+        self.docs.extend(docs)
+
+    def add(self, docs, commit=False, **kwargs):
+        self.docs.extend(docs)
+
+    def commit(self, *args, **kwargs):
+        pass
+
+    def close(self):
+        pass
+
+def index_documents(ids):
+    """
+    Build the complete Solr documents for a batch of packages, the same ones
+    CKAN's own indexing would post, including the fields every plugin adds
+    in 'before_index'.  Runs in the worker processes of a bulk rebuild.
+
+    @param ids: list of package ids
+    @return: (last id, list of documents, list of (id, error) tuples)
+    """
+    import ckan.model as model
+    import ckan.logic as logic
+    import ckan.lib.search.index as search_index
+
+    docs, errors = [], []
+    # CKAN's indexer sends each document to the connection it makes itself,
+    # so point it at a buffer for the duration of the batch.  The worker
+    # process does nothing else, so no other caller sees the swap.
+    connection = BufferedConnection(docs)
+    make_connection = search_index.make_connection
+    search_index.make_connection = lambda *args, **kwargs: connection
+    try:
+        package_index = search_index.PackageSearchIndex()
+        for id in ids:
+            context = {'model': model, 'ignore_auth': True,
+                       'validate': False, 'use_cache': False}
+            try:
+                pkg_dict = logic.get_action('package_show')(context,
+                                                            {'id': id})
+                package_index.index_package(pkg_dict, defer_commit=True)
+            except Exception, e:
+                errors.append((id, str(e) or e.__class__.__name__))
+    finally:
+        search_index.make_connection = make_connection
+        model.Session.remove()
+    return ids[-1], docs, errors
+
+class SolrUpdater(object):
+    """
+    Posts documents to Solr's JSON update handler, many per request, and
+    commits once at the end.
+    """
+
+    def __init__(self, url, user=None, password=None, timeout=300):
+        self.url = url.rstrip('/') + '/update'
+        self.timeout = timeout
+        self.headers = {'Content-Type': 'application/json'}
+        if user and password:
+            self.headers['Authorization'] = 'Basic ' + base64.b64encode(
+                '%s:%s' % (user, password))
+
+    def _post(self, body, params='wt=json'):
+        request = urllib2.Request('%s?%s' % (self.url, params), body,
+                                  self.headers)
+        response = urllib2.urlopen(request, timeout=self.timeout)
+        try:
+            return response.read()
+        finally:
+            response.close()
+
+    def post(self, docs):
+        """
+        @param docs: list of Solr documents
+        @return: nothing
+        """
+        self._post(json.dumps(docs, default=unicode))
+
+    def commit(self):
+        self._post(json.dumps({'commit': {}}))
+
+def rebuild(batches, build, updater=None, checkpoint=None, indexed=0,
+            report=None):
+    """
+    Build and post the documents of every batch.  With a checkpoint, progress
+    is recorded after every batch that reached Solr; the single commit at the
+    end makes all of them searchable at once, and then the checkpoint is
+    removed.
+
+    @param batches: iterator of lists of package ids
+    @param build: function mapping an iterator of batches to an iterator of
+                  'index_documents' results, e.g. 'Pool.imap'
+    @param updater: SolrUpdater, or None for a dry run that only builds
+    @param checkpoint: optional Checkpoint
+    @param indexed: number of packages posted before resuming
+    @param report: optional function called with the statistics after
+                   every batch
+    @return: dictionary of 'packages', 'indexed', 'failed', 'bytes' and
+             'seconds'
+    """
+    stats = {'packages': 0, 'indexed': indexed, 'failed': 0, 'bytes': 0,
+             'seconds': 0.0}
+    started = time.time()
+    for last_id, docs, errors in build(batches):
+        for id, error in errors:
+            log.warning('Could not index package %s: %s' % (id, error))
+        if docs:
+            if updater is None:
+                stats['bytes'] += len(json.dumps(docs, default=unicode))
+            else:
+                updater.post(docs)
+                stats['indexed'] += len(docs)
+        if checkpoint is not None and updater is not None:
+            checkpoint.write(last_id, stats['indexed'])
+        stats['packages'] += len(docs) + len(errors)
+        stats['failed'] += len(errors)
+        stats['seconds'] = time.time() - started
+        if report is not None:
+            report(stats)
+
+    if updater is not None and stats['packages']:
+        updater.commit()
+    if checkpoint is not None and updater is not None:
+        checkpoint.clear()
+    stats['seconds'] = time.time() - started
+    return stats
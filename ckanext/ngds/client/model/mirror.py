@@ -0,0 +1,352 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+from ckanext.ngds.client.model import spatial
+from ckanext.ngds.client.model.capabilities import normalize_url
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS mirrored_layers (
+    url TEXT NOT NULL,
+    layer TEXT NOT NULL COLLATE NOCASE,
+    generation INTEGER,
+    token TEXT,
+    synced REAL,
+    count INTEGER,
+    PRIMARY KEY (url, layer)
+);
+CREATE TABLE IF NOT EXISTS generations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT NOT NULL,
+    layer TEXT NOT NULL COLLATE NOCASE,
+    started REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS features (
+    id INTEGER PRIMARY KEY,
+    generation INTEGER NOT NULL,
+    feature BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS features_generation ON features (generation);
+CREATE VIRTUAL TABLE IF NOT EXISTS feature_index USING rtree (
+    id, minx, maxx, miny, maxy
+);
+"""
+
+# Features are written in transactions of this many, so that a long sync never
+# holds the write lock for more than a moment at a time.
+INSERT_BATCH = 1000
+
+def _number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, long, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _like(pattern):
+    # The wildcards 'encode_filter' declares: '*', '.' and '!' to escape
+    regex = []
+    escaped = False
+    for char in pattern:
+        if escaped:
+            regex.append(re.escape(char))
+            escaped = False
+        elif char == '!':
+            escaped = True
+        elif char == '*':
+            regex.append('.*')
+        elif char == '.':
+            regex.append('.')
+        else:
+            regex.append(re.escape(char))
+    return re.compile(''.join(regex) + r'\Z', re.DOTALL)
+
+def match_filter(properties, filter):
+    """
+    Evaluate an attribute filter, in the form 'ogc.encode_filter' sends to WFS
+    servers, against the properties of one feature.  Values are compared as
+    numbers when both sides are numeric and as text otherwise.
+
+    @param properties: feature properties dictionary
+    @param filter: dictionary of property names and values, or list of
+                   (property, operator, value) tuples
+    @return: True if every condition holds
+    """
+    if isinstance(filter, dict):
+        filter = [(key, '=', value) for (key, value) in filter.items()]
+    for name, operator, expected in filter or []:
+        value = properties.get(name)
+        if value is None:
+            return False
+        operator = operator.lower()
+        if operator == 'like':
+            if not _like(unicode(expected)).match(unicode(value)):
+                return False
+            continue
+        a, b = _number(value), _number(expected)
+        if a is None or b is None:
+            a, b = unicode(value), unicode(expected)
+        if not {'=': a == b, '!=': a != b, '<': a < b, '<=': a <= b,
+                '>': a > b, '>=': a >= b}[operator]:
+            return False
+    return True
+
+class FeatureMirror(object):
+    """
+    Local copy of selected WFS layers, so that the layers every map and
+    preview asks for are served from disk instead of from their upstream
+    servers.  Features are kept zlib-compressed in a sqlite database, in WAL
+    mode so that every worker process can read it while a sync writes, with
+    an R-tree of their bounding boxes for bbox queries.
+
+    Each sync of a layer writes a new generation of its features next to the
+    one being served, and only switches over once it is complete, so readers
+    never see a half-synced layer and a failed sync leaves the old copy in
+    place.
+    """
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        conn = self._connection()
+        with conn:
+            conn.executescript(SCHEMA)
+
+    def _connection(self):
+        # sqlite connections can neither be shared between threads nor
+        # survive a fork, so keep one per thread and per process.
+        conn = getattr(self._local, 'connection', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def add(self, url, layer):
+        """
+        Select a layer for mirroring.  It is served from upstream until its
+        first sync.
+
+        @param url: WFS service URL
+        @param layer: feature type name
+        @return: nothing
+        """
+        conn = self._connection()
+        with conn:
+            conn.execute('INSERT OR IGNORE INTO mirrored_layers (url, layer) '
+                         'VALUES (?, ?)', (normalize_url(url), layer))
+
+    def remove(self, url, layer):
+        """
+        Stop mirroring a layer and delete its features.
+        """
+        key = (normalize_url(url), layer)
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM mirrored_layers '
+                         'WHERE url = ? AND layer = ?', key)
+            self._delete_generations(conn, key)
+
+    def layers(self):
+        """
+        @return: list of dictionaries with the 'url', 'layer', 'token',
+                 'synced' and 'count' of every mirrored layer; 'synced' is
+                 None for layers that haven't been synced yet
+        """
+        keys = ('url', 'layer', 'token', 'synced', 'count')
+        return [dict(zip(keys, row)) for row in self._connection().execute(
+            'SELECT url, layer, token, synced, count FROM mirrored_layers '
+            'ORDER BY url, layer')]
+
+    def get(self, url, layer):
+        """
+        @return: dictionary with the layer's 'token', 'synced' and 'count',
+                 or None if the layer isn't mirrored
+        """
+        row = self._connection().execute(
+            'SELECT token, synced, count FROM mirrored_layers '
+            'WHERE url = ? AND layer = ?', (normalize_url(url), layer)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('token', 'synced', 'count'), row))
+
+    def is_stale(self, url, layer, token=None, max_age=None):
+        """
+        @param token: current version of the layer upstream, see
+                      'HandleWFS.get_layer_token'
+        @param max_age: seconds after which a layer is synced again even if
+                        its token hasn't changed
+        @return: whether a mirrored layer needs syncing
+        """
+        record = self.get(url, layer)
+        if record is None:
+            return False
+        if record['synced'] is None or record['token'] != token:
+            return True
+        return bool(max_age) and time.time() - record['synced'] > max_age
+
+    def sync(self, url, layer, features, token=None):
+        """
+        Replace the mirrored features of a layer.
+
+        @param url: WFS service URL
+        @param layer: feature type name
+        @param features: iterable of GeoJSON feature dictionaries in WGS84,
+                         which bbox queries are answered in, e.g. from
+                         'HandleWFS.iter_upstream'
+        @param token: version of the layer the features were read from
+        @return: number of features written
+        """
+        key = (normalize_url(url), layer)
+        conn = self._connection()
+        with conn:
+            generation = conn.execute(
+                'INSERT INTO generations (url, layer, started) '
+                'VALUES (?, ?, ?)', key + (time.time(),)).lastrowid
+
+        count = 0
+        try:
+            batch = []
+            for feature in features:
+                batch.append(feature)
+                if len(batch) >= INSERT_BATCH:
+                    self._insert(conn, generation, batch)
+                    count += len(batch)
+                    batch = []
+            self._insert(conn, generation, batch)
+            count += len(batch)
+
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO mirrored_layers '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    key + (generation, token, time.time(), count))
+                self._delete_generations(conn, key, keep=generation)
+        except Exception:
+            with conn:
+                self._delete_generation(conn, generation)
+            raise
+        return count
+
+    def _insert(self, conn, generation, features):
+        with conn:
+            for feature in features:
+                id = conn.execute(
+                    'INSERT INTO features (generation, feature) VALUES (?, ?)',
+                    (generation, sqlite3.Binary(zlib.compress(
+                        json.dumps(feature))))).lastrowid
+                bbox = spatial.geometry_bbox(feature.get('geometry'))
+                if bbox is not None:
+                    conn.execute('INSERT INTO feature_index '
+                                 'VALUES (?, ?, ?, ?, ?)',
+                                 (id, bbox[0], bbox[2], bbox[1], bbox[3]))
+
+    def _delete_generation(self, conn, generation):
+        conn.execute('DELETE FROM feature_index WHERE id IN '
+                     '(SELECT id FROM features WHERE generation = ?)',
+                     (generation,))
+        conn.execute('DELETE FROM features WHERE generation = ?',
+                     (generation,))
+        conn.execute('DELETE FROM generations WHERE id = ?', (generation,))
+
+    def _delete_generations(self, conn, key, keep=None):
+        for (generation,) in conn.execute(
+                'SELECT id FROM generations WHERE url = ? AND layer = ? '
+                'AND id IS NOT ?', key + (keep,)).fetchall():
+            self._delete_generation(conn, generation)
+
+    def query(self, url, layer, bbox=None, properties=None, filter=None,
+              max_features=None):
+        """
+        Read features of a mirrored layer, with the same subsetting a WFS
+        server would do for 'HandleWFS.iter_features'.
+
+        @param url: WFS service URL
+        @param layer: feature type name
+        @param bbox: WGS84 (minx, miny, maxx, maxy) the features' bounding
+                     boxes must intersect
+        @param properties: list of property names to keep
+        @param filter: attribute filter, see 'match_filter'
+        @param max_features: most features to return
+        @return: iterator of GeoJSON feature dictionaries, or None if the
+                 layer isn't mirrored or hasn't been synced yet
+        """
+        key = (normalize_url(url), layer)
+        if self._connection().execute(
+                'SELECT 1 FROM mirrored_layers WHERE url = ? AND layer = ? '
+                'AND generation IS NOT NULL', key).fetchone() is None:
+            return None
+        # The generation is looked up in the same statement as its features,
+        # so a sync that switches over mid-query can't pull them away.
+        if bbox:
+            minx, miny, maxx, maxy = [float(x) for x in bbox]
+            rows = self._connection().execute(
+                'SELECT f.feature FROM mirrored_layers l '
+                'JOIN features f ON f.generation = l.generation '
+                'JOIN feature_index i ON i.id = f.id '
+                'WHERE l.url = ? AND l.layer = ? AND i.minx <= ? '
+                'AND i.maxx >= ? AND i.miny <= ? AND i.maxy >= ? '
+                'ORDER BY f.id', key + (maxx, minx, maxy, miny))
+        else:
+            rows = self._connection().execute(
+                'SELECT f.feature FROM mirrored_layers l '
+                'JOIN features f ON f.generation = l.generation '
+                'WHERE l.url = ? AND l.layer = ? ORDER BY f.id', key)
+        return self._read(rows, properties, filter, max_features)
+
+    def _read(self, rows, properties, filter, max_features):
+        found = 0
+        for (blob,) in rows:
+            feature = json.loads(zlib.decompress(blob))
+            if filter and not match_filter(feature.get('properties') or {},
+                                           filter):
+                continue
+            if properties:
+                feature['properties'] = dict(
+                    (name, value) for (name, value)
+                    in (feature.get('properties') or {}).items()
+                    if name in properties)
+            yield feature
+            found += 1
+            if max_features and found >= max_features:
+                return
+
+# The mirror is opt-in: None unless a database file is configured.
+feature_mirror = None
+
+# Seconds after which 'ngds-ogc mirror-refresh' syncs a layer again even if its
+# service's capabilities haven't changed.
+max_age = 86400
+
+def configure(path=None, age=None):
+    """
+    Apply settings from the CKAN config file to the shared feature mirror.
+
+    @param path: sqlite file mirrored features are stored in; disables the
+                 mirror if empty
+    @param age: seconds after which a mirrored layer is synced again
+    @return: nothing
+    """
+    global feature_mirror, max_age
+    feature_mirror = FeatureMirror(path) if path else None
+    if age is not None:
+        max_age = int(age)
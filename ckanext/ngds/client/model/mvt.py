@@ -0,0 +1,355 @@
+import json
+import struct
+
+# Mapbox Vector Tile 2.1 constants: geometry types, drawing commands and the
+# field numbers of the protobuf messages written below.
+POINT, LINESTRING, POLYGON = 1, 2, 3
+MOVE_TO, LINE_TO, CLOSE_PATH = 1, 2, 7
+
+CONTENT_TYPE = 'application/vnd.mapbox-vector-tile'
+
+# Most varints in a tile (tags, commands, small deltas) fit in one byte
+_BYTES = [chr(n) for n in xrange(128)]
+
+def _varint(n):
+    if n < 0x80:
+        return _BYTES[n]
+    out = []
+    while n > 0x7f:
+        out.append(chr((n & 0x7f) | 0x80))
+        n >>= 7
+    out.append(chr(n))
+    return ''.join(out)
+
+def _zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+def _field(number, data):
+    # Length-delimited field: strings, bytes, embedded messages, packed lists
+    return _varint(number << 3 | 2) + _varint(len(data)) + data
+
+def _uint_field(number, n):
+    return _varint(number << 3) + _varint(n)
+
+def _packed(number, values):
+    return _field(number, ''.join(_varint(v) for v in values))
+
+def _value(value):
+    # One Value message of a layer's value table
+    if isinstance(value, bool):
+        return _uint_field(7, int(value))
+    if isinstance(value, (int, long)):
+        if value < 0:
+            return _uint_field(6, _zigzag(value))
+        return _uint_field(5, value)
+    if isinstance(value, float):
+        return _varint(3 << 3 | 1) + struct.pack('<d', value)
+    if not isinstance(value, basestring):
+        value = json.dumps(value)
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return _field(1, value)
+
+def simplify(points, tolerance):
+    """
+    Douglas-Peucker simplification of a line, keeping its end points.
+
+    @param points: list of (x, y)
+    @param tolerance: largest distance a dropped point may be from the line
+    @return: list of (x, y)
+    """
+    if tolerance <= 0 or len(points) < 3:
+        return points
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    squared = tolerance * tolerance
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (ax, ay), (bx, by) = points[first], points[last]
+        dx, dy = bx - ax, by - ay
+        length = dx * dx + dy * dy
+        worst, index = 0, None
+        for i in xrange(first + 1, last):
+            px, py = points[i]
+            if length:
+                t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) /
+                                 length))
+                ex, ey = ax + t * dx - px, ay + t * dy - py
+            else:
+                ex, ey = ax - px, ay - py
+            distance = ex * ex + ey * ey
+            if distance > worst:
+                worst, index = distance, i
+        if index is not None and worst > squared:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+def clip_line(points, lo, hi):
+    """
+    Clip a line to a square, with Liang-Barsky clipping of each segment.
+
+    @param points: list of (x, y)
+    @param lo: lowest x and y inside the square
+    @param hi: highest x and y inside the square
+    @return: list of the lines, lists of (x, y), inside the square
+    """
+    parts = []
+    current = []
+    for (ax, ay), (bx, by) in zip(points, points[1:]):
+        dx, dy = bx - ax, by - ay
+        t0, t1 = 0.0, 1.0
+        for p, q in ((-dx, ax - lo), (dx, hi - ax),
+                     (-dy, ay - lo), (dy, hi - ay)):
+            if p == 0:
+                if q < 0:
+                    t0, t1 = 1.0, 0.0
+                    break
+            else:
+                t = q / float(p)
+                if p < 0:
+                    t0 = max(t0, t)
+                else:
+                    t1 = min(t1, t)
+        if t0 > t1:
+            if current:
+                parts.append(current)
+                current = []
+            continue
+        start = (ax + t0 * dx, ay + t0 * dy)
+        end = (ax + t1 * dx, ay + t1 * dy)
+        if not current or t0 > 0:
+            if current:
+                parts.append(current)
+            current = [start]
+        current.append(end)
+        if t1 < 1:
+            parts.append(current)
+            current = []
+    if current:
+        parts.append(current)
+    return parts
+
+def clip_ring(ring, lo, hi):
+    """
+    Clip a polygon ring to a square, Sutherland-Hodgman style.  Parts of the
+    ring outside the square are replaced by stretches along its edges.
+
+    @param ring: list of (x, y), without repeating the first point at the end
+    @param lo: lowest x and y inside the square
+    @param hi: highest x and y inside the square
+    @return: list of (x, y)
+    """
+    for axis, bound, inside in ((0, lo, lambda v: v >= lo),
+                                (0, hi, lambda v: v <= hi),
+                                (1, lo, lambda v: v >= lo),
+                                (1, hi, lambda v: v <= hi)):
+        if not ring:
+            break
+        clipped = []
+        previous = ring[-1]
+        for point in ring:
+            if inside(point[axis]) != inside(previous[axis]):
+                t = (bound - previous[axis]) / float(point[axis] -
+                                                     previous[axis])
+                crossing = [previous[0] + t * (point[0] - previous[0]),
+                            previous[1] + t * (point[1] - previous[1])]
+                crossing[axis] = bound
+                clipped.append(tuple(crossing))
+            if inside(point[axis]):
+                clipped.append(point)
+            previous = point
+        ring = clipped
+    return ring
+
+def _quantize(points):
+    # Round to the tile's integer grid, dropping repeated points
+    out = []
+    for x, y in points:
+        point = (int(round(x)), int(round(y)))
+        if not out or out[-1] != point:
+            out.append(point)
+    return out
+
+def _ring_area(ring):
+    return sum(ax * by - bx * ay for (ax, ay), (bx, by)
+               in zip(ring, ring[1:] + ring[:1]))
+
+class TileEncoder(object):
+    """
+    Build one layer of a Mapbox Vector Tile from GeoJSON features.  Features
+    are projected into the tile's integer grid of 'extent' units, clipped to
+    the tile plus a 'buffer' on every side so that lines and polygon edges
+    run on seamlessly into the next tile, and simplified with a tolerance of
+    'tolerance' units.  Points are thinned to one per 'point_cell' units, so
+    that tiles of dense point layers stay small at low zoom levels while
+    looking the same.
+    """
+
+    def __init__(self, name, project, extent=4096, buffer=64, tolerance=4,
+                 point_cell=16):
+        """
+        @param name: layer name
+        @param project: function mapping WGS84 (lon, lat) to floating point
+                        tile coordinates, with y increasing downwards
+        """
+        self.name = name
+        self.project = project
+        self.extent = extent
+        self.buffer = buffer
+        self.tolerance = tolerance
+        self.point_cell = point_cell
+        self.features = []
+        self.keys = {}
+        self.values = {}
+        self._value_list = []
+        self._cells = set()
+
+    def __len__(self):
+        return len(self.features)
+
+    def _points(self, coordinates):
+        return [self.project(c[0], c[1]) for c in coordinates
+                if isinstance(c, (list, tuple)) and len(c) >= 2]
+
+    def _geometry(self, geometry):
+        # Returns (geometry type, list of parts) in tile coordinates
+        kind = geometry.get('type')
+        coordinates = geometry.get('coordinates') or []
+        lo, hi = -self.buffer, self.extent + self.buffer
+        if kind in ('Point', 'MultiPoint'):
+            points = self._points([coordinates] if kind == 'Point'
+                                  else coordinates)
+            kept = []
+            for point in _quantize(points):
+                if not (lo <= point[0] <= hi and lo <= point[1] <= hi):
+                    continue
+                cell = (point[0] // self.point_cell,
+                        point[1] // self.point_cell)
+                if cell not in self._cells:
+                    self._cells.add(cell)
+                    kept.append(point)
+            return POINT, [kept] if kept else []
+        if kind in ('LineString', 'MultiLineString'):
+            lines = [coordinates] if kind == 'LineString' else coordinates
+            parts = []
+            for line in lines:
+                for part in clip_line(self._points(line), lo, hi):
+                    part = _quantize(simplify(part, self.tolerance))
+                    if len(part) >= 2:
+                        parts.append(part)
+            return LINESTRING, parts
+        if kind in ('Polygon', 'MultiPolygon'):
+            polygons = [coordinates] if kind == 'Polygon' else coordinates
+            rings = []
+            for polygon in polygons:
+                for i, ring in enumerate(polygon):
+                    points = self._points(ring)
+                    if len(points) > 1 and points[0] == points[-1]:
+                        points = points[:-1]
+                    points = clip_ring(points, lo, hi)
+                    points = _quantize(simplify(points + points[:1],
+                                                self.tolerance))[:-1]
+                    area = _ring_area(points) if len(points) >= 3 else 0
+                    if not area:
+                        if i == 0:
+                            break
+                        continue
+                    # Exterior rings wind clockwise on screen, holes the
+                    # other way round.
+                    if (area > 0) != (i == 0):
+                        points.reverse()
+                    rings.append(points)
+            return POLYGON, rings
+        if kind == 'GeometryCollection':
+            for part in geometry.get('geometries') or []:
+                found = self._geometry(part)
+                if found[1]:
+                    return found
+        return None, []
+
+    def _commands(self, kind, parts):
+        commands = []
+        x = y = 0
+        for part in parts:
+            if kind == POINT:
+                commands.append(MOVE_TO | len(part) << 3)
+            for i, (px, py) in enumerate(part):
+                if kind != POINT and i < 2:
+                    commands.append(MOVE_TO | 1 << 3 if i == 0
+                                    else LINE_TO | (len(part) - 1) << 3)
+                commands.append(_zigzag(px - x))
+                commands.append(_zigzag(py - y))
+                x, y = px, py
+            if kind == POLYGON:
+                commands.append(CLOSE_PATH | 1 << 3)
+        return commands
+
+    def _key(self, key):
+        index = self.keys.get(key)
+        if index is None:
+            index = self.keys[key] = len(self.keys)
+        return index
+
+    def _value(self, value):
+        # Keep 1, True and 1.0 apart in the value table
+        token = (type(value), value)
+        try:
+            hash(token)
+        except TypeError:
+            token = (type(value), json.dumps(value, sort_keys=True))
+        index = self.values.get(token)
+        if index is None:
+            index = self.values[token] = len(self._value_list)
+            self._value_list.append(value)
+        return index
+
+    def add(self, feature):
+        """
+        @param feature: GeoJSON feature dictionary in WGS84
+        @return: whether anything of the feature falls into the tile
+        """
+        geometry = feature.get('geometry')
+        if not isinstance(geometry, dict):
+            return False
+        kind, parts = self._geometry(geometry)
+        if not parts:
+            return False
+
+        tags = []
+        for key, value in sorted((feature.get('properties') or {}).items()):
+            if value is None:
+                continue
+            tags.append(self._key(key))
+            tags.append(self._value(value))
+
+        message = []
+        id = feature.get('id')
+        if isinstance(id, (int, long)) and not isinstance(id, bool) and id >= 0:
+            message.append(_uint_field(1, id))
+        if tags:
+            message.append(_packed(2, tags))
+        message.append(_uint_field(3, kind))
+        message.append(_packed(4, self._commands(kind, parts)))
+        self.features.append(''.join(message))
+        return True
+
+    def encode(self):
+        """
+        @return: the layer as a complete vector tile, or an empty string if
+                 no feature falls into the tile
+        """
+        if not self.features:
+            return ''
+        name = self.name.encode('utf-8') if isinstance(self.name, unicode) \
+            else self.name
+        layer = [_uint_field(15, 2), _field(1, name)]
+        layer.extend(_field(2, feature) for feature in self.features)
+        for key, _ in sorted(self.keys.items(), key=lambda item: item[1]):
+            layer.append(_field(3, key.encode('utf-8')
+                                if isinstance(key, unicode) else key))
+        layer.extend(_field(4, _value(value)) for value in self._value_list)
+        layer.append(_uint_field(5, self.extent))
+        return _field(3, ''.join(layer))
@@ -1,6 +1,198 @@
-from owslib.wms import WebMapService
-from owslib.wfs import WebFeatureService
+import hashlib
+import json
+import logging
+import re
+import urllib
+import uuid
+
+from cStringIO import StringIO
+from itertools import chain, islice
+from xml.etree.cElementTree import iterparse
+from xml.sax.saxutils import escape, quoteattr
+
+from osgeo import gdal
 from osgeo import ogr
+from osgeo import osr
+from ckanext.ngds.client.model import capabilities
+from ckanext.ngds.client.model import mirror
+from ckanext.ngds.client.model import mvt
+from ckanext.ngds.client.model import recline
+from ckanext.ngds.client.model import tiles
+from ckanext.ngds.client.model import transport
+
+log = logging.getLogger(__name__)
+
+# WFS 1.0.0 qualifies operation and method names with the WFS namespace, while OWSLib reports them unqualified for
+# 1.1.0 and 2.0.0.  Strip the namespace so that lookups work for every version.
+def local_name(name):
+    return name.split('}', 1)[-1]
+
+# Comparison operators understood by 'encode_filter', and the OGC Filter element each one becomes
+FILTER_OPERATORS = {
+    '=': 'PropertyIsEqualTo',
+    '!=': 'PropertyIsNotEqualTo',
+    '<': 'PropertyIsLessThan',
+    '<=': 'PropertyIsLessThanOrEqualTo',
+    '>': 'PropertyIsGreaterThan',
+    '>=': 'PropertyIsGreaterThanOrEqualTo',
+    'like': 'PropertyIsLike'
+}
+
+# Encode a simple attribute filter, and optionally a bounding box, as an OGC Filter document for a getFeature request.
+# The filter is either a dictionary of property names and the values they must equal, or a list of (property,
+# operator, value) tuples using the operators in FILTER_OPERATORS; all conditions must hold.  WFS 2.0.0 gets a
+# Filter Encoding 2.0 document, older versions get Filter Encoding 1.1.
+def encode_filter(filter, version='1.0.0', bbox=None, geometry_name=None):
+    if isinstance(filter, dict):
+        filter = [(key, '=', value) for (key, value) in sorted(filter.items())]
+
+    if version == '2.0.0':
+        ns, prefix, gml, property_tag, escape_attr = \
+            'http://www.opengis.net/fes/2.0', 'fes', 'http://www.opengis.net/gml/3.2', 'ValueReference', 'escapeChar'
+    else:
+        ns, prefix, gml, property_tag, escape_attr = \
+            'http://www.opengis.net/ogc', 'ogc', 'http://www.opengis.net/gml', 'PropertyName', 'escape'
+
+    def tag(name, content, attributes=''):
+        return '<%s:%s%s>%s</%s:%s>' % (prefix, name, attributes, content, prefix, name)
+
+    conditions = []
+    for (name, operator, value) in filter or []:
+        element = FILTER_OPERATORS[operator.lower()]
+        attributes = ''
+        if element == 'PropertyIsLike':
+            attributes = ' wildCard="*" singleChar="." %s="!"' % escape_attr
+        conditions.append(tag(element, tag(property_tag, escape(name)) +
+                              tag('Literal', escape(unicode(value))), attributes))
+
+    if bbox:
+        minx, miny, maxx, maxy = [repr(float(x)) for x in bbox]
+        if version == '1.0.0':
+            box = '<gml:Box srsName="EPSG:4326"><gml:coordinates>%s,%s %s,%s</gml:coordinates></gml:Box>' % \
+                  (minx, miny, maxx, maxy)
+        else:
+            box = '<gml:Envelope srsName="EPSG:4326"><gml:lowerCorner>%s %s</gml:lowerCorner>' \
+                  '<gml:upperCorner>%s %s</gml:upperCorner></gml:Envelope>' % (minx, miny, maxx, maxy)
+        geometry = tag(property_tag, escape(geometry_name)) if geometry_name else ''
+        conditions.append(tag('BBOX', geometry + box))
+
+    if len(conditions) > 1:
+        body = tag('And', ''.join(conditions))
+    else:
+        body = ''.join(conditions)
+    return tag('Filter', body, ' xmlns:%s=%s xmlns:gml=%s' % (prefix, quoteattr(ns), quoteattr(gml)))
+
+# GetFeature output formats that are GeoJSON, lowercased, in order of preference.  GeoServer advertises
+# 'application/json' for WFS 1.1.0 and 2.0.0 and a JSON result format element for 1.0.0.
+GEOJSON_FORMATS = ('application/json', 'application/geo+json', 'application/vnd.geo+json', 'json', 'geojson')
+
+# The CRS every feature handed out by HandleWFS is in, whatever the native CRS of its layer.  Tiling, the feature
+# mirror and vector tiles all compare coordinates against WGS84 boxes.
+WGS84 = 'EPSG:4326'
+
+# Return the EPSG code of a CRS name in any of the forms WFS servers use: 'EPSG:26912', 'urn:ogc:def:crs:EPSG::26912'
+# or 'http://www.opengis.net/gml/srs/epsg.xml#26912'; 4326 for CRS84, None if there is no code.
+def epsg_code(name):
+    if not name:
+        return None
+    if name.upper().endswith('CRS84'):
+        return 4326
+    match = re.search(r'(\d+)\s*$', name)
+    return int(match.group(1)) if match else None
+
+# Return an OGR transformation from a spatial reference to WGS84 longitude/latitude, or None if the spatial reference
+# already is WGS84 or unknown
+def wgs84_transform(source):
+    if source is None:
+        return None
+    target = osr.SpatialReference()
+    target.ImportFromEPSG(4326)
+    for srs in (source, target):
+        # GDAL 3 would otherwise follow the latitude first axis order of EPSG:4326
+        if hasattr(srs, 'SetAxisMappingStrategy'):
+            srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    if source.IsSame(target):
+        return None
+    return osr.CoordinateTransformation(source, target)
+
+# Reproject the geometries of GeoJSON features from the CRS with an EPSG code to WGS84, in place, for servers that
+# ignore the srsName they were asked for
+def reproject_features(features, code):
+    source = osr.SpatialReference()
+    source.ImportFromEPSG(code)
+    transform = wgs84_transform(source)
+    if transform is None:
+        return features
+    for feature in features:
+        if feature.get('geometry'):
+            geometry = ogr.CreateGeometryFromJson(json.dumps(feature['geometry']))
+            geometry.Transform(transform)
+            feature['geometry'] = json.loads(geometry.ExportToJson())
+    return features
+
+# Most features read for one vector tile.  Mirrored layers are read from local disk; other layers are fetched from
+# their services while the map waits, so they get a much lower limit.  Tiles that hit it are marked as truncated.
+MIRROR_TILE_FEATURES = 50000
+UPSTREAM_TILE_FEATURES = 5000
+
+# Read the number of features from the response to a resultType=hits getFeature request.  Only the root element is
+# parsed: WFS 1.1.0 reports 'numberOfFeatures', WFS 2.0.0 reports 'numberMatched', which may be 'unknown'.  Returns
+# None when the service doesn't know the count.
+def parse_hits(xml):
+    for event, elem in iterparse(StringIO(xml), events=('start',)):
+        count = elem.get('numberMatched', elem.get('numberOfFeatures'))
+        if count is None:
+            raise ValueError('Response is not a FeatureCollection with a feature count')
+        try:
+            return int(count)
+        except ValueError:
+            return None
+
+# Split a (minx, miny, maxx, maxy) box into four equal quadrants
+def split_bbox(bbox):
+    minx, miny, maxx, maxy = bbox
+    midx = (minx + maxx) / 2.0
+    midy = (miny + maxy) / 2.0
+    return [(minx, miny, midx, midy), (midx, miny, maxx, midy),
+            (minx, midy, midx, maxy), (midx, midy, maxx, maxy)]
+
+# Return the overlap of two (minx, miny, maxx, maxy) boxes, either of which may be None
+def intersect_bbox(a, b):
+    if not a or not b:
+        box = a or b
+        return tuple(box[:4]) if box else None
+    minx, miny = max(a[0], b[0]), max(a[1], b[1])
+    maxx, maxy = min(a[2], b[2]), min(a[3], b[3])
+    if minx > maxx or miny > maxy:
+        return None
+    return (minx, miny, maxx, maxy)
+
+# Return the first coordinate pair of a GeoJSON geometry, which always lies on the geometry itself
+def first_coordinate(geometry):
+    if not geometry:
+        return None
+    if geometry.get('type') == 'GeometryCollection':
+        geometries = geometry.get('geometries') or [None]
+        return first_coordinate(geometries[0])
+    coordinates = geometry.get('coordinates')
+    while coordinates and isinstance(coordinates[0], (list, tuple)):
+        coordinates = coordinates[0]
+    return coordinates or None
+
+# Return the WGS84 bounding box of the layer that a WMS or WFS resource points at, or None for other resources and
+# for layers that don't advertise one.  The capabilities come from the shared cache.
+def resource_bbox(resource):
+    service_type = capabilities.detect_service_type(resource.get('url'), resource.get('format'),
+                                                    resource.get('protocol'))
+    if service_type == 'WMS':
+        handler = HandleWMS(resource['url'])
+    elif service_type == 'WFS':
+        handler = HandleWFS(resource['url'])
+    else:
+        return None
+    layer = handler.do_layer_check({'resource': resource})
+    bbox = handler.get_bbox(layer) if layer else None
+    return tuple(float(x) for x in bbox[:4]) if bbox else None
 
 class HandleWMS():
     """
@@ -9,20 +201,35 @@ class HandleWMS():
     """
 
     def __init__(self, url, version="1.1.1"):
-        self.wms = WebMapService(url, version=version)
-        self.type = self.wms.identification.type
-        self.version = self.wms.identification.version
-        self.title = self.wms.identification.title
-        self.abstract = self.wms.identification.abstract
+        self.url = url
+        self.capabilities = capabilities.get_summary('WMS', url, version)
+        self.type = self.capabilities['type']
+        self.version = self.capabilities['version']
+        self.title = self.capabilities['title']
+        self.abstract = self.capabilities['abstract']
         self.size = (256, 256)
+        self._requested_version = version
+
+    # The full OWSLib WebMapService is only needed by callers that want more than the capabilities summary, so it is
+    # parsed on first access rather than up front.
+    @property
+    def wms(self):
+        return capabilities.get_service('WMS', self.url, self._requested_version)
+
+    # Return the summary of a named layer, matching the name without regard to case
+    def get_layer(self, layer):
+        this_layer = self.capabilities.find_layer(layer)
+        if this_layer is None:
+            raise KeyError(layer)
+        return this_layer
 
     # Return a specific service URL, getMap is default
     def get_service_url(self, method='Get'):
-        return self.wms.getOperationByName('GetMap').methods[method]['url']
+        return self.capabilities['operations']['GetMap']['methods'][method]['url']
 
     # Return an image format, *.png is default
     def get_format_options(self, format='image/png'):
-        formats = self.wms.getOperationByName('GetMap').formatOptions
+        formats = self.capabilities['operations']['GetMap']['formats']
         if format in formats:
             return format
         else:
@@ -30,8 +237,7 @@ class HandleWMS():
 
     # Return a spatial reference system, default is WGS84
     def get_srs(self, layer, srs='EPSG:4326'):
-        this_layer = self.wms[layer]
-        srs_list = this_layer.crsOptions
+        srs_list = self.get_layer(layer)['crs']
         if srs in srs_list:
             return srs
         else:
@@ -39,38 +245,103 @@ class HandleWMS():
 
     # Return bounding box of the service
     def get_bbox(self, layer):
-        this_layer = self.wms[layer]
-        return this_layer.boundingBoxWGS84
+        return self.get_layer(layer)['bbox']
 
     # Pass in a dictionary with the layer name bound to 'layer'.  If the 'layer' is not found, then just return the
     # first layer in the list of available layers
     def do_layer_check(self, data_dict):
-        wms_layers = list(self.wms.contents)
+        wms_layers = self.capabilities['layers']
         resource = data_dict.get("resource", {})
         res_layer = resource.get("layer", None)
 
         if res_layer and wms_layers:
-            wms_lower = [x.lower() for x in wms_layers]
-            res_lower = resource.get("layer").lower()
-            if res_lower in wms_lower:
+            if self.capabilities.find_layer(res_layer) is not None:
                 return res_layer
         elif wms_layers:
-            return wms_layers[0]
+            return wms_layers[0]['name']
 
-    # Return all of the information we need to access features in a WMS as one dictionary
+    # Return all of the information we need to access features in a WMS as one dictionary.  The result only depends
+    # on the capabilities summary, so it is memoized alongside it and recomputed when the summary is refreshed.
     def get_layer_info(self, data_dict):
         layer = self.do_layer_check(data_dict)
-        bbox = self.get_bbox(layer)
-        srs = self.get_srs(layer)
-        format = self.get_format_options()
+        key = ('layer_info', layer)
+        info = self.capabilities.memo.get(key)
+        if info is None:
+            info = {
+                'layer': layer,
+                'bbox': self.get_bbox(layer),
+                'srs': self.get_srs(layer),
+                'tile_format': self.get_format_options(),
+                'service_url': self.get_service_url()
+            }
+            self.capabilities.memo[key] = info
+        return dict(info)
+
+    # Build a GetMap URL for one image of a layer.  WMS 1.3.0 names the SRS parameter CRS and orders EPSG:4326
+    # coordinates latitude first.
+    def get_map_url(self, layer, bbox, srs='EPSG:4326', format='image/png', size=None):
+        width, height = size or self.size
+        if self.version == '1.3.0' and srs == 'EPSG:4326':
+            bbox = (bbox[1], bbox[0], bbox[3], bbox[2])
+        request = [('SERVICE', 'WMS'), ('VERSION', self.version), ('REQUEST', 'GetMap'), ('LAYERS', layer),
+                   ('STYLES', ''), ('CRS' if self.version == '1.3.0' else 'SRS', srs),
+                   ('BBOX', ','.join(repr(float(x)) for x in bbox)), ('WIDTH', width), ('HEIGHT', height),
+                   ('FORMAT', format), ('TRANSPARENT', 'TRUE')]
+        encoded_request = "&".join("%s=%s" % (key, urllib.quote(unicode(value).encode('utf-8'), safe=',:'))
+                                   for (key, value) in request)
         service_url = self.get_service_url()
-        return {
-            'layer': layer,
-            'bbox': bbox,
-            'srs': srs,
-            'tile_format': format,
-            'service_url': service_url
-        }
+        if service_url.endswith(('?', '&')):
+            return service_url + encoded_request
+        return service_url + ('&' if '?' in service_url else '?') + encoded_request
+
+    # Return one tile of a layer on the fixed grid of tiles.GRIDS for 'srs', as (content type, image bytes).  Tiles
+    # are served from the shared disk cache when it is configured, and only fetched from the service on a miss.
+    def get_tile(self, layer, z, x, y, srs='EPSG:4326', format='image/png'):
+        grid = tiles.GRIDS[srs]
+        if not grid.valid(z, x, y):
+            raise ValueError('No tile %s/%s/%s in %s' % (z, x, y, srs))
+        format = self.get_format_options(format)
+        if not isinstance(format, basestring):
+            raise ValueError('Format is not offered by this service')
+        # Services advertise the spherical Mercator grid under any of its names, so ask for it by the one they use.
+        service_srs = [name for name in tiles.SRS_ALIASES.get(srs, [srs]) if self.get_srs(layer, name) == name]
+        if not service_srs:
+            raise ValueError('%s is not offered for layer %s' % (srs, layer))
+        url = self.get_map_url(self.get_layer(layer)['name'], grid.tile_bbox(z, x, y), service_srs[0], format,
+                               (grid.size, grid.size))
+
+        cache = tiles.tile_cache
+        key = tiles.TileCache.make_key(url)
+        data = cache.get(key) if cache is not None else None
+        if data is not None:
+            return format, data
+
+        response = transport.http_client.get(url)
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+        if not content_type.startswith('image/'):
+            # Services answer errors with a ServiceExceptionReport, which must not be cached as a tile.
+            raise IOError('Service did not return an image for %s' % url)
+        if cache is not None:
+            cache.put(key, response.content)
+        return format, response.content
+
+    # Fetch every tile of a layer that intersects its bounding box at the given zoom levels into the tile cache, so
+    # that the first map views are fast too.  Returns the number of tiles that could not be fetched.
+    def seed_tiles(self, layer, zooms, srs='EPSG:4326', format='image/png'):
+        grid = tiles.GRIDS[srs]
+        bbox = self.get_bbox(layer)
+        wanted = [tile for z in zooms for tile in grid.tiles_in_bbox(bbox, z)]
+
+        def fetch(tile):
+            try:
+                self.get_tile(layer, tile[0], tile[1], tile[2], srs, format)
+                return True
+            except Exception, e:
+                log.warning('Could not seed tile %s of %s: %s' % (tile, layer, e))
+                return False
+
+        return transport.http_client.map(fetch, wanted).count(False)
 
 class HandleWFS():
     """
@@ -79,36 +350,172 @@ class HandleWFS():
     """
 
     def __init__(self, url, version="1.0.0"):
-        self.wfs = WebFeatureService(url, version=version)
-        self.type = self.wfs.identification.type
-        self.version = self.wfs.identification.version
-        self.title = self.wfs.identification.title
-        self.abstract = self.wfs.identification.abstract
+        self.url = url
+        self.capabilities = capabilities.get_summary('WFS', url, version)
+        self.type = self.capabilities['type']
+        self.version = self.capabilities['version']
+        self.title = self.capabilities['title']
+        self.abstract = self.capabilities['abstract']
+        self._requested_version = version
+
+    # The full OWSLib WebFeatureService is only needed by callers that want more than the capabilities summary, so
+    # it is parsed on first access rather than up front.
+    @property
+    def wfs(self):
+        return capabilities.get_service('WFS', self.url, self._requested_version)
 
     # Return a specific service URL, getFeature is default
     def get_service_url(self, operation='{http://www.opengis.net/wfs}GetFeature',
                         method='{http://www.opengis.net/wfs}Get'):
-        return self.wfs.getOperationByName(operation).methods[method]['url']
+        operations = self.capabilities['operations']
+        methods = (operations.get(operation) or operations[local_name(operation)])['methods']
+        return (methods.get(method) or methods[local_name(method)])['url']
+
+    # Return the WGS84 bounding box of a feature type
+    def get_bbox(self, layer):
+        this_layer = self.capabilities.find_layer(layer)
+        if this_layer is None:
+            raise KeyError(layer)
+        return this_layer['bbox']
+
+    # Return the output formats the service advertises for an operation, from its result formats (WFS 1.0.0) and
+    # its 'outputFormat' parameter (WFS 1.1.0 and 2.0.0)
+    def get_output_formats(self, operation='{http://www.opengis.net/wfs}GetFeature'):
+        operations = self.capabilities['operations']
+        this_operation = operations.get(operation) or operations.get(local_name(operation)) or {}
+        formats = [local_name(format) for format in this_operation.get('formats') or []]
+        parameter = (this_operation.get('parameters') or {}).get('outputFormat') or {}
+        formats.extend(parameter.get('values') or [])
+        return formats
+
+    # Return the advertised GetFeature output format that is GeoJSON, or None.  It is looked up once per capabilities
+    # summary, and a service whose GeoJSON turns out to be unreadable is remembered as offering none.
+    def get_geojson_format(self):
+        key = ('geojson_format',)
+        if key not in self.capabilities.memo:
+            advertised = dict((format.split(';')[0].strip().lower(), format) for format in self.get_output_formats())
+            found = None
+            for format in GEOJSON_FORMATS:
+                if format in advertised:
+                    found = advertised[format]
+                    break
+            self.capabilities.memo[key] = found
+        return self.capabilities.memo[key]
+
+    # Return the fields of a feature type, in schema order, from a DescribeFeatureType request; see
+    # 'recline.parse_feature_type'.  The schema of a layer only changes with the service, so it is memoized alongside
+    # the capabilities summary; failed requests are not, and are tried again next time.
+    def describe_feature_type(self, type_name):
+        key = ('feature_type', type_name)
+        if key not in self.capabilities.memo:
+            service_url = self.get_service_url('{http://www.opengis.net/wfs}DescribeFeatureType')
+            request = {'service': 'WFS', 'version': self.version, 'request': 'DescribeFeatureType',
+                       'typeName': type_name}
+            response = transport.http_client.get(service_url + '&' + urllib.urlencode(request))
+            response.raise_for_status()
+            self.capabilities.memo[key] = recline.parse_feature_type(response.content, type_name)
+        return [dict(field) for field in self.capabilities.memo[key]]
+
+    # Return the name of a feature type's geometry property from its DescribeFeatureType schema, or None if the service
+    # can't describe it.  Filter Encoding 1.0 requires it in every BBOX, and property lists need it to keep geometries.
+    def get_geometry_name(self, type_name):
+        try:
+            fields = self.describe_feature_type(type_name)
+        except Exception, e:
+            log.warning('Could not describe %s of %s: %s', type_name, self.url, e)
+            return None
+        for field in fields:
+            if field['type'] == 'geojson':
+                return field['id']
+
+    # Return a list of property names to request with the layer's geometry property added, so that features keep
+    # their geometries whatever columns were asked for
+    def with_geometry(self, type_name, properties):
+        if not properties:
+            return properties
+        geometry_name = self.get_geometry_name(type_name)
+        if geometry_name and geometry_name not in properties:
+            return list(properties) + [geometry_name]
+        return properties
+
+    # Return the number of features in a layer, or in the part of it within a WGS84 'bbox' and matching a 'filter'
+    # (see 'build_url'), from a resultType=hits getFeature request, which transfers no features at all.  None if the
+    # service can't count them.  The count of a whole layer is memoized alongside the capabilities summary.
+    def count_features(self, type_name, bbox=None, filter=None):
+        key = ('feature_count', type_name)
+        if bbox or filter or key not in self.capabilities.memo:
+            response = transport.http_client.get(self.build_url(type_name, bbox=bbox, filter=filter,
+                                                                 resultType='hits'))
+            response.raise_for_status()
+            count = parse_hits(response.content)
+            if bbox or filter:
+                return count
+            self.capabilities.memo[key] = count
+        return self.capabilities.memo[key]
+
+    # Return what previews need to know about a layer before fetching any of its features, as one dictionary: its
+    # 'layer' name, WGS84 'bbox', 'fields' (see 'describe_feature_type') and feature 'count'.  A field list or count
+    # the service can't provide is None.  Raises KeyError if the service has no such layer.
+    def get_layer_stats(self, data_dict):
+        type_name = self.require_layer(data_dict)
+        stats = {'layer': type_name, 'bbox': self.get_bbox(type_name), 'fields': None, 'count': None}
+        try:
+            stats['fields'] = self.describe_feature_type(type_name)
+        except Exception, e:
+            log.warning('Could not describe %s of %s: %s', type_name, self.url, e)
+        try:
+            stats['count'] = self.count_features(type_name)
+        except Exception, e:
+            log.warning('Could not count the features of %s of %s: %s', type_name, self.url, e)
+        return stats
+
+    # Return a token that changes whenever the service reports a change to its layers, which is what drives the
+    # refresh of mirrored layers: the ETag or Last-Modified header of its capabilities document, or for services that
+    # send neither, a digest of the layer's entry in the capabilities summary.
+    def get_layer_token(self, type_name):
+        entry = capabilities.capabilities_cache.get('WFS', self.url, self._requested_version)
+        if entry.etag or entry.last_modified:
+            return entry.etag or entry.last_modified
+        layer = self.capabilities.find_layer(type_name)
+        return hashlib.sha1(json.dumps(layer, sort_keys=True)).hexdigest()
+
+    # Copy every feature of a layer into the local feature mirror, after which 'iter_features' serves the layer from
+    # there.  Returns the number of features copied.
+    def sync_mirror(self, type_name, page_size=1000):
+        token = self.get_layer_token(type_name)
+        mirror.feature_mirror.add(self.url, type_name)
+        return mirror.feature_mirror.sync(self.url, type_name, self.iter_upstream(type_name, page_size), token)
+
+    # Return whether a layer is served from the local feature mirror
+    def is_mirrored(self, type_name):
+        if mirror.feature_mirror is None:
+            return False
+        try:
+            record = mirror.feature_mirror.get(self.url, type_name)
+        except Exception, e:
+            log.warning('Could not read the feature mirror: %s', e)
+            return False
+        return record is not None and record['synced'] is not None
 
     # Pass in a dictionary with the layer name bound to 'layer'.  If the 'layer' is not found, then just return the
     # first layer in the list of available layers
     def do_layer_check(self, data_dict):
-        wfs_layers = list(self.wfs.contents)
+        wfs_layers = self.capabilities['layers']
         resource = data_dict.get("resource", {})
         res_layer = resource.get("layer", None)
 
         if res_layer and wfs_layers:
-            wfs_lower = [x.lower() for x in wfs_layers]
-            res_lower = res_layer.lower()
-            if res_lower in wfs_lower:
+            if self.capabilities.find_layer(res_layer) is not None:
                 return res_layer
         elif wfs_layers:
-            return wfs_layers[0]
+            return wfs_layers[0]['name']
 
     # Build a URL for accessing service data, getFeature is default
     def build_url(self, typename=None, method='{http://www.opengis.net/wfs}Get',
-                  operation='{http://www.opengis.net/wfs}GetFeature', maxFeatures=None):
-        service_url = self.wfs.getOperationByName(operation).methods[method]['url']
+                  operation='{http://www.opengis.net/wfs}GetFeature', maxFeatures=None,
+                  startIndex=None, count=None, bbox=None, propertyName=None, filter=None,
+                  geometryName=None, outputFormat=None, srsName=None, resultType=None):
+        service_url = self.get_service_url(operation, method)
         request = {'service': 'WFS', 'version': self.version}
         try:
             assert len(typename) > 0
@@ -118,31 +525,308 @@ class HandleWFS():
             pass
 
         if maxFeatures: request['maxfeatures'] = str(maxFeatures)
+        if count: request['count'] = str(count)
+        if startIndex is not None: request['startIndex'] = str(startIndex)
+        if outputFormat: request['outputFormat'] = outputFormat
+        if srsName: request['srsName'] = srsName
+        if resultType: request['resultType'] = resultType
+        if propertyName:
+            if not isinstance(propertyName, basestring):
+                propertyName = ','.join(propertyName)
+            request['propertyName'] = propertyName
+
+        # A request can carry either a BBOX or a FILTER parameter but not both, so when there is an attribute filter
+        # the bounding box becomes part of the filter document.
+        if filter:
+            if bbox and not geometryName:
+                geometryName = self.get_geometry_name(typename)
+            request['filter'] = encode_filter(filter, self.version, bbox, geometryName)
+        elif bbox:
+            request['bbox'] = ','.join(repr(float(x)) for x in bbox)
+            if self.version != '1.0.0':
+                request['bbox'] += ',EPSG:4326'
 
-        encoded_request = "&".join("%s=%s" % (key,value) for (key,value) in request.items())
+        encoded_request = "&".join("%s=%s" % (key, urllib.quote(unicode(value).encode('utf-8'), safe=',:'))
+                                   for (key,value) in request.items())
         url = service_url + "&" + encoded_request
         return url
 
-    # Take a data_dict, use information to build a getFeature URL and get features as GML.  Then take that GML response
-    # and turn it into GeoJSON.
-    def make_geojson(self, data_dict):
-        geojson = []
+    # Fetch a getFeature URL through the shared OGC HTTP client, open the response with OGR from memory and yield its
+    # features one at a time as GeoJSON dictionaries in WGS84.  Going through the shared client rather than letting
+    # OGR fetch the URL itself means pooled connections, per-host limits and timeouts apply to feature requests too.
+    # Features in any other CRS, from servers that don't honour srsName, are reprojected.
+    def read_features(self, wfs_url):
+        response = transport.http_client.get(wfs_url)
+        response.raise_for_status()
+        path = '/vsimem/ngds_%s.gml' % uuid.uuid4().hex
+        gdal.FileFromMemBuffer(path, response.content)
+        response = None
+        source = None
+        try:
+            source = ogr.Open(path)
+            if source is None:
+                raise IOError('Could not read features from %s' % wfs_url)
+            layer = source.GetLayerByIndex(0)
+            transform = wgs84_transform(layer.GetSpatialRef())
+            for feature in layer:
+                geometry = feature.GetGeometryRef()
+                if transform is not None and geometry is not None:
+                    geometry.Transform(transform)
+                yield feature.ExportToJson(as_object=True)
+        finally:
+            source = None
+            gdal.Unlink(path)
+            gdal.Unlink(path[:-len('.gml')] + '.gfs')
+
+    # Fetch a getFeature URL that asks for GeoJSON and return its features.  The body is decoded with the json module
+    # straight into the dictionaries callers want, so no GML is parsed at all.  A collection that names a CRS other
+    # than WGS84 is reprojected.
+    def read_geojson(self, wfs_url):
+        response = transport.http_client.get(wfs_url)
+        response.raise_for_status()
+        collection = json.loads(response.content)
+        if not isinstance(collection, dict) or not isinstance(collection.get('features'), list):
+            raise ValueError('%s did not return a GeoJSON FeatureCollection' % wfs_url)
+        crs = collection.get('crs') or {}
+        code = epsg_code((crs.get('properties') or {}).get('name')) if isinstance(crs, dict) else None
+        if code and code != 4326:
+            return reproject_features(collection['features'], code)
+        return collection['features']
+
+    # Return the body of a GeoJSON response as is, or None if it isn't GeoJSON in WGS84.  Only the start of the body
+    # is looked at, so nothing is decoded.  A collection naming its CRS does so before its features.
+    def read_geojson_body(self, wfs_url):
+        response = transport.http_client.get(wfs_url)
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', '').lower()
+        if 'json' not in content_type or not response.content.lstrip().startswith('{'):
+            return None
+        head = response.content[:response.content.find('"features"')]
+        match = re.search(r'"crs"\s*:.*?"name"\s*:\s*"([^"]*)"', head, re.DOTALL)
+        if match and epsg_code(match.group(1)) not in (None, 4326):
+            return None
+        return response.content
+
+    # Request features of a layer and yield them as GeoJSON dictionaries in WGS84, whatever the layer's native CRS.
+    # Services that advertise GeoJSON output are asked for it, which skips GML parsing altogether; the GML path through
+    # OGR is only taken for services that don't, or whose GeoJSON can't be read.
+    def get_features(self, type_name, **params):
+        output_format = self.get_geojson_format()
+        if output_format:
+            url = self.build_url(type_name, outputFormat=output_format, srsName=WGS84, **params)
+            try:
+                return self.read_geojson(url)
+            except ValueError, e:
+                log.warning('Falling back to GML for %s: %s', self.url, e)
+                self.capabilities.memo[('geojson_format',)] = None
+        return self.read_features(self.build_url(type_name, srsName=WGS84, **params))
+
+    # Yield every feature of a layer without ever holding more than one page of them in memory.  WFS 2.0.0 services
+    # are paged through with startIndex/count; older versions have no paging, so the layer's bounding box is split
+    # into tiles instead, and any tile that comes back full is split again.  A small 'max_features' is served with a
+    # single request, like 'make_geojson' has always done.  'bbox', 'properties' and 'filter' are passed on to the
+    # server (see 'build_url') so that only the features and columns asked for are ever transferred; the geometry is
+    # always requested along with 'properties', as tiling needs it to tell tiles apart.  Layers in the local feature
+    # mirror are read from there and the service isn't asked at all.
+    def iter_features(self, data_dict, page_size=1000, max_features=None, bbox=None, properties=None, filter=None):
+        type_name = self.do_layer_check(data_dict)
+        if mirror.feature_mirror is not None:
+            try:
+                features = mirror.feature_mirror.query(self.url, type_name, bbox, properties, filter, max_features)
+            except Exception, e:
+                log.warning('Could not read %s of %s from the feature mirror: %s', type_name, self.url, e)
+                features = None
+            if features is not None:
+                return features
+        return self.iter_upstream(type_name, page_size, max_features, bbox, properties, filter)
+
+    # Request the features of a layer from the service itself; see 'iter_features'
+    def iter_upstream(self, type_name, page_size=1000, max_features=None, bbox=None, properties=None, filter=None):
+        query = {'propertyName': self.with_geometry(type_name, properties), 'filter': filter}
+
+        if max_features and max_features <= page_size:
+            features = self.get_features(type_name, maxFeatures=max_features, bbox=bbox, **query)
+        elif self.version == '2.0.0':
+            features = self.iter_pages(type_name, page_size, dict(query, bbox=bbox))
+        else:
+            tile = intersect_bbox(bbox, self.get_bbox(type_name))
+            if tile:
+                features = self.iter_tiles(type_name, tile, tile, page_size, query)
+            else:
+                features = self.get_features(type_name, maxFeatures=max_features, bbox=bbox, **query)
+
+        for i, feature in enumerate(features):
+            if max_features and i >= max_features:
+                break
+            yield feature
+
+    # Page through a WFS 2.0.0 feature type with startIndex/count
+    def iter_pages(self, type_name, page_size, query=None):
+        start = 0
+        while True:
+            received = 0
+            for feature in self.get_features(type_name, startIndex=start, count=page_size, **(query or {})):
+                received += 1
+                yield feature
+            if received < page_size:
+                break
+            start += received
+
+    # Recursively tile a bounding box for services without paging.  A feature that crosses tile boundaries comes
+    # back from several tiles, so it is only kept by the tile that holds its first coordinate; tile edges that lie on
+    # the edge of the layer's own bounding box are left open so that nothing falls outside every tile.
+    def iter_tiles(self, type_name, bbox, layer_bbox, page_size, query=None, depth=0, max_depth=12):
+        features = list(self.get_features(type_name, maxFeatures=page_size, bbox=bbox, **(query or {})))
+        if len(features) >= page_size:
+            if depth < max_depth:
+                del features
+                for tile in split_bbox(bbox):
+                    for feature in self.iter_tiles(type_name, tile, layer_bbox, page_size, query, depth + 1,
+                                                   max_depth):
+                        yield feature
+                return
+            log.warning('Tile %s of %s is still full at depth %s; some features may be missing',
+                        bbox, type_name, depth)
+
+        minx, miny, maxx, maxy = bbox
+        for feature in features:
+            point = first_coordinate(feature.get('geometry'))
+            if point:
+                x, y = point[0], point[1]
+                if not ((x >= minx or minx <= layer_bbox[0]) and (x < maxx or maxx >= layer_bbox[2]) and
+                        (y >= miny or miny <= layer_bbox[1]) and (y < maxy or maxy >= layer_bbox[3])):
+                    continue
+            yield feature
+
+    # Return the layer a data_dict asks for, raising KeyError if the service has no such layer
+    def require_layer(self, data_dict):
         type_name = self.do_layer_check(data_dict)
-        wfs_url = self.build_url(type_name, maxFeatures=100)
-        source = ogr.Open(wfs_url)
-        layer = source.GetLayerByIndex(0)
-        for feature in layer:
-            geojson.append(feature.ExportToJson(as_object=True))
-        return geojson
+        if type_name is None:
+            raise KeyError(data_dict.get('resource', {}).get('layer'))
+        return type_name
+
+    # Return an iterator over the features of a layer, see 'iter_features', with the first page already fetched.
+    # Streamed responses are sent with their status as soon as they start, so everything that can fail up front, an
+    # unknown layer or an unreachable service, has to fail before then.
+    def prefetch_features(self, data_dict, page_size=1000, max_features=None, **query):
+        self.require_layer(data_dict)
+        features = self.iter_features(data_dict, page_size, max_features, **query)
+        return chain(list(islice(features, 1)), features)
+
+    # Write every feature of a layer out as chunks of one GeoJSON FeatureCollection, suitable for a streamed HTTP
+    # response body.  When a single request is enough and the service offers GeoJSON, its response is passed through
+    # byte for byte, unless the layer is mirrored.  The layer is checked and the first page fetched before this
+    # returns, so those errors are raised to the caller rather than cutting the response short.
+    def stream_geojson(self, data_dict, page_size=1000, max_features=None, **query):
+        type_name = self.require_layer(data_dict)
+        output_format = self.get_geojson_format()
+        if output_format and max_features and max_features <= page_size and not self.is_mirrored(type_name):
+            url = self.build_url(type_name, maxFeatures=max_features,
+                                 propertyName=self.with_geometry(type_name, query.get('properties')),
+                                 bbox=query.get('bbox'), filter=query.get('filter'), outputFormat=output_format,
+                                 srsName=WGS84)
+            body = self.read_geojson_body(url)
+            if body is not None:
+                return iter([body])
+            log.warning('Falling back to GML for %s: response is not GeoJSON in WGS84', self.url)
+            self.capabilities.memo[('geojson_format',)] = None
+        return self._write_geojson(self.prefetch_features(data_dict, page_size, max_features, **query))
+
+    def _write_geojson(self, features):
+        yield '{"type": "FeatureCollection", "features": ['
+        separator = ''
+        for feature in features:
+            yield separator + json.dumps(feature)
+            separator = ','
+        yield ']}'
+
+    # Take a data_dict, use information to build a getFeature URL and get features as GeoJSON, natively or by turning
+    # a GML response into it.  Optionally restrict the features to a WGS84 'bbox', the attributes to a list of
+    # 'properties' and the rows to an attribute 'filter'; all three are evaluated by the WFS server.
+    def make_geojson(self, data_dict, bbox=None, properties=None, filter=None):
+        return list(self.iter_features(data_dict, max_features=100, bbox=bbox, properties=properties,
+                                       filter=filter))
+
+    # Return one Mapbox Vector Tile of a layer as (bytes, truncated); the bytes are empty if no feature falls into the
+    # tile.  The features of the tile and a buffer around it are read through 'iter_features', so from the feature
+    # mirror for mirrored layers, then clipped, simplified and encoded by 'mvt.TileEncoder'.  Tiles go into the shared
+    # tile cache, keyed by the layer's token and mirror sync, so that they are rebuilt once the layer changes.  At most
+    # 'max_features' are read for one tile, by default MIRROR_TILE_FEATURES or UPSTREAM_TILE_FEATURES; 'truncated' is
+    # True if the tile holds more, which only happens at low zoom levels of large layers.
+    def get_vector_tile(self, layer, z, x, y, srs='EPSG:3857', max_features=None, extent=4096, buffer=64):
+        grid = tiles.GRIDS[srs]
+        if not grid.valid(z, x, y):
+            raise ValueError('No tile %s/%s/%s in %s' % (z, x, y, srs))
+        if self.capabilities.find_layer(layer) is None:
+            raise KeyError(layer)
+
+        mirrored = self.is_mirrored(layer)
+        if not max_features:
+            max_features = MIRROR_TILE_FEATURES if mirrored else UPSTREAM_TILE_FEATURES
+
+        cache = tiles.tile_cache
+        if cache is not None:
+            synced = mirror.feature_mirror.get(self.url, layer) if mirrored else None
+            key = tiles.TileCache.make_key('mvt', capabilities.normalize_url(self.url), layer, srs, z, x, y,
+                                           max_features, self.get_layer_token(layer), synced and synced['synced'])
+            # Truncated tiles are marked by a second, empty entry
+            truncated_key = tiles.TileCache.make_key(key, 'truncated')
+            data = cache.get(key)
+            if data is not None:
+                return data, cache.get(truncated_key) is not None
+
+        minx, miny, maxx, maxy = grid.tile_bbox(z, x, y)
+        scale_x, scale_y = extent / (maxx - minx), extent / (maxy - miny)
+
+        def project(lon, lat):
+            px, py = grid.from_wgs84(lon, lat)
+            return (px - minx) * scale_x, (maxy - py) * scale_y
+
+        margin_x, margin_y = buffer / scale_x, buffer / scale_y
+        west, south = grid.to_wgs84(minx - margin_x, miny - margin_y)
+        east, north = grid.to_wgs84(maxx + margin_x, maxy + margin_y)
+        bbox = (max(west, -180.0), max(south, -90.0), min(east, 180.0), min(north, 90.0))
+
+        encoder = mvt.TileEncoder(layer.split(':')[-1], project, extent, buffer)
+        truncated = False
+        for i, feature in enumerate(self.iter_features({'resource': {'layer': layer}}, max_features=max_features + 1,
+                                                       bbox=bbox)):
+            if i >= max_features:
+                log.warning('Vector tile %s/%s/%s of %s of %s holds more than %s features; the rest are left out',
+                            z, x, y, layer, self.url, max_features)
+                truncated = True
+                break
+            encoder.add(feature)
+        data = encoder.encode()
+        if cache is not None:
+            if truncated:
+                cache.put(truncated_key, '')
+            cache.put(key, data)
+        return data, truncated
+
+    # Write the features of a layer out as a columnar, dictionary-encoded Recline payload, in chunks suitable for a
+    # streamed HTTP response body; see 'recline.encode_columnar'.  The fields come from DescribeFeatureType, or from
+    # the first feature for services that can't describe the layer.  Takes the same arguments as 'stream_geojson', and
+    # like it fails before returning if the layer is unknown or its first page can't be fetched.
+    def stream_recline(self, data_dict, page_size=1000, max_features=None, batch_size=5000, **query):
+        type_name = self.require_layer(data_dict)
+        try:
+            fields = self.describe_feature_type(type_name)
+        except Exception, e:
+            log.warning('Could not describe %s of %s: %s', type_name, self.url, e)
+            fields = None
+        if fields and query.get('properties'):
+            fields = [field for field in fields if field['id'] in query['properties'] or field['type'] == 'geojson']
+        features = self.prefetch_features(data_dict, page_size, max_features, **query)
+        return recline.encode_columnar(features, fields, batch_size)
 
     # Recline.js doesn't support the GeoJSON specification and instead just wants it's own flavor of spatial-json.  So,
     # give this method the same data_dict you would give the 'make_geojson' method and we'll take the GeoJSON and turn
     # it into Recline JSON.
-    def make_recline_json(self, data_dict):
+    def make_recline_json(self, data_dict, bbox=None, properties=None, filter=None):
         recline_json = []
-        geojson = self.make_geojson(data_dict)
-        for i in geojson:
-            properties = i['properties']
-            properties.update(dict(geometry=i['geometry']))
-            recline_json.append(properties)
-        return recline_json
\ No newline at end of file
+        for i in self.iter_features(data_dict, max_features=100, bbox=bbox, properties=properties, filter=filter):
+            row = i['properties']
+            row.update(dict(geometry=i['geometry']))
+            recline_json.append(row)
+        return recline_json
@@ -0,0 +1,164 @@
+import json
+
+from itertools import islice
+from xml.etree import cElementTree as etree
+
+XSD = '{http://www.w3.org/2001/XMLSchema}'
+
+# Recline field types for the XML schema types a WFS describes its feature
+# types with.  GML property types are geometries.
+XSD_TYPES = {
+    'string': 'string', 'anyURI': 'string',
+    'int': 'integer', 'integer': 'integer', 'long': 'integer',
+    'short': 'integer', 'byte': 'integer', 'nonNegativeInteger': 'integer',
+    'positiveInteger': 'integer',
+    'double': 'number', 'float': 'number', 'decimal': 'number',
+    'date': 'date', 'dateTime': 'date', 'time': 'string',
+    'boolean': 'boolean'
+}
+
+def parse_feature_type(xml, type_name=None):
+    """
+    Read the fields of a feature type from a DescribeFeatureType response.
+
+    @param xml: XML schema document as a string
+    @param type_name: feature type to read, with or without its prefix;
+                      defaults to the first one in the document
+    @return: list of dictionaries with 'id' and Recline 'type', in schema
+             order, geometries as type 'geojson'
+    """
+    root = etree.fromstring(xml)
+    complex_types = dict((node.get('name'), node)
+                         for node in root.findall(XSD + 'complexType'))
+    elements = root.findall(XSD + 'element')
+    local = (type_name or '').split(':')[-1]
+    for element in elements:
+        if not local or element.get('name') == local:
+            type_ref = (element.get('type') or '').split(':')[-1]
+            node = complex_types.get(type_ref)
+            if node is None:
+                node = element.find(XSD + 'complexType')
+            break
+    else:
+        node = None
+    if node is None and len(complex_types) == 1:
+        node = complex_types.values()[0]
+    if node is None:
+        raise ValueError('Feature type %s is not described' % type_name)
+
+    fields = []
+    for element in node.iter(XSD + 'element'):
+        name = element.get('name')
+        if not name:
+            continue
+        kind = element.get('type') or ''
+        if kind.startswith('gml:') or kind.endswith('PropertyType'):
+            fields.append({'id': name, 'type': 'geojson'})
+            continue
+        restriction = element.find('.//%srestriction' % XSD)
+        if not kind and restriction is not None:
+            kind = restriction.get('base') or ''
+        fields.append({'id': name,
+                       'type': XSD_TYPES.get(kind.split(':')[-1], 'string')})
+    return fields
+
+def feature_fields(feature):
+    """
+    @param feature: GeoJSON feature dictionary
+    @return: field list for a layer that wasn't described, from its first
+             feature
+    """
+    fields = []
+    for name, value in sorted((feature.get('properties') or {}).items()):
+        if isinstance(value, bool):
+            kind = 'boolean'
+        elif isinstance(value, (int, long)):
+            kind = 'integer'
+        elif isinstance(value, float):
+            kind = 'number'
+        else:
+            kind = 'string'
+        fields.append({'id': name, 'type': kind})
+    fields.append({'id': 'geometry', 'type': 'geojson'})
+    return fields
+
+def encode_columnar(features, fields=None, batch_size=5000,
+                    dictionary_ratio=0.5):
+    """
+    Write features out as a compact, columnar Recline payload, in chunks
+    suitable for a streamed HTTP response body:
+
+        {"fields": [{"id": ..., "type": ...}, ...],
+         "batches": [{"count": N,
+                      "dictionaries": {"state": ["AZ", "NV"]},
+                      "columns": {"state": {"codes": [0, 1, 0]},
+                                  "depth": {"values": [10.5, 3.0, 7.25]}}},
+                     ...],
+         "count": TOTAL}
+
+    Rows are encoded 'batch_size' at a time, so only one batch is ever held
+    in memory.  String columns are dictionary encoded: each batch lists the
+    values that first appear in it under 'dictionaries', appended to those of
+    earlier batches, and the column holds indexes into the accumulated list.
+    A string column whose first batch has more than 'dictionary_ratio'
+    distinct values per row is sent as plain values instead.  The feature
+    geometry is the 'geojson' field of the field list, if there is one.
+
+    @param features: iterable of GeoJSON feature dictionaries
+    @param fields: field list, e.g. from 'parse_feature_type'; defaults to
+                   the properties of the first feature
+    @param batch_size: rows per batch
+    @param dictionary_ratio: distinct values per row above which string
+                             columns aren't dictionary encoded
+    @return: iterator over chunks of JSON text
+    """
+    features = iter(features)
+    batch = list(islice(features, batch_size))
+    if fields is None:
+        fields = feature_fields(batch[0]) if batch else []
+
+    yield '{"fields": %s, "batches": [' % json.dumps(fields)
+    dictionaries = dict((field['id'], {}) for field in fields
+                        if field['type'] == 'string')
+    count = 0
+    separator = ''
+    while batch:
+        columns = {}
+        new_values = {}
+        for field in fields:
+            name = field['id']
+            if field['type'] == 'geojson':
+                values = [feature.get('geometry') for feature in batch]
+            else:
+                values = [(feature.get('properties') or {}).get(name)
+                          for feature in batch]
+
+            dictionary = dictionaries.get(name)
+            if dictionary is not None and count == 0 and \
+                    len(set(values)) > dictionary_ratio * len(values):
+                del dictionaries[name]
+                dictionary = None
+            if dictionary is None:
+                columns[name] = {'values': values}
+                continue
+
+            codes = []
+            added = []
+            for value in values:
+                code = dictionary.get(value)
+                if code is None:
+                    code = dictionary[value] = len(dictionary)
+                    added.append(value)
+                codes.append(code)
+            columns[name] = {'codes': codes}
+            if added:
+                new_values[name] = added
+
+        yield separator + json.dumps({'count': len(batch),
+                                      'dictionaries': new_values,
+                                      'columns': columns})
+        separator = ','
+        count += len(batch)
+        batch = list(islice(features, batch_size))
+
+    yield '], "count": %d}' % count
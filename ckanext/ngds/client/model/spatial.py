@@ -0,0 +1,165 @@
+import json
+
+# Solr field holding each dataset's extent as a rectangle, declared with the
+# 'location_rpt' type in solr/schema.xml.  'minx', 'miny', 'maxx', 'maxy' and
+# 'bbox_area' are indexed next to it for ranking.
+SPATIAL_FIELD = 'spatial_geom'
+
+WORLD = (-180.0, -90.0, 180.0, 90.0)
+
+def geometry_bbox(geometry):
+    """
+    @param geometry: GeoJSON geometry, feature or feature collection
+    @return: (minx, miny, maxx, maxy) around every coordinate, or None
+    """
+    if not isinstance(geometry, dict):
+        return None
+    kind = geometry.get('type')
+    if kind == 'FeatureCollection':
+        parts = [geometry_bbox(f) for f in geometry.get('features') or []]
+    elif kind == 'Feature':
+        parts = [geometry_bbox(geometry.get('geometry'))]
+    elif kind == 'GeometryCollection':
+        parts = [geometry_bbox(g) for g in geometry.get('geometries') or []]
+    else:
+        xs, ys = [], []
+        stack = [geometry.get('coordinates')]
+        while stack:
+            coordinates = stack.pop()
+            if not isinstance(coordinates, (list, tuple)) or not coordinates:
+                continue
+            if isinstance(coordinates[0], (list, tuple)):
+                stack.extend(coordinates)
+            elif len(coordinates) >= 2:
+                xs.append(float(coordinates[0]))
+                ys.append(float(coordinates[1]))
+        return (min(xs), min(ys), max(xs), max(ys)) if xs else None
+
+    bbox = None
+    for part in parts:
+        bbox = union_bbox(bbox, part)
+    return bbox
+
+# Return the smallest box around two (minx, miny, maxx, maxy) boxes, either of
+# which may be None
+def union_bbox(a, b):
+    if not a or not b:
+        return a or b
+    return (min(a[0], b[0]), min(a[1], b[1]),
+            max(a[2], b[2]), max(a[3], b[3]))
+
+def normalize_bbox(bbox):
+    """
+    Clip a box to the valid range of WGS84 coordinates.
+
+    @param bbox: sequence of minx, miny, maxx and maxy
+    @return: tuple of floats, or None if the box is malformed or empty
+    """
+    try:
+        minx, miny, maxx, maxy = [float(x) for x in bbox[:4]]
+    except (TypeError, ValueError):
+        return None
+    if minx > maxx or miny > maxy:
+        return None
+    bbox = (max(minx, WORLD[0]), max(miny, WORLD[1]),
+            min(maxx, WORLD[2]), min(maxy, WORLD[3]))
+    if bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+        return None
+    return bbox
+
+def parse_bbox(value):
+    """
+    @param value: 'minx,miny,maxx,maxy' string or list of four numbers
+    @return: normalized box
+    @raise ValueError: if the value is not a valid box
+    """
+    if isinstance(value, basestring):
+        value = value.split(',')
+    bbox = normalize_bbox(value) if value and len(value) == 4 else None
+    if bbox is None:
+        raise ValueError('Expected minx,miny,maxx,maxy in WGS84 degrees')
+    return bbox
+
+def extra_value(pkg_dict, key):
+    """
+    @param pkg_dict: dataset dictionary, with 'extras_' fields as given to
+                     'before_index' or a list of 'extras'
+    @param key: name of the extra
+    @return: the extra's value, decoded if it is JSON, or None
+    """
+    value = pkg_dict.get('extras_' + key)
+    if value is None:
+        for extra in pkg_dict.get('extras') or []:
+            if isinstance(extra, dict) and extra.get('key') == key:
+                value = extra.get('value')
+    if isinstance(value, basestring):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return None if value.strip()[:1] in ('{', '[') else value
+    return value
+
+def metadata_bbox(pkg_dict):
+    """
+    Read a dataset's extent from its own metadata: a GeoJSON 'spatial' extra,
+    as written by ckanext-spatial, or the geographic extents of the USGIN
+    metadata in the 'md_package' extra.
+
+    @param pkg_dict: dataset dictionary, as given to 'before_index'
+    @return: normalized box, or None if the metadata has no extent
+    """
+    bbox = geometry_bbox(extra_value(pkg_dict, 'spatial'))
+    if bbox is None:
+        md_package = extra_value(pkg_dict, 'md_package')
+        if isinstance(md_package, dict):
+            description = md_package.get('resourceDescription') or {}
+            for extent in description.get('geographicExtent') or []:
+                try:
+                    bbox = union_bbox(bbox, (
+                        float(extent['westBound']), float(extent['southBound']),
+                        float(extent['eastBound']), float(extent['northBound'])))
+                except (KeyError, TypeError, ValueError):
+                    continue
+    return normalize_bbox(bbox) if bbox else None
+
+def index_fields(bbox):
+    """
+    @param bbox: normalized box
+    @return: dictionary of Solr fields describing the box
+    """
+    minx, miny, maxx, maxy = bbox
+    return {'minx': minx, 'miny': miny, 'maxx': maxx, 'maxy': maxy,
+            'bbox_area': (maxx - minx) * (maxy - miny),
+            SPATIAL_FIELD: '%r %r %r %r' % bbox}
+
+def intersects_filter(bbox):
+    """
+    @param bbox: normalized box
+    @return: Solr filter query for datasets whose extent intersects the box
+    """
+    return '%s:"Intersects(%r %r %r %r)"' % ((SPATIAL_FIELD,) + tuple(bbox))
+
+def area_ratio(bbox):
+    """
+    Solr function that ranks datasets by how closely their extent matches a
+    box: the area they share divided by the larger of the two areas.  A
+    dataset covering exactly the box scores 1, one covering the whole world or
+    only a speck of the box scores close to 0.
+
+    @param bbox: normalized box
+    @return: Solr function query
+    """
+    minx, miny, maxx, maxy = [repr(x) for x in bbox]
+    area = repr(max((bbox[2] - bbox[0]) * (bbox[3] - bbox[1]), 1e-9))
+    overlap_x = 'max(0,sub(min(maxx,%s),max(minx,%s)))' % (maxx, minx)
+    overlap_y = 'max(0,sub(min(maxy,%s),max(miny,%s)))' % (maxy, miny)
+    return 'div(product(%s,%s),max(bbox_area,%s))' % (overlap_x, overlap_y,
+                                                     area)
+
+def search_params(bbox):
+    """
+    @param bbox: normalized box
+    @return: 'fq' and 'sort' parameters for a bbox search
+    """
+    return {'fq': intersects_filter(bbox),
+            'sort': '%s desc, metadata_modified desc' % area_ratio(bbox)}
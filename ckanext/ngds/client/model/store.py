@@ -0,0 +1,177 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS capabilities (
+    url TEXT NOT NULL,
+    service_type TEXT NOT NULL,
+    version TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fetched REAL NOT NULL,
+    PRIMARY KEY (url, service_type, version)
+);
+CREATE TABLE IF NOT EXISTS service_health (
+    url TEXT NOT NULL,
+    service_type TEXT NOT NULL,
+    version TEXT NOT NULL,
+    checked REAL NOT NULL,
+    available INTEGER NOT NULL,
+    latency REAL,
+    error TEXT,
+    layers TEXT,
+    PRIMARY KEY (url, service_type, version)
+);
+"""
+
+class CapabilitiesStore(object):
+    """
+    On-disk store of parsed capability summaries, backed by a sqlite database
+    in WAL mode so that every paster/uwsgi worker on a host can read and write
+    it at the same time.  A worker that starts cold reads its summaries from
+    here instead of downloading and parsing the GetCapabilities documents
+    again.
+    """
+
+    def __init__(self, path, timeout=5):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        conn = self._connection()
+        with conn:
+            conn.executescript(SCHEMA)
+
+    def _connection(self):
+        # sqlite connections can neither be shared between threads nor
+        # survive a fork, so keep one per thread and per process.
+        conn = getattr(self._local, 'connection', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        """
+        Read one summary from disk.
+
+        @param key: tuple of (normalized URL, service type, version)
+        @return: dictionary with 'summary', 'etag', 'last_modified' and
+                 'fetched', or None if nothing is stored for this key
+        """
+        row = self._connection().execute(
+            'SELECT summary, etag, last_modified, fetched FROM capabilities '
+            'WHERE url = ? AND service_type = ? AND version = ?',
+            key).fetchone()
+        if row is None:
+            return None
+        return {'summary': json.loads(row[0]),
+                'etag': row[1],
+                'last_modified': row[2],
+                'fetched': row[3]}
+
+    def put(self, key, summary, etag=None, last_modified=None, fetched=None):
+        """
+        Write one summary to disk, replacing whatever was stored before.
+
+        @param key: tuple of (normalized URL, service type, version)
+        @param summary: JSON-serializable capabilities summary
+        @param etag: ETag header of the response the summary was built from
+        @param last_modified: Last-Modified header of that response
+        @param fetched: time the document was fetched, defaults to now
+        @return: nothing
+        """
+        url, service_type, version = key
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO capabilities VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (url, service_type, version, json.dumps(summary), etag,
+                 last_modified, fetched or time.time()))
+
+    def touch(self, key, fetched=None):
+        """
+        Mark a stored summary as freshly revalidated without rewriting it.
+        """
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                'UPDATE capabilities SET fetched = ? '
+                'WHERE url = ? AND service_type = ? AND version = ?',
+                (fetched or time.time(),) + tuple(key))
+
+    def delete(self, key=None):
+        """
+        Remove one summary, or every summary if called without a key.
+        """
+        conn = self._connection()
+        with conn:
+            if key is None:
+                conn.execute('DELETE FROM capabilities')
+            else:
+                conn.execute(
+                    'DELETE FROM capabilities '
+                    'WHERE url = ? AND service_type = ? AND version = ?', key)
+
+    def record_health(self, key, available, latency=None, error=None,
+                      layers=None, checked=None):
+        """
+        Record the outcome of one health check of a service.
+
+        @param key: tuple of (normalized URL, service type, version)
+        @param available: whether the service answered with usable capabilities
+        @param latency: seconds the check took
+        @param error: error message if the service was not available
+        @param layers: list of layer names the service advertised
+        @param checked: time of the check, defaults to now
+        @return: nothing
+        """
+        url, service_type, version = key
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO service_health '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (url, service_type, version, checked or time.time(),
+                 int(bool(available)), latency, error,
+                 json.dumps(layers or [])))
+
+    def health_report(self, available=None):
+        """
+        Read the last recorded health check of every service.
+
+        @param available: only return services that were (True) or were not
+                          (False) available at their last check
+        @return: list of dictionaries, slowest services first
+        """
+        query = 'SELECT url, service_type, version, checked, available, ' \
+                'latency, error, layers FROM service_health'
+        args = ()
+        if available is not None:
+            query += ' WHERE available = ?'
+            args = (int(bool(available)),)
+        query += ' ORDER BY latency DESC'
+
+        keys = ('url', 'service_type', 'version', 'checked', 'available',
+                'latency', 'error', 'layers')
+        report = []
+        for row in self._connection().execute(query, args):
+            record = dict(zip(keys, row))
+            record['available'] = bool(record['available'])
+            record['layers'] = json.loads(record['layers'] or '[]')
+            report.append(record)
+        return report
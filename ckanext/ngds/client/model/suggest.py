@@ -0,0 +1,203 @@
+import bisect
+import heapq
+import logging
+import threading
+import time
+
+from ckanext.ngds.client.model.classifier import tokenize
+
+log = logging.getLogger(__name__)
+
+# Suggestions of each type are ranked above all suggestions of the types after
+# it: content models first, then tags by the number of datasets using them,
+# then dataset titles.
+TYPE_WEIGHTS = {'content_model': 1e9, 'tag': 1e6, 'dataset': 0.0}
+
+def normalize(text):
+    return u' '.join(tokenize(text))
+
+class PrefixIndex(object):
+    """
+    Typeahead suggestions over a fixed set of entries.  Every suffix of an
+    entry's normalized text that starts at a word is kept in one sorted list,
+    so the entries with a word starting with some prefix are a single slice
+    of it, found by binary search.  Slices of more than 'SCAN' keys would be
+    too slow to rank on every keystroke, so the best suggestions for every
+    prefix with such a slice are ranked once, up front, each from the best of
+    the longer prefixes within it.
+    """
+    SCAN = 1000
+
+    def __init__(self, entries, limit=10):
+        """
+        @param entries: iterable of (text, type, weight, name) tuples, where
+                        'name' identifies the dataset, tag or content model
+        @param limit: most suggestions returned for one prefix
+        """
+        self.limit = limit
+        self.entries = []
+        keys = []
+        for text, kind, weight, name in entries:
+            words = normalize(text).split()
+            if not words:
+                continue
+            index = len(self.entries)
+            self.entries.append((TYPE_WEIGHTS.get(kind, 0.0) + weight,
+                                 -len(text), text, kind, name))
+            for start in xrange(len(words)):
+                keys.append((u' '.join(words[start:]), index))
+        keys.sort()
+        self.keys = [key for key, _ in keys]
+        self.indexes = [index for _, index in keys]
+
+        self.ranked = {}
+        if len(self.keys) > self.SCAN:
+            self._rank(u'', 0, len(self.keys))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _best(self, candidates):
+        entries = self.entries
+        # Best weight first, then the shortest text, then the first listed
+        return heapq.nlargest(self.limit, set(candidates),
+                              key=lambda i: (entries[i][0], entries[i][1], -i))
+
+    def _range(self, prefix, lo=0, hi=None):
+        lo = bisect.bisect_left(self.keys, prefix, lo, hi or len(self.keys))
+        return lo, bisect.bisect_left(self.keys, prefix + u'\uffff', lo,
+                                      hi or len(self.keys))
+
+    def _rank(self, prefix, lo, hi):
+        # Keys equal to the prefix come first, then one slice for each
+        # character that can follow it.
+        candidates = []
+        depth = len(prefix)
+        while lo < hi and len(self.keys[lo]) == depth:
+            candidates.append(self.indexes[lo])
+            lo += 1
+        while lo < hi:
+            child = prefix + self.keys[lo][depth]
+            child_lo, child_hi = self._range(child, lo, hi)
+            if child_hi - child_lo > self.SCAN:
+                candidates.extend(self._rank(child, child_lo, child_hi))
+            else:
+                candidates.extend(self._best(self.indexes[child_lo:child_hi]))
+            lo = child_hi
+        best = self.ranked[prefix] = self._best(candidates)
+        return best
+
+    def suggest(self, prefix, limit=None):
+        """
+        @param prefix: text typed so far
+        @param limit: most suggestions to return, at most the index's limit
+        @return: list of dictionaries with 'value', 'type' and 'name', best
+                 first
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        best = self.ranked.get(prefix)
+        if best is None:
+            lo, hi = self._range(prefix)
+            best = self._best(self.indexes[lo:hi])
+        return [{'value': self.entries[i][2], 'type': self.entries[i][3],
+                 'name': self.entries[i][4]}
+                for i in best[:limit or self.limit]]
+
+def catalog_entries(model, content_models=()):
+    """
+    Read the entries to suggest from the database.
+
+    @param model: base CKAN model object
+    @param content_models: names of the USGIN content models
+    @return: list of (text, type, weight, name) tuples for the titles and tags
+             of active public datasets and the content models
+    """
+    from sqlalchemy import func
+
+    Package, PackageTag, Tag = model.Package, model.PackageTag, model.Tag
+    public = (Package.state == 'active', Package.private == False)
+
+    entries = [(name, 'content_model', 0.0, name) for name in content_models]
+    for name, title in model.Session.query(Package.name, Package.title)\
+            .filter(*public):
+        entries.append((title or name, 'dataset', 0.0, name))
+    for name, count in model.Session.query(Tag.name,
+                                           func.count(PackageTag.package_id))\
+            .join(PackageTag, PackageTag.tag_id == Tag.id)\
+            .join(Package, Package.id == PackageTag.package_id)\
+            .filter(PackageTag.state == 'active').filter(*public)\
+            .group_by(Tag.name):
+        entries.append((name, 'tag', float(count), name))
+    return entries
+
+class SuggestionCache(object):
+    """
+    The prefix index shared by every request in the process.  It is built on
+    first use and rebuilt once it is 'ttl' seconds old or datasets have
+    changed; rebuilds run in a background thread while the old index keeps
+    answering, so no typeahead request waits for one except the very first.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.index = None
+        self._built = 0
+        self._stale = False
+        self._building = False
+        self._lock = threading.Lock()
+
+    def _rebuild(self, build, cleanup=None):
+        try:
+            index = build()
+            with self._lock:
+                self.index = index
+                self._built = time.time()
+        except Exception, e:
+            log.warning('Could not rebuild the suggestion index: %s' % e)
+        finally:
+            with self._lock:
+                self._building = False
+            if cleanup is not None:
+                cleanup()
+
+    def get(self, build, cleanup=None):
+        """
+        @param build: function returning a new PrefixIndex
+        @param cleanup: function called in the background thread after a
+                        rebuild, e.g. to release its database session
+        @return: the current PrefixIndex
+        """
+        with self._lock:
+            expired = self._stale or time.time() - self._built > self.ttl
+            start = expired and not self._building
+            if start:
+                self._building = True
+                self._stale = False
+            index = self.index
+        if index is None:
+            if start:
+                self._rebuild(build)
+            return self.index if self.index is not None else PrefixIndex([])
+        if start:
+            thread = threading.Thread(target=self._rebuild,
+                                      args=(build, cleanup))
+            thread.daemon = True
+            thread.start()
+        return index
+
+    def invalidate(self):
+        with self._lock:
+            self._stale = True
+
+# The index is shared by every request in the process.
+suggestion_cache = SuggestionCache()
+
+def configure(ttl=None):
+    """
+    @param ttl: seconds before the suggestion index is rebuilt
+    @return: nothing
+    """
+    if ttl is not None:
+        suggestion_cache.ttl = float(ttl)
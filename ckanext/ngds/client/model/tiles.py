@@ -0,0 +1,284 @@
+import errno
+import hashlib
+import logging
+import math
+import os
+import tempfile
+import threading
+
+log = logging.getLogger(__name__)
+
+MERCATOR_EXTENT = 20037508.342789244
+
+class TileGrid(object):
+    """
+    A fixed pyramid of 256x256 pixel tiles over one spatial reference system.
+    Zoom level 0 is made up of 'columns' by 'rows' tiles covering 'extent',
+    and every level doubles both.  Tiles are numbered from the top left, the
+    way Leaflet and OpenLayers number them.
+    """
+
+    def __init__(self, srs, extent, columns=1, rows=1, size=256):
+        self.srs = srs
+        self.extent = extent
+        self.columns = columns
+        self.rows = rows
+        self.size = size
+
+    def tile_span(self, z):
+        minx, miny, maxx, maxy = self.extent
+        return ((maxx - minx) / (self.columns << z),
+                (maxy - miny) / (self.rows << z))
+
+    def valid(self, z, x, y):
+        return 0 <= z <= 30 and 0 <= x < (self.columns << z) \
+            and 0 <= y < (self.rows << z)
+
+    def tile_bbox(self, z, x, y):
+        """
+        @return: (minx, miny, maxx, maxy) of one tile, in the grid's SRS
+        """
+        dx, dy = self.tile_span(z)
+        minx, maxy = self.extent[0], self.extent[3]
+        return (minx + x * dx, maxy - (y + 1) * dy,
+                minx + (x + 1) * dx, maxy - y * dy)
+
+    def tile_for_bbox(self, bbox, width, height, tolerance=1e-6):
+        """
+        Find the tile a GetMap request is asking for.
+
+        @param bbox: (minx, miny, maxx, maxy) in the grid's SRS
+        @param width: requested image width in pixels
+        @param height: requested image height in pixels
+        @return: (z, x, y), or None if the request does not line up with a
+                 tile of this grid
+        """
+        if (width, height) != (self.size, self.size):
+            return None
+        minx, miny, maxx, maxy = bbox
+        span = self.extent[2] - self.extent[0]
+        columns = span / (maxx - minx) if maxx > minx else 0
+        if columns <= 0:
+            return None
+        z = int(round(math.log(columns / self.columns, 2)))
+        if z < 0:
+            return None
+        dx, dy = self.tile_span(z)
+        x = int(round((minx - self.extent[0]) / dx))
+        y = int(round((self.extent[3] - maxy) / dy))
+        if not self.valid(z, x, y):
+            return None
+        expected = self.tile_bbox(z, x, y)
+        if any(abs(a - b) > tolerance * max(dx, dy)
+               for a, b in zip(expected, bbox)):
+            return None
+        return z, x, y
+
+    def from_wgs84(self, lon, lat):
+        return lon, lat
+
+    def to_wgs84(self, x, y):
+        return x, y
+
+    def tiles_in_bbox(self, bbox, z):
+        """
+        List the tiles of one zoom level that intersect a WGS84 bounding box.
+
+        @param bbox: (minx, miny, maxx, maxy) in WGS84
+        @param z: zoom level
+        @return: list of (z, x, y)
+        """
+        minx, miny = self.from_wgs84(bbox[0], bbox[1])
+        maxx, maxy = self.from_wgs84(bbox[2], bbox[3])
+        dx, dy = self.tile_span(z)
+        last_x, last_y = (self.columns << z) - 1, (self.rows << z) - 1
+        x0 = max(0, int(math.floor((minx - self.extent[0]) / dx)))
+        x1 = min(last_x, int(math.floor((maxx - self.extent[0]) / dx)))
+        y0 = max(0, int(math.floor((self.extent[3] - maxy) / dy)))
+        y1 = min(last_y, int(math.floor((self.extent[3] - miny) / dy)))
+        return [(z, x, y) for y in range(y0, y1 + 1)
+                for x in range(x0, x1 + 1)]
+
+class MercatorGrid(TileGrid):
+    """
+    The spherical Mercator grid used by OpenStreetMap and Google base maps.
+    """
+
+    def __init__(self, srs='EPSG:3857'):
+        super(MercatorGrid, self).__init__(srs, (-MERCATOR_EXTENT,
+                                                 -MERCATOR_EXTENT,
+                                                 MERCATOR_EXTENT,
+                                                 MERCATOR_EXTENT))
+
+    def from_wgs84(self, lon, lat):
+        lat = max(min(lat, 85.0511287798), -85.0511287798)
+        x = lon * MERCATOR_EXTENT / 180.0
+        y = math.log(math.tan(math.pi / 4 + math.radians(lat) / 2)) \
+            * MERCATOR_EXTENT / math.pi
+        return x, y
+
+    def to_wgs84(self, x, y):
+        lon = x * 180.0 / MERCATOR_EXTENT
+        lat = math.degrees(2 * math.atan(math.exp(y * math.pi /
+                                                  MERCATOR_EXTENT))
+                           - math.pi / 2)
+        return lon, lat
+
+# Grids tiles can be requested in, by the SRS name used in GetMap requests.
+# Zoom level 0 of the geographic grid is two tiles covering the whole world.
+GRIDS = {
+    'EPSG:4326': TileGrid('EPSG:4326', (-180.0, -90.0, 180.0, 90.0), 2, 1),
+    'EPSG:3857': MercatorGrid('EPSG:3857'),
+    'EPSG:900913': MercatorGrid('EPSG:900913')
+}
+
+# Names the same grid goes by in capabilities documents, in order of preference.
+SRS_ALIASES = {
+    'EPSG:4326': ['EPSG:4326', 'CRS:84'],
+    'EPSG:3857': ['EPSG:3857', 'EPSG:900913', 'EPSG:102100'],
+    'EPSG:900913': ['EPSG:900913', 'EPSG:3857', 'EPSG:102100']
+}
+
+class TileCache(object):
+    """
+    Size-bounded on-disk cache of rendered map tiles.  Each tile is stored in
+    a file named after the SHA-1 of the GetMap request that produced it, so
+    the same tile requested through different resources is only stored
+    once, and several worker processes can share the directory.  Reading a
+    tile bumps its modification time; when the cache grows past 'max_size'
+    bytes, the least recently read tiles are removed until it is back under
+    nine tenths of that.
+    """
+
+    def __init__(self, directory, max_size=1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self._size = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(*parts):
+        return hashlib.sha1('\n'.join(unicode(part).encode('utf-8')
+                                      for part in parts)).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:])
+
+    def get(self, key):
+        """
+        Read one tile.
+
+        @param key: key from 'make_key'
+        @return: the tile's bytes, or None if it is not cached
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path, None)
+        except (IOError, OSError), e:
+            if e.errno != errno.ENOENT:
+                log.warning('Could not read tile %s: %s' % (path, e))
+            return None
+        return data
+
+    def put(self, key, data):
+        """
+        Store one tile, evicting old tiles if the cache is over its size.
+        The file is written under a temporary name and renamed into place so
+        that readers never see half a tile.
+
+        @param key: key from 'make_key'
+        @param data: the tile's bytes
+        @return: nothing
+        """
+        path = self.path(key)
+        directory = os.path.dirname(path)
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        handle, temp = tempfile.mkstemp(dir=directory, prefix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                f.write(data)
+            os.rename(temp, path)
+        except Exception:
+            os.unlink(temp)
+            raise
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._scan())
+            else:
+                self._size += len(data)
+            over = self._size > self.max_size
+        if over:
+            self.evict()
+
+    def _scan(self):
+        # Files being written by 'put', in this or another process, are left
+        # alone: they are not tiles yet, and are about to be renamed.
+        tiles = []
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if name.startswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                tiles.append((stat.st_mtime, stat.st_size, path))
+        return tiles
+
+    def evict(self):
+        """
+        Remove the least recently read tiles until the cache is back under
+        nine tenths of its maximum size.  The directory is rescanned, so tiles
+        written by other processes are accounted for.
+
+        @return: number of tiles removed
+        """
+        with self._lock:
+            tiles = sorted(self._scan())
+            size = sum(tile[1] for tile in tiles)
+            target = self.max_size * 0.9
+            removed = 0
+            for mtime, tile_size, path in tiles:
+                if size <= target:
+                    break
+                try:
+                    os.unlink(path)
+                except OSError:
+                    continue
+                size -= tile_size
+                removed += 1
+            self._size = size
+        return removed
+
+    def __len__(self):
+        return len(self._scan())
+
+# The tile cache is shared by every tile request in the process; it stays
+# disabled until a directory is configured.
+tile_cache = None
+
+def configure(directory=None, max_size=None):
+    """
+    Apply settings from the CKAN config file to the shared tile cache.
+
+    @param directory: directory tiles are stored in; disables the cache if
+                      empty
+    @param max_size: maximum size of the cache in megabytes
+    @return: nothing
+    """
+    global tile_cache
+    if not directory:
+        tile_cache = None
+        return
+    tile_cache = TileCache(directory)
+    if max_size is not None:
+        tile_cache.max_size = int(max_size) * 1024 * 1024
@@ -0,0 +1,303 @@
+import logging
+import os
+import threading
+import time
+import urlparse
+
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+import requests
+from requests.adapters import HTTPAdapter
+
+log = logging.getLogger(__name__)
+
+class HostBusy(IOError):
+    """
+    Raised when every connection slot for a host stays taken for longer than
+    the connect timeout.
+    """
+    pass
+
+class ServiceUnavailable(IOError):
+    """
+    Raised without touching the network when a URL failed moments ago or its
+    host's circuit breaker is open.
+    """
+    pass
+
+class CircuitBreaker(object):
+    """
+    Per-host circuit breaker.  After 'threshold' consecutive failures the
+    circuit opens and every request fails immediately.  Once 'reset_timeout'
+    seconds have passed, a single probe request is let through (half-open):
+    if it succeeds the circuit closes again, otherwise it re-opens for another
+    'reset_timeout'.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold=3, reset_timeout=60):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and \
+                    time.time() - self.opened_at >= self.reset_timeout:
+                # This caller becomes the probe; everyone else keeps failing
+                # fast until it reports back.
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                self.state = self.OPEN
+                self.opened_at = time.time()
+
+    def abandon(self):
+        # The request never reached the host, so it tells us nothing; let the
+        # next caller probe instead.
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+class HostLimiter(object):
+    """
+    Counting semaphore whose acquire gives up after a timeout, which the
+    Python 2 threading.Semaphore can't do.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self._condition = threading.Condition(threading.Lock())
+
+    def acquire(self, timeout):
+        with self._condition:
+            if self.active >= self.limit:
+                self._condition.wait(timeout)
+            if self.active >= self.limit:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+class OGCHttpClient(object):
+    """
+    Shared HTTP layer for all WMS/WFS traffic.  Requests go through one
+    keep-alive connection pool per host, at most 'per_host' of them run
+    against the same host at once, and every request has a connect and a read
+    timeout.  'map' runs a function over many items on a shared thread pool,
+    so that capability and feature requests for different services can be
+    made in parallel.
+
+    Connection errors, timeouts and 5xx responses count as failures.  A
+    failed URL is remembered for 'negative_ttl' seconds and each host has a
+    CircuitBreaker, so requests to a service that is known to be down raise
+    ServiceUnavailable at once instead of waiting out the timeout again.
+    """
+
+    def __init__(self, pool_size=10, per_host=4, connect_timeout=5,
+                 read_timeout=30, workers=8, failure_threshold=3,
+                 reset_timeout=60, negative_ttl=30, negative_size=1000):
+        self.pool_size = pool_size
+        self.per_host = per_host
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.workers = workers
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.negative_ttl = negative_ttl
+        self.negative_size = negative_size
+        self._lock = threading.Lock()
+        self._limiters = {}
+        self._breakers = {}
+        self._failed = OrderedDict()
+        self._session = None
+        self._pool = None
+        self._pid = None
+
+    def _reset_after_fork(self):
+        # Sockets and threads don't survive a fork, so each worker process
+        # builds its own session and thread pool on first use.
+        if self._pid != os.getpid():
+            self._session = None
+            self._pool = None
+            self._limiters = {}
+            self._breakers = {}
+            self._failed = OrderedDict()
+            self._pid = os.getpid()
+
+    @property
+    def session(self):
+        with self._lock:
+            self._reset_after_fork()
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.pool_size,
+                                      pool_maxsize=self.per_host)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+            return self._session
+
+    @property
+    def pool(self):
+        with self._lock:
+            self._reset_after_fork()
+            if self._pool is None:
+                self._pool = ThreadPool(self.workers)
+            return self._pool
+
+    def limiter(self, url):
+        host = urlparse.urlsplit(url).netloc.lower()
+        with self._lock:
+            self._reset_after_fork()
+            if host not in self._limiters:
+                self._limiters[host] = HostLimiter(self.per_host)
+            return self._limiters[host]
+
+    def breaker(self, url):
+        host = urlparse.urlsplit(url).netloc.lower()
+        with self._lock:
+            self._reset_after_fork()
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(self.failure_threshold,
+                                                      self.reset_timeout)
+            return self._breakers[host]
+
+    def recent_failure(self, url):
+        """
+        Return the error a URL failed with less than 'negative_ttl' seconds
+        ago, or None.
+        """
+        with self._lock:
+            self._reset_after_fork()
+            failed = self._failed.get(url)
+            if failed is None:
+                return None
+            expires, error = failed
+            if expires <= time.time():
+                del self._failed[url]
+                return None
+            return error
+
+    def _remember_failure(self, url, error):
+        with self._lock:
+            self._reset_after_fork()
+            self._failed.pop(url, None)
+            self._failed[url] = (time.time() + self.negative_ttl, error)
+            while len(self._failed) > self.negative_size:
+                self._failed.popitem(last=False)
+
+    def get(self, url, headers=None):
+        """
+        GET a URL through the shared connection pool and read the whole body.
+
+        @param url: URL to fetch
+        @param headers: extra request headers
+        @return: requests.Response
+        """
+        error = self.recent_failure(url)
+        if error is not None:
+            raise ServiceUnavailable('%s failed recently: %s' % (url, error))
+
+        breaker = self.breaker(url)
+        if not breaker.allow():
+            raise ServiceUnavailable('Circuit open for %s' % url)
+
+        limiter = self.limiter(url)
+        if not limiter.acquire(self.connect_timeout):
+            breaker.abandon()
+            raise HostBusy('Too many concurrent requests to %s' % url)
+        try:
+            response = self.session.get(url, headers=headers or {},
+                                        timeout=(self.connect_timeout,
+                                                 self.read_timeout))
+        except (requests.ConnectionError, requests.Timeout), e:
+            breaker.failure()
+            self._remember_failure(url, str(e) or e.__class__.__name__)
+            raise
+        except Exception:
+            breaker.abandon()
+            raise
+        finally:
+            limiter.release()
+
+        if response.status_code >= 500:
+            breaker.failure()
+            self._remember_failure(url, 'HTTP %s' % response.status_code)
+        else:
+            breaker.success()
+        return response
+
+    def map(self, function, items):
+        """
+        Apply a function to every item on the shared thread pool.  The
+        function must not call 'map' itself, or the pool can run out of
+        threads waiting on each other.
+
+        @param function: callable taking one item
+        @param items: iterable of items
+        @return: list of results, in the order of the items
+        """
+        items = list(items)
+        if len(items) < 2:
+            return [function(item) for item in items]
+        return self.pool.map(function, items)
+
+# The client is shared by every HandleWMS/HandleWFS object in the process.
+http_client = OGCHttpClient()
+
+def configure(pool_size=None, per_host=None, connect_timeout=None,
+              read_timeout=None, workers=None, failure_threshold=None,
+              reset_timeout=None, negative_ttl=None):
+    """
+    Apply settings from the CKAN config file to the shared HTTP client.
+
+    @param pool_size: number of hosts to keep connection pools for
+    @param per_host: concurrent requests and pooled connections per host
+    @param connect_timeout: seconds to wait for a connection
+    @param read_timeout: seconds to wait for data on an open connection
+    @param workers: size of the shared thread pool
+    @param failure_threshold: consecutive failures that open a host's circuit
+    @param reset_timeout: seconds an open circuit waits before a probe
+    @param negative_ttl: seconds a failed URL keeps failing without a request
+    @return: nothing
+    """
+    if pool_size is not None:
+        http_client.pool_size = int(pool_size)
+    if per_host is not None:
+        http_client.per_host = int(per_host)
+    if connect_timeout is not None:
+        http_client.connect_timeout = float(connect_timeout)
+    if read_timeout is not None:
+        http_client.read_timeout = float(read_timeout)
+    if workers is not None:
+        http_client.workers = int(workers)
+    if failure_threshold is not None:
+        http_client.failure_threshold = int(failure_threshold)
+    if reset_timeout is not None:
+        http_client.reset_timeout = float(reset_timeout)
+    if negative_ttl is not None:
+        http_client.negative_ttl = float(negative_ttl)
@@ -1,17 +1,27 @@
+import os
+
 from ckanext.ngds.common import plugins as p
 from ckanext.ngds.client.logic import action
+from ckanext.ngds.client.model import capabilities
+from ckanext.ngds.client.model import classifier
+from ckanext.ngds.client.model import facets
+from ckanext.ngds.client.model import indexing
+from ckanext.ngds.client.model import mirror
+from ckanext.ngds.client.model import suggest
+from ckanext.ngds.client.model import tiles
+from ckanext.ngds.client.model import transport
 
 class NGDSClient(p.SingletonPlugin):
 
     p.implements(p.IConfigurer, inherit=True)
     p.implements(p.IRoutes, inherit=True)
     p.implements(p.IActions, inherit=True)
+    p.implements(p.IPackageController, inherit=True)
 
     """
     p.implements(p.ITemplateHelpers, inherit=True)
     p.implements(p.IAuthFunctions)
     p.implements(p.IFacets)
-    p.implements(p.IPackageController)
     p.implements(p.IDatasetForm)
     """
 
@@ -26,6 +36,88 @@ class NGDSClient(p.SingletonPlugin):
         p.toolkit.add_public_directory(config, 'public')
         p.toolkit.add_resource('fanstatic', 'client')
 
+        # Size and lifetime of the process-wide GetCapabilities cache shared
+        # by every WMS/WFS handler, and the sqlite file that lets a freshly
+        # started worker pick up summaries parsed by the ones before it.
+        store_path = config.get('ngds.ogc.capabilities_store')
+        if store_path is None and config.get('cache_dir'):
+            store_path = os.path.join(config.get('cache_dir'), 'ngds',
+                                      'capabilities.db')
+        capabilities.configure(
+            ttl=config.get('ngds.ogc.capabilities_ttl', 3600),
+            max_size=config.get('ngds.ogc.capabilities_cache_size', 128),
+            store_path=store_path)
+
+        # Connection pooling, per-host limits, timeouts and failure tracking
+        # for all WMS/WFS traffic.
+        transport.configure(
+            pool_size=config.get('ngds.ogc.http_pool_size', 10),
+            per_host=config.get('ngds.ogc.http_per_host', 4),
+            connect_timeout=config.get('ngds.ogc.connect_timeout', 5),
+            read_timeout=config.get('ngds.ogc.read_timeout', 30),
+            workers=config.get('ngds.ogc.workers', 8),
+            failure_threshold=config.get('ngds.ogc.failure_threshold', 3),
+            reset_timeout=config.get('ngds.ogc.breaker_reset', 60),
+            negative_ttl=config.get('ngds.ogc.negative_ttl', 30))
+
+        # Directory and size, in megabytes, of the disk cache that WMS tiles
+        # are served from.
+        tile_dir = config.get('ngds.ogc.tile_cache')
+        if tile_dir is None and config.get('cache_dir'):
+            tile_dir = os.path.join(config.get('cache_dir'), 'ngds', 'tiles')
+        tiles.configure(directory=tile_dir,
+                        max_size=config.get('ngds.ogc.tile_cache_size', 1024))
+
+        # Opt-in local copy of hot WFS layers, served instead of their
+        # upstream services, and how often its layers are synced regardless.
+        mirror.configure(config.get('ngds.ogc.feature_mirror'),
+                         config.get('ngds.ogc.feature_mirror_max_age', 86400))
+
+        # Keyword list that datasets are matched against to fill in their
+        # content models when they are indexed.
+        classifier.configure(config.get('ngds.content_model_keywords'))
+
+        # Facet tree counted by the 'ngds_facets' action, and how long its
+        # counts are reused for the same search.
+        facets.configure(config.get('ngds.facet_config'),
+                         config.get('ngds.facet_cache_ttl', 60))
+
+        # Whether datasets without an extent in their metadata get the extent
+        # of their WMS/WFS layers when they are indexed, which may request
+        # the capabilities of every such service.
+        indexing.configure(p.toolkit.asbool(
+            config.get('ngds.spatial.service_extents', False)))
+
+        # How long the typeahead's prefix index of the catalog is used before
+        # it is rebuilt in the background.
+        suggest.configure(config.get('ngds.suggest_ttl', 300))
+
+    def before_index(self, pkg_dict):
+        """
+        Extends 'before_index' function in IPackageController object.  Fills
+        the NGDS-specific search fields: 'res_content_model' behind the
+        Content Model facet with the USGIN content models the dataset's title,
+        description and tags match, 'author_string' and 'maintainer_string'
+        behind the Author facet, and the spatial fields that
+        'ngds_bbox_search' queries with the dataset's extent.  Fields the
+        dataset already declares are left alone.
+
+        @param pkg_dict: dictionary that is about to be indexed
+        @return: dictionary to index
+        """
+        pkg_dict.update(indexing.ngds_fields(pkg_dict))
+        return pkg_dict
+
+    def after_create(self, context, pkg_dict):
+        # Titles and tags may have changed, so rebuild the typeahead's index
+        suggest.suggestion_cache.invalidate()
+
+    def after_update(self, context, pkg_dict):
+        suggest.suggestion_cache.invalidate()
+
+    def after_delete(self, context, pkg_dict):
+        suggest.suggestion_cache.invalidate()
+
     def before_map(self, map):
         controller = 'ckanext.ngds.client.controllers.view:ViewController'
         map.connect('ngds_developers', '/ngds/developers', controller=controller,
@@ -34,9 +126,32 @@ class NGDSClient(p.SingletonPlugin):
                     action='render_help')
         map.connect('ngds_contact', '/ngds/contact', controller=controller,
                     action='render_contact')
+
+        controller = 'ckanext.ngds.client.controllers.features:FeatureController'
+        map.connect('ngds_geojson', '/ngds/resource/{id}/geojson',
+                    controller=controller, action='render_geojson')
+        map.connect('ngds_recline', '/ngds/resource/{id}/recline',
+                    controller=controller, action='render_recline')
+        map.connect('ngds_schema', '/ngds/resource/{id}/schema',
+                    controller=controller, action='render_schema')
+
+        controller = 'ckanext.ngds.client.controllers.tiles:TileController'
+        map.connect('ngds_tile', '/ngds/resource/{id}/tiles/{z}/{x}/{y}',
+                    controller=controller, action='render_tile')
+        map.connect('ngds_getmap', '/ngds/resource/{id}/wms',
+                    controller=controller, action='render_getmap')
+        map.connect('ngds_vector_tile', '/ngds/resource/{id}/vector/{z}/{x}/{y}',
+                    controller=controller, action='render_vector_tile')
+
+        controller = 'ckanext.ngds.client.controllers.suggest:SuggestController'
+        map.connect('ngds_suggest', '/ngds/suggest', controller=controller,
+                    action='suggest')
         return map
 
     def get_actions(self):
         return {
-            'geothermal_prospector_url': action.geothermal_prospector_url
+            'geothermal_prospector_url': action.geothermal_prospector_url,
+            'geothermal_prospector_urls': action.geothermal_prospector_urls,
+            'ngds_facets': action.ngds_facets,
+            'ngds_bbox_search': action.ngds_bbox_search
         }
\ No newline at end of file
@@ -132,3 +132,18 @@ class TestNgdsClientAction(object):
         result = self.actions.geothermal_prospector_url(context, {'id': str(uuid.uuid4())})
 
         assert result == 'error'
+
+    #Test batch ngdsClient logic geothermal_prospector_urls method
+    def test_geothermalProspectorUrls(self):
+        print 'test_geothermalProspectorUrls(): Running actual test code ..........................'
+
+        context = {'user': self.sysadmin_user.name}
+        badID = str(uuid.uuid4())
+        result = self.actions.geothermal_prospector_urls(context, {'ids': [self.resourceID, badID]})
+
+        assert result[self.resourceID] != 'error'
+        assert result[badID] == 'error'
+
+        #second call for the same resource is served from the cache
+        single = self.actions.geothermal_prospector_url(context, {'id': self.resourceID})
+        assert single == result[self.resourceID]
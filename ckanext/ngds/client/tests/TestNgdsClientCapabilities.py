@@ -0,0 +1,139 @@
+from owslib.wms import WebMapService
+
+import ckanext.ngds.client.model.capabilities as ngdsClientCapabilities
+
+WMS_CAPABILITIES = """<?xml version="1.0" encoding="UTF-8"?>
+<WMT_MS_Capabilities version="1.1.1" xmlns:xlink="http://www.w3.org/1999/xlink">
+  <Service>
+    <Name>OGC:WMS</Name>
+    <Title>Thermal Springs</Title>
+    <Abstract>Test service</Abstract>
+    <OnlineResource xlink:href="http://example.com/wms"/>
+  </Service>
+  <Capability>
+    <Request>
+      <GetMap>
+        <Format>image/png</Format>
+        <Format>image/jpeg</Format>
+        <DCPType><HTTP><Get>
+          <OnlineResource xlink:href="http://example.com/wms?"/>
+        </Get></HTTP></DCPType>
+      </GetMap>
+    </Request>
+    <Layer>
+      <Title>Root</Title>
+      <SRS>EPSG:4326</SRS>
+      <Layer>
+        <Name>ThermalSprings</Name>
+        <Title>Thermal Springs</Title>
+        <LatLonBoundingBox minx="-124.5" miny="32.5" maxx="-114.1" maxy="42.0"/>
+      </Layer>
+    </Layer>
+  </Capability>
+</WMT_MS_Capabilities>
+"""
+
+class FakeFetch(object):
+    """
+    Stand-in for 'fetch_capabilities' that records every request it gets and
+    answers with a canned WMS capabilities document.
+    """
+
+    def __init__(self, etag='"v1"'):
+        self.etag = etag
+        self.calls = []
+
+    def __call__(self, url, headers=None, timeout=30):
+        self.calls.append((url, headers or {}))
+        if headers and headers.get('If-None-Match') == self.etag:
+            return 304, None, {'ETag': self.etag}
+        return 200, WMS_CAPABILITIES, {'ETag': self.etag}
+
+class TestNgdsClientCapabilities(object):
+
+    #setup executes before each method in this class
+    def setup(self):
+        print ("")
+        print ("TestUM:setup() before each test method")
+        self.fetch = FakeFetch()
+
+    #setup executes after each method in this class
+    def teardown(self):
+        print ("")
+        print ("TestUM:teardown() after each test method")
+        self.fetch = None
+
+    #test that differently written URLs for the same endpoint share a key
+    def test_normalizeUrl(self):
+        print 'test_normalizeUrl(): Running actual test code ..........................'
+
+        a = ngdsClientCapabilities.normalize_url(
+            'HTTP://Example.com/wms?request=GetCapabilities&b=2&a=1&SERVICE=WMS')
+        b = ngdsClientCapabilities.normalize_url('http://example.com/wms?a=1&b=2')
+
+        assert a == b
+
+    #test that a second lookup is served from memory without any network I/O
+    def test_cacheHit(self):
+        print 'test_cacheHit(): Running actual test code ..........................'
+
+        cache = ngdsClientCapabilities.CapabilitiesCache(fetch=self.fetch)
+        first = cache.get('WMS', 'http://example.com/wms?', '1.1.1')
+        second = cache.get('WMS', 'http://example.com/wms', '1.1.1')
+
+        assert first is second
+        assert len(self.fetch.calls) == 1
+
+    #test that the least recently used entry is evicted first
+    def test_lruEviction(self):
+        print 'test_lruEviction(): Running actual test code ..........................'
+
+        cache = ngdsClientCapabilities.CapabilitiesCache(max_size=2,
+                                                         fetch=self.fetch)
+        cache.get('WMS', 'http://a.example.com/wms', '1.1.1')
+        cache.get('WMS', 'http://b.example.com/wms', '1.1.1')
+        cache.get('WMS', 'http://a.example.com/wms', '1.1.1')
+        cache.get('WMS', 'http://c.example.com/wms', '1.1.1')
+
+        assert len(cache) == 2
+        assert len(self.fetch.calls) == 3
+
+        cache.get('WMS', 'http://a.example.com/wms', '1.1.1')
+        assert len(self.fetch.calls) == 3
+
+        cache.get('WMS', 'http://b.example.com/wms', '1.1.1')
+        assert len(self.fetch.calls) == 4
+
+    #test that a stale entry is revalidated with its ETag and not re-parsed
+    def test_etagRevalidation(self):
+        print 'test_etagRevalidation(): Running actual test code ..........................'
+
+        cache = ngdsClientCapabilities.CapabilitiesCache(ttl=0, fetch=self.fetch)
+        first = cache.get('WMS', 'http://example.com/wms', '1.1.1')
+        second = cache.get('WMS', 'http://example.com/wms', '1.1.1')
+
+        assert first is second
+        assert len(self.fetch.calls) == 2
+        assert self.fetch.calls[1][1].get('If-None-Match') == '"v1"'
+
+    #test that the streaming WMS parser builds the same summary as OWSLib
+    def test_parseWmsCapabilities(self):
+        print 'test_parseWmsCapabilities(): Running actual test code ..........................'
+
+        fast = ngdsClientCapabilities.parse_wms_capabilities(WMS_CAPABILITIES, '1.1.1')
+        full = ngdsClientCapabilities.summarize(
+            WebMapService('http://example.com/wms', version='1.1.1', xml=WMS_CAPABILITIES))
+
+        assert fast == full
+
+    #test that layers are looked up without regard to case and summaries skip OWSLib
+    def test_findLayer(self):
+        print 'test_findLayer(): Running actual test code ..........................'
+
+        cache = ngdsClientCapabilities.CapabilitiesCache(fetch=self.fetch)
+        entry = cache.get('WMS', 'http://example.com/wms', '1.1.1')
+
+        assert entry.service is None
+        assert entry.summary.find_layer('thermalsprings')['name'] == 'ThermalSprings'
+        assert entry.summary.find_layer('missing') is None
+        assert entry.summary.layer_names == ['ThermalSprings']
@@ -0,0 +1,70 @@
+import ckanext.ngds.client.model.classifier as ngdsClientClassifier
+
+class TestNgdsClientClassifier(object):
+
+    #setup_class executes (auto once) before anything in this class
+    @classmethod
+    def setup_class(self):
+        print ("")
+        self.classifier = ngdsClientClassifier.ContentModelClassifier.from_csv()
+
+    #setup executes before each method in this class
+    def setup(self):
+        print ("")
+        print ("TestUM:setup() before each test method")
+
+    #setup executes after each method in this class
+    def teardown(self):
+        print ("")
+        print ("TestUM:teardown() after each test method")
+
+    #test that multi-word keywords are matched across token boundaries, and not across tags
+    def test_matches(self):
+        print 'test_matches(): Running actual test code ..........................'
+
+        phrases = dict((' '.join(tokens), index) for (index, (tokens, models, idf))
+                       in enumerate(self.classifier.phrases))
+
+        found = self.classifier.matches(ngdsClientClassifier.tokenize('Measured Slip-Rate of the active fault'))
+        assert phrases['slip rate'] in found
+        assert phrases['active fault'] in found
+        assert phrases['fault'] in found
+
+        score = self.classifier.score({'tags': ['slip', 'rate']})
+        assert score.get('ActiveFaults', 0) == 0
+
+    #test that datasets are given the content models their text is about
+    def test_classify(self):
+        print 'test_classify(): Running actual test code ..........................'
+
+        models = self.classifier.classify({
+            'title': 'Earthquake hypocenters',
+            'notes': 'Catalog of seismic events in the fault zone',
+            'tags': [{'name': 'seismic'}]})
+        assert models[0] == 'SeismicHypocenters'
+
+        assert self.classifier.classify({'title': 'County report', 'notes': '', 'tags': []}) == []
+
+    #test that the benchmark classifies every synthetic dataset
+    def test_benchmark(self):
+        print 'test_benchmark(): Running actual test code ..........................'
+
+        rate, classified = ngdsClientClassifier.benchmark(self.classifier, 200)
+        assert rate > 0
+        assert 0 < classified <= 200
+
+    #test that a missing keyword list disables the classifier instead of failing
+    def test_missingKeywords(self):
+        print 'test_missingKeywords(): Running actual test code ..........................'
+
+        default = ngdsClientClassifier.DEFAULT_KEYWORDS
+        try:
+            ngdsClientClassifier.DEFAULT_KEYWORDS = default + '.missing'
+            ngdsClientClassifier.configure()
+            assert ngdsClientClassifier.content_model_classifier is None
+
+            ngdsClientClassifier.configure(default)
+            assert ngdsClientClassifier.content_model_classifier is not None
+        finally:
+            ngdsClientClassifier.DEFAULT_KEYWORDS = default
+            ngdsClientClassifier.content_model_classifier = None
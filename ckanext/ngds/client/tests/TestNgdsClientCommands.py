@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+
+import ckan.model as model
+
+import ckanext.ngds.client.commands as ngdsClientCommands
+import ckanext.ngds.client.model.mirror as ngdsClientMirror
+import ckanext.ngds.client.model.ogc as ngdsClientModel
+
+URL = 'http://example.com/wfs?'
+
+class FakeResource(object):
+
+    url = URL
+    extras = {'layer': 'azgs:wells'}
+
+class FakeWFS(object):
+    # Stand-in for HandleWFS serving one layer of three wells, whose token can
+    # be changed to make the mirrored copy stale.
+    token = 'etag-1'
+    syncs = []
+
+    def __init__(self, url, version='1.0.0'):
+        self.url = url
+
+    def do_layer_check(self, data_dict):
+        return data_dict['resource']['layer']
+
+    def get_layer_token(self, type_name):
+        return FakeWFS.token
+
+    def sync_mirror(self, type_name, page_size=1000):
+        FakeWFS.syncs.append(type_name)
+        ngdsClientMirror.feature_mirror.add(self.url, type_name)
+        features = [{'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [-112.0 + n, 33.0]},
+                     'properties': {'name': 'well %d' % n}} for n in range(3)]
+        return ngdsClientMirror.feature_mirror.sync(self.url, type_name, features, FakeWFS.token)
+
+class TestNgdsClientCommands(object):
+
+    #setup executes before each method in this class
+    def setup(self):
+        print ("")
+        print ("TestUM:setup() before each test method")
+        self.directory = tempfile.mkdtemp()
+        ngdsClientMirror.configure(os.path.join(self.directory, 'mirror.db'))
+        self.handle_wfs = ngdsClientModel.HandleWFS
+        self.resource_get = model.Resource.__dict__['get']
+        ngdsClientModel.HandleWFS = FakeWFS
+        model.Resource.get = classmethod(lambda cls, id: FakeResource() if id == 'wells' else None)
+        FakeWFS.token = 'etag-1'
+        FakeWFS.syncs = []
+
+    #setup executes after each method in this class
+    def teardown(self):
+        print ("")
+        print ("TestUM:teardown() after each test method")
+        ngdsClientModel.HandleWFS = self.handle_wfs
+        model.Resource.get = self.resource_get
+        ngdsClientMirror.configure(None)
+        shutil.rmtree(self.directory)
+
+    def run(self, *args):
+        command = ngdsClientCommands.OGCCommand('ngds-ogc')
+        command._load_config = lambda: None
+        command.options, command.args = command.parser.parse_args(list(args))
+        command.command()
+
+    #test that layers are mirrored, refreshed once stale and unmirrored through the ngds-ogc command
+    def test_mirrorCommands(self):
+        print 'test_mirrorCommands(): Running actual test code ..........................'
+
+        self.run('mirror', 'wells')
+        assert [record['layer'] for record in ngdsClientMirror.feature_mirror.layers()] == ['azgs:wells']
+        assert ngdsClientMirror.feature_mirror.get(URL, 'azgs:wells')['count'] == 3
+
+        self.run('mirror-refresh')
+        assert FakeWFS.syncs == ['azgs:wells']
+        FakeWFS.token = 'etag-2'
+        self.run('mirror-refresh')
+        assert FakeWFS.syncs == ['azgs:wells', 'azgs:wells']
+        assert ngdsClientMirror.feature_mirror.get(URL, 'azgs:wells')['token'] == 'etag-2'
+
+        self.run('unmirror', 'wells')
+        assert ngdsClientMirror.feature_mirror.layers() == []
@@ -0,0 +1,78 @@
+import ckanext.ngds.client.model.facets as ngdsClientFacets
+
+class FakeSolr(object):
+    """
+    Stand-in for a Solr connection that records every request it gets and
+    answers with fixed facet counts.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, params):
+        self.calls.append(params)
+        return {'facet_counts': {
+            'facet_queries': {u'tags:"Direct Use"': 7, u'private:"true"': 2},
+            'facet_fields': {'res_content_model': ['ThermalSprings', 5, 'HeatFlow', 3]}}}
+
+class TestNgdsClientFacets(object):
+
+    #setup executes before each method in this class
+    def setup(self):
+        print ("")
+        print ("TestUM:setup() before each test method")
+        self.plan = ngdsClientFacets.FacetPlan.from_json()
+        self.solr = FakeSolr()
+
+    #setup executes after each method in this class
+    def teardown(self):
+        print ("")
+        print ("TestUM:teardown() after each test method")
+        self.plan = None
+        self.solr = None
+
+    #test that the plan asks for every facet of the tree, with inherited fields
+    def test_facetPlan(self):
+        print 'test_facetPlan(): Running actual test code ..........................'
+
+        assert u'tags:"Direct Use"' in self.plan.facet_queries
+        assert u'tags:"Casing Diagrams"' in self.plan.facet_queries
+        assert u'res_resource_format:"offline-resource"' in self.plan.facet_queries
+        assert u'private:"true"' in self.plan.facet_queries
+        assert 'res_content_model' in self.plan.facet_fields
+        assert 'author_string' in self.plan.facet_fields
+        assert 'tags' in self.plan.facet_fields
+
+    #test that the whole tree is counted with one request, and counted again only for a new search
+    def test_countFacets(self):
+        print 'test_countFacets(): Running actual test code ..........................'
+
+        cache = ngdsClientFacets.FacetCountCache()
+        tree = ngdsClientFacets.count_facets(self.plan, self.solr, cache=cache)
+        ngdsClientFacets.count_facets(self.plan, self.solr, cache=cache)
+
+        assert len(self.solr.calls) == 1
+
+        category = dict((node['name'], node) for node in tree)['Category']
+        assert category['children'][0]['count'] == 7
+        content_model = dict((node['name'], node) for node in tree)['Content Model']
+        assert content_model['items'][0] == {'name': 'ThermalSprings', 'count': 5}
+
+        ngdsClientFacets.count_facets(self.plan, self.solr, q='heat', cache=cache)
+        assert len(self.solr.calls) == 2
+
+    #test that a missing facet configuration disables the facet plan instead of failing
+    def test_missingFacetConfig(self):
+        print 'test_missingFacetConfig(): Running actual test code ..........................'
+
+        default = ngdsClientFacets.DEFAULT_FACET_CONFIG
+        try:
+            ngdsClientFacets.DEFAULT_FACET_CONFIG = default + '.missing'
+            ngdsClientFacets.configure()
+            assert ngdsClientFacets.facet_plan is None
+
+            ngdsClientFacets.configure(default)
+            assert ngdsClientFacets.facet_plan is not None
+        finally:
+            ngdsClientFacets.DEFAULT_FACET_CONFIG = default
+            ngdsClientFacets.facet_plan = None
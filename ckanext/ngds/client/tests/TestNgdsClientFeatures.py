@@ -0,0 +1,350 @@
+import json
+import os
+import shutil
+import tempfile
+import urlparse
+
+import ckanext.ngds.client.model.capabilities as ngdsClientCapabilities
+import ckanext.ngds.client.model.mirror as ngdsClientMirror
+import ckanext.ngds.client.model.ogc as ngdsClientModel
+import ckanext.ngds.client.model.tiles as ngdsClientTiles
+import ckanext.ngds.client.model.transport as ngdsClientTransport
+
+def summary(formats=(), parameters=None, version='1.1.0'):
+    return ngdsClientCapabilities.Capabilities({
+        'type': 'WFS', 'version': version, 'title': 'Wells', 'abstract': None,
+        'layers': [{'name': 'azgs:wells', 'title': 'Wells', 'bbox': (-115.0, 31.0, -109.0, 37.0), 'crs': []}],
+        'operations': {'GetFeature': {'methods': {'Get': {'url': 'http://example.com/wfs?'}},
+                                      'formats': list(formats), 'parameters': parameters or {}}}})
+
+class FakeResponse(object):
+
+    def __init__(self, content, content_type):
+        self.content = content
+        self.headers = {'Content-Type': content_type}
+
+    def raise_for_status(self):
+        pass
+
+class FakeClient(object):
+
+    def __init__(self, content, content_type='application/json'):
+        self.response = FakeResponse(content, content_type)
+        self.urls = []
+
+    def get(self, url, headers=None):
+        self.urls.append(url)
+        return self.response
+
+class RoutingClient(object):
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.urls = []
+
+    def get(self, url, headers=None):
+        self.urls.append(url)
+        query = urlparse.parse_qs(urlparse.urlparse(url).query)
+        route = (query.get('resultType') or query.get('request'))[0]
+        return FakeResponse(self.routes[route], 'text/xml')
+
+DESCRIBE_WELLS = ('<xsd:schema xmlns:xsd="http://www.w3.org/2001/XMLSchema"><xsd:element name="wells">'
+                  '<xsd:complexType><xsd:sequence><xsd:element name="n" type="xsd:int"/>'
+                  '<xsd:element name="the_geom" type="gml:PointPropertyType"/></xsd:sequence></xsd:complexType>'
+                  '</xsd:element></xsd:schema>')
+
+class ProjectedWFS(object):
+    # A WFS serving a 10 by 10 grid of wells, including wells on the edges of the layer's bounding box, in a projected
+    # CRS unless asked for EPSG:4326.  Understands bbox, maxfeatures, startIndex/count and propertyName, and describes
+    # the layer with DESCRIBE_WELLS.
+
+    def __init__(self):
+        self.wells = [(-115.0 + 6.0 * i / 9, 31.0 + 6.0 * j / 9) for i in range(10) for j in range(10)]
+        self.urls = []
+
+    def get(self, url, headers=None):
+        self.urls.append(url)
+        query = dict(urlparse.parse_qsl(urlparse.urlparse(url).query))
+        if query.get('request') == 'DescribeFeatureType':
+            return FakeResponse(DESCRIBE_WELLS, 'text/xml')
+        if 'IOError' in query.get('typename'):
+            raise IOError('Connection refused')
+        wells = list(enumerate(self.wells))
+        if 'bbox' in query:
+            minx, miny, maxx, maxy = [float(x) for x in query['bbox'].split(',')[:4]]
+            wells = [(n, (x, y)) for (n, (x, y)) in wells if minx <= x <= maxx and miny <= y <= maxy]
+        start = int(query.get('startIndex', 0))
+        wells = wells[start:start + int(query.get('count') or query.get('maxfeatures') or len(wells))]
+        scale = 1 if query.get('srsName') == 'EPSG:4326' else 111000
+        geometry = 'the_geom' in query.get('propertyName', 'the_geom').split(',')
+        return FakeResponse(json.dumps({'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'properties': {'n': n},
+             'geometry': {'type': 'Point', 'coordinates': [x * scale, y * scale]} if geometry else None}
+            for (n, (x, y)) in wells]}), 'application/json')
+
+class TestNgdsClientFeatures(object):
+
+    #setup executes before each method in this class
+    def setup(self):
+        print ("")
+        print ("TestUM:setup() before each test method")
+        self.get_summary = ngdsClientCapabilities.get_summary
+        self.http_client = ngdsClientTransport.http_client
+
+    #setup executes after each method in this class
+    def teardown(self):
+        print ("")
+        print ("TestUM:teardown() after each test method")
+        ngdsClientCapabilities.get_summary = self.get_summary
+        ngdsClientTransport.http_client = self.http_client
+
+    def handler(self, capabilities, client, version='1.1.0'):
+        ngdsClientCapabilities.get_summary = lambda service_type, url, version: capabilities
+        ngdsClientTransport.http_client = client
+        return ngdsClientModel.HandleWFS('http://example.com/wfs', version)
+
+    #test that GeoJSON output is found among the advertised output formats
+    def test_geojsonFormat(self):
+        print 'test_geojsonFormat(): Running actual test code ..........................'
+
+        wfs = self.handler(summary(parameters={'outputFormat': {'values': ['text/xml; subtype=gml/3.1.1',
+                                                                           'application/json']}}), None)
+        assert wfs.get_geojson_format() == 'application/json'
+
+        wfs = self.handler(summary(formats=['{http://www.opengis.net/wfs}GML2', '{http://www.opengis.net/wfs}JSON']),
+                           None)
+        assert wfs.get_geojson_format() == 'JSON'
+
+        wfs = self.handler(summary(formats=['{http://www.opengis.net/wfs}GML2']), None)
+        assert wfs.get_geojson_format() is None
+
+    #test that features are requested as GeoJSON and passed through untouched when one request is enough
+    def test_nativeGeojson(self):
+        print 'test_nativeGeojson(): Running actual test code ..........................'
+
+        body = json.dumps({'type': 'FeatureCollection', 'totalFeatures': 1, 'features': [
+            {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [-112.0, 33.5]},
+             'properties': {'name': 'well 1'}}]})
+        client = FakeClient(body)
+        wfs = self.handler(summary(parameters={'outputFormat': {'values': ['application/json']}}), client)
+
+        features = wfs.make_geojson({})
+        assert features[0]['properties']['name'] == 'well 1'
+        query = urlparse.parse_qs(urlparse.urlparse(client.urls[0]).query)
+        assert query['outputFormat'] == ['application/json']
+        assert query['srsName'] == ['EPSG:4326']
+
+        assert list(wfs.stream_geojson({}, max_features=100)) == [body]
+
+    #test that a service whose GeoJSON can't be read is no longer asked for it
+    def test_unreadableGeojson(self):
+        print 'test_unreadableGeojson(): Running actual test code ..........................'
+
+        client = FakeClient('<ows:ExceptionReport/>', 'text/xml')
+        wfs = self.handler(summary(parameters={'outputFormat': {'values': ['application/json']}}), client)
+
+        assert wfs.read_geojson_body(wfs.build_url('azgs:wells', outputFormat='application/json')) is None
+        try:
+            wfs.get_features('azgs:wells', maxFeatures=10)
+        except Exception:
+            pass
+        assert wfs.get_geojson_format() is None
+
+    #test that a layer the service can't describe is encoded for Recline with the fields of its first feature
+    def test_streamRecline(self):
+        print 'test_streamRecline(): Running actual test code ..........................'
+
+        body = json.dumps({'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [-112.0, 33.5 + n]},
+             'properties': {'name': 'well %d' % n, 'county': 'Pima'}} for n in range(3)]})
+        wfs = self.handler(summary(parameters={'outputFormat': {'values': ['application/json']}}), FakeClient(body))
+
+        payload = json.loads(''.join(wfs.stream_recline({}, max_features=3)))
+        assert [field['id'] for field in payload['fields']] == ['county', 'name', 'geometry']
+        assert payload['count'] == 3
+        assert payload['batches'][0]['dictionaries'] == {'county': ['Pima']}
+
+    #test that a layer's fields and feature count are requested once and then served from the capabilities memo
+    def test_layerStats(self):
+        print 'test_layerStats(): Running actual test code ..........................'
+
+        describe = ('<xsd:schema xmlns:xsd="http://www.w3.org/2001/XMLSchema"><xsd:element name="wells">'
+                    '<xsd:complexType><xsd:sequence><xsd:element name="name" type="xsd:string"/>'
+                    '<xsd:element name="the_geom" type="gml:PointPropertyType"/></xsd:sequence></xsd:complexType>'
+                    '</xsd:element></xsd:schema>')
+        hits = '<wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs" numberOfFeatures="52311"/>'
+        client = RoutingClient({'DescribeFeatureType': describe, 'hits': hits})
+        capabilities = summary()
+        capabilities.data['operations']['DescribeFeatureType'] = {
+            'methods': {'Get': {'url': 'http://example.com/wfs?'}}, 'formats': [], 'parameters': {}}
+        wfs = self.handler(capabilities, client)
+
+        stats = wfs.get_layer_stats({})
+        assert stats['layer'] == 'azgs:wells'
+        assert stats['fields'] == [{'id': 'name', 'type': 'string'}, {'id': 'the_geom', 'type': 'geojson'}]
+        assert stats['count'] == 52311
+        assert wfs.get_layer_stats({}) == stats
+        assert len(client.urls) == 2
+
+        assert wfs.count_features('azgs:wells', bbox=(-112, 33, -111, 34)) == 52311
+        assert len(client.urls) == 3
+
+        try:
+            wfs.get_layer_stats({'resource': {'layer': 'azgs:faults'}})
+            assert False
+        except KeyError:
+            pass
+        assert len(client.urls) == 3
+
+        assert ngdsClientModel.parse_hits('<wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs/2.0" '
+                                          'numberMatched="unknown" numberReturned="0"/>') is None
+
+    #test that a mirrored layer is read from the mirror and the service isn't asked for features
+    def test_mirroredLayer(self):
+        print 'test_mirroredLayer(): Running actual test code ..........................'
+
+        body = json.dumps({'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [-112.0 + n, 33.0]},
+             'properties': {'name': 'well %d' % n}} for n in range(3)]})
+        client = FakeClient(body)
+        wfs = self.handler(summary(parameters={'outputFormat': {'values': ['application/json']}}), client)
+
+        directory = tempfile.mkdtemp()
+        try:
+            ngdsClientMirror.configure(os.path.join(directory, 'mirror.db'))
+            ngdsClientMirror.feature_mirror.add(wfs.url, 'azgs:wells')
+            ngdsClientMirror.feature_mirror.sync(wfs.url, 'azgs:wells', wfs.iter_upstream('azgs:wells'), 'etag-1')
+            assert len(client.urls) == 1
+
+            features = wfs.make_geojson({}, bbox=(-111.5, 32, -110.5, 34))
+            assert [f['properties']['name'] for f in features] == ['well 1']
+            assert json.loads(''.join(wfs.stream_geojson({}, max_features=10)))['features'][2]['properties'] == \
+                {'name': 'well 2'}
+            assert len(client.urls) == 1
+        finally:
+            ngdsClientMirror.configure(None)
+            shutil.rmtree(directory)
+
+    #test that a vector tile is cut from the features within the tile and its buffer
+    def test_vectorTile(self):
+        print 'test_vectorTile(): Running actual test code ..........................'
+
+        body = json.dumps({'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [-112.0, 33.5]},
+             'properties': {'name': 'well 1'}}]})
+        client = FakeClient(body)
+        wfs = self.handler(summary(parameters={'outputFormat': {'values': ['application/json']}}), client)
+
+        data, truncated = wfs.get_vector_tile('azgs:wells', 6, 12, 25)
+        assert not truncated
+        assert data.startswith('\x1a') and 'wells' in data and 'well 1' in data
+        bbox = urlparse.parse_qs(urlparse.urlparse(client.urls[0]).query)['bbox'][0].split(',')
+        assert -113.0 < float(bbox[0]) < -112.5 and 36.6 < float(bbox[3]) < 36.7
+
+        try:
+            wfs.get_vector_tile('azgs:faults', 6, 12, 25)
+            assert False
+        except KeyError:
+            pass
+
+    #test that a layer without paging is tiled, every feature arrives once and in WGS84 although the layer is projected
+    def test_tileLayer(self):
+        print 'test_tileLayer(): Running actual test code ..........................'
+
+        client = ProjectedWFS()
+        wfs = self.handler(summary(parameters={'outputFormat': {'values': ['application/json']}}), client)
+
+        features = list(wfs.iter_features({}, page_size=30))
+        assert sorted(f['properties']['n'] for f in features) == range(100)
+        assert len(client.urls) > 4
+        for url in client.urls:
+            assert urlparse.parse_qs(urlparse.urlparse(url).query)['srsName'] == ['EPSG:4326']
+        for f in features:
+            x, y = f['geometry']['coordinates']
+            assert -115.0 <= x <= -109.0 and 31.0 <= y <= 37.0
+
+        features = list(wfs.iter_features({}, page_size=30, bbox=(-112.0, 31.0, -109.0, 37.0)))
+        assert len(features) == 50
+
+    #test that a WFS 2.0.0 layer is paged through with startIndex and count
+    def test_pageLayer(self):
+        print 'test_pageLayer(): Running actual test code ..........................'
+
+        client = ProjectedWFS()
+        wfs = self.handler(summary(parameters={'outputFormat': {'values': ['application/json']}}, version='2.0.0'),
+                           client, '2.0.0')
+
+        features = list(wfs.iter_features({}, page_size=30))
+        assert [f['properties']['n'] for f in features] == range(100)
+        starts = [urlparse.parse_qs(urlparse.urlparse(url).query)['startIndex'][0] for url in client.urls]
+        assert starts == ['0', '30', '60', '90']
+
+        assert len(list(wfs.iter_features({}, page_size=30, max_features=45))) == 45
+
+    #test that an unknown layer or an unreachable service fails before a stream starts
+    def test_streamErrors(self):
+        print 'test_streamErrors(): Running actual test code ..........................'
+
+        client = ProjectedWFS()
+        capabilities = summary(parameters={'outputFormat': {'values': ['application/json']}})
+        capabilities.data['layers'].append({'name': 'azgs:IOError', 'title': 'Broken', 'bbox': None, 'crs': []})
+        wfs = self.handler(capabilities, client)
+
+        for stream in (wfs.stream_geojson, wfs.stream_recline):
+            try:
+                stream({'resource': {'layer': 'azgs:faults'}})
+                assert False
+            except KeyError:
+                pass
+            try:
+                stream({'resource': {'layer': 'azgs:IOError'}}, page_size=10)
+                assert False
+            except IOError:
+                pass
+
+        chunks = wfs.stream_geojson({}, page_size=30)
+        assert len(client.urls) > 0
+        assert len(json.loads(''.join(chunks))['features']) == 100
+
+    #test that BBOX filters name the geometry property and property lists keep the geometry
+    def test_geometryProperty(self):
+        print 'test_geometryProperty(): Running actual test code ..........................'
+
+        assert '<ogc:BBOX><ogc:PropertyName>the_geom</ogc:PropertyName><gml:Box srsName="EPSG:4326">' in \
+            ngdsClientModel.encode_filter({'n': 5}, '1.0.0', (-112, 33, -111, 34), 'the_geom')
+
+        client = ProjectedWFS()
+        capabilities = summary(parameters={'outputFormat': {'values': ['application/json']}})
+        capabilities.data['operations']['DescribeFeatureType'] = {
+            'methods': {'Get': {'url': 'http://example.com/wfs?'}}, 'formats': [], 'parameters': {}}
+        wfs = self.handler(capabilities, client)
+
+        wfs.make_geojson({}, bbox=(-112.0, 33.0, -111.0, 34.0), filter={'n': 5})
+        filter = urlparse.parse_qs(urlparse.urlparse(client.urls[-1]).query)['filter'][0]
+        assert '<ogc:BBOX><ogc:PropertyName>the_geom</ogc:PropertyName><gml:Envelope' in filter
+
+        features = list(wfs.iter_features({}, page_size=30, properties=['n']))
+        assert sorted(f['properties']['n'] for f in features) == range(100)
+        assert urlparse.parse_qs(urlparse.urlparse(client.urls[-1]).query)['propertyName'] == ['n,the_geom']
+
+    #test that a vector tile holding more features than may be read is marked as truncated, also in the tile cache
+    def test_truncatedVectorTile(self):
+        print 'test_truncatedVectorTile(): Running actual test code ..........................'
+
+        client = ProjectedWFS()
+        wfs = self.handler(summary(parameters={'outputFormat': {'values': ['application/json']}}), client)
+        wfs.get_layer_token = lambda type_name: 'etag-1'
+
+        directory = tempfile.mkdtemp()
+        tile_cache = ngdsClientTiles.tile_cache
+        try:
+            ngdsClientTiles.configure(directory)
+            data, truncated = wfs.get_vector_tile('azgs:wells', 3, 1, 3, max_features=10)
+            assert truncated and data
+            requests = len(client.urls)
+            assert wfs.get_vector_tile('azgs:wells', 3, 1, 3, max_features=10) == (data, True)
+            assert wfs.get_vector_tile('azgs:wells', 3, 1, 3, max_features=1000)[1] is False
+            assert len(client.urls) == requests + 1
+        finally:
+            ngdsClientTiles.tile_cache = tile_cache
+            shutil.rmtree(directory)
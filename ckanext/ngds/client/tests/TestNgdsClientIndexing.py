@@ -0,0 +1,95 @@
+import json
+import os
+import shutil
+import tempfile
+
+import ckanext.ngds.client.model.indexing as ngdsClientIndexing
+
+class FakeUpdater(object):
+
+    def __init__(self, fail_after=None):
+        self.posted = []
+        self.commits = 0
+        self.fail_after = fail_after
+
+    def post(self, docs):
+        if self.fail_after is not None and len(self.posted) == self.fail_after:
+            raise IOError('Solr went away')
+        self.posted.append(docs)
+
+    def commit(self):
+        self.commits += 1
+
+def build(batches):
+    for ids in batches:
+        yield ids[-1], [{'id': id} for id in ids], []
+
+class TestNgdsClientIndexing(object):
+
+    #setup executes before each method in this class
+    def setup(self):
+        print ("")
+        print ("TestUM:setup() before each test method")
+        self.directory = tempfile.mkdtemp()
+        self.service_extents = ngdsClientIndexing.service_extents
+        ngdsClientIndexing.configure(False)
+
+    #setup executes after each method in this class
+    def teardown(self):
+        print ("")
+        print ("TestUM:teardown() after each test method")
+        shutil.rmtree(self.directory)
+        ngdsClientIndexing.configure(self.service_extents)
+
+    #test that author, maintainer and extent fields are computed from the USGIN metadata
+    def test_ngdsFields(self):
+        print 'test_ngdsFields(): Running actual test code ..........................'
+
+        md_package = {'resourceDescription': {
+            'citedSourceAgents': [{'agentRole': {'individual': {'personName': 'Jane Doe'}}},
+                                  {'agentRole': {'organizationName': 'Arizona Geological Survey'}},
+                                  {'agentRole': {'individual': {'personName': 'Jane Doe'}}}],
+            'geographicExtent': [{'westBound': -114, 'southBound': 31, 'eastBound': -109, 'northBound': 37}]}}
+        fields = ngdsClientIndexing.ngds_fields({'author': 'Someone Else', 'maintainer': 'AZGS',
+                                                 'extras_md_package': json.dumps(md_package)})
+
+        assert fields['author_string'] == ['Jane Doe', 'Arizona Geological Survey']
+        assert fields['maintainer_string'] == ['AZGS']
+        assert (fields['minx'], fields['maxy'], fields['bbox_area']) == (-114.0, 37.0, 30.0)
+
+        fields = ngdsClientIndexing.ngds_fields({'author_string': ['Declared'], 'author': 'Someone Else'})
+        assert 'author_string' not in fields
+        assert 'minx' not in fields
+
+    #test that a rebuild posts every batch, commits once and can resume after a failure
+    def test_rebuild(self):
+        print 'test_rebuild(): Running actual test code ..........................'
+
+        ids = ['%03d' % n for n in range(10)]
+        checkpoint = ngdsClientIndexing.Checkpoint(os.path.join(self.directory, 'reindex.checkpoint'))
+
+        def batches(after=None):
+            remaining = [id for id in ids if after is None or id > after]
+            return [remaining[i:i + 3] for i in range(0, len(remaining), 3)]
+
+        updater = FakeUpdater(fail_after=2)
+        try:
+            ngdsClientIndexing.rebuild(batches(), build, updater, checkpoint)
+            assert False
+        except IOError:
+            pass
+        assert updater.commits == 0
+        assert checkpoint.read()['last_id'] == '005'
+        assert checkpoint.read()['indexed'] == 6
+
+        saved = checkpoint.read()
+        updater = FakeUpdater()
+        stats = ngdsClientIndexing.rebuild(batches(saved['last_id']), build, updater, checkpoint,
+                                           saved['indexed'])
+        assert [doc['id'] for docs in updater.posted for doc in docs] == ids[6:]
+        assert updater.commits == 1
+        assert stats['indexed'] == 10
+        assert checkpoint.read() is None
+
+        stats = ngdsClientIndexing.rebuild(batches(), build)
+        assert stats['packages'] == 10 and stats['indexed'] == 0 and stats['bytes'] > 0
@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+
+import ckanext.ngds.client.model.mirror as ngdsClientMirror
+
+URL = 'http://example.com/wfs?'
+
+def well(n):
+    return {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [-115.0 + n, 31.0 + n]},
+            'properties': {'name': 'well %d' % n, 'county': ['Pima', 'Cochise'][n % 2], 'depth': 100 * n}}
+
+class TestNgdsClientMirror(object):
+
+    #setup executes before each method in this class
+    def setup(self):
+        print ("")
+        print ("TestUM:setup() before each test method")
+        self.directory = tempfile.mkdtemp()
+        self.mirror = ngdsClientMirror.FeatureMirror(os.path.join(self.directory, 'mirror.db'))
+
+    #setup executes after each method in this class
+    def teardown(self):
+        print ("")
+        print ("TestUM:teardown() after each test method")
+        shutil.rmtree(self.directory)
+
+    #test that bbox, attribute and property queries are answered from a synced layer
+    def test_query(self):
+        print 'test_query(): Running actual test code ..........................'
+
+        self.mirror.add(URL, 'azgs:wells')
+        assert self.mirror.query(URL, 'azgs:wells') is None
+        assert self.mirror.sync(URL, 'azgs:wells', (well(n) for n in range(6)), 'etag-1') == 6
+
+        assert len(list(self.mirror.query(URL, 'AZGS:Wells'))) == 6
+        found = list(self.mirror.query(URL, 'azgs:wells', bbox=(-114.5, 31.5, -111.5, 34.5)))
+        assert [f['properties']['name'] for f in found] == ['well 1', 'well 2', 'well 3']
+
+        found = list(self.mirror.query(URL, 'azgs:wells', filter=[('county', '=', 'Cochise'), ('depth', '>', '100')],
+                                       properties=['name']))
+        assert [f['properties'] for f in found] == [{'name': 'well 3'}, {'name': 'well 5'}]
+        assert len(list(self.mirror.query(URL, 'azgs:wells', filter={'name': 'well 4'}))) == 1
+        assert len(list(self.mirror.query(URL, 'azgs:wells', filter=[('name', 'like', 'well*')],
+                                          max_features=2))) == 2
+
+        assert self.mirror.query(URL, 'azgs:faults') is None
+
+    #test that a sync replaces the served copy only once it completes
+    def test_sync(self):
+        print 'test_sync(): Running actual test code ..........................'
+
+        self.mirror.sync(URL, 'azgs:wells', [well(n) for n in range(3)], 'etag-1')
+        assert not self.mirror.is_stale(URL, 'azgs:wells', 'etag-1', 3600)
+        assert self.mirror.is_stale(URL, 'azgs:wells', 'etag-2', 3600)
+
+        def failing():
+            yield well(10)
+            raise IOError('upstream went away')
+        try:
+            self.mirror.sync(URL, 'azgs:wells', failing(), 'etag-2')
+            assert False
+        except IOError:
+            pass
+        assert len(list(self.mirror.query(URL, 'azgs:wells'))) == 3
+
+        self.mirror.sync(URL, 'azgs:wells', [well(10)], 'etag-2')
+        assert [f['properties']['name'] for f in self.mirror.query(URL, 'azgs:wells')] == ['well 10']
+        assert self.mirror.get(URL, 'azgs:wells')['count'] == 1
+
+        self.mirror.sync(URL, 'azgs:Wells', [well(11)], 'etag-3')
+        assert [f['properties']['name'] for f in self.mirror.query(URL, 'azgs:wells')] == ['well 11']
+        assert self.mirror._connection().execute('SELECT COUNT(*) FROM generations').fetchone()[0] == 1
+
+        self.mirror.remove(URL, 'azgs:wells')
+        assert self.mirror.layers() == []
+        assert self.mirror._connection().execute('SELECT COUNT(*) FROM features').fetchone()[0] == 0
@@ -0,0 +1,119 @@
+import struct
+
+import ckanext.ngds.client.model.mvt as ngdsClientMvt
+
+def read_varint(data, i):
+    shift = result = 0
+    while True:
+        byte = ord(data[i])
+        i += 1
+        result |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return result, i
+
+def read_message(data):
+    # Decode a protobuf message into {field number: [raw values]}
+    fields = {}
+    i = 0
+    while i < len(data):
+        key, i = read_varint(data, i)
+        number, wire = key >> 3, key & 7
+        if wire == 0:
+            value, i = read_varint(data, i)
+        elif wire == 1:
+            value, i = struct.unpack('<d', data[i:i + 8])[0], i + 8
+        else:
+            length, i = read_varint(data, i)
+            value, i = data[i:i + length], i + length
+        fields.setdefault(number, []).append(value)
+    return fields
+
+def read_packed(data):
+    values = []
+    i = 0
+    while i < len(data):
+        value, i = read_varint(data, i)
+        values.append(value)
+    return values
+
+def unzigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+def identity(lon, lat):
+    return lon, lat
+
+class TestNgdsClientMvt(object):
+
+    #setup executes before each method in this class
+    def setup(self):
+        print ("")
+        print ("TestUM:setup() before each test method")
+
+    #setup executes after each method in this class
+    def teardown(self):
+        print ("")
+        print ("TestUM:teardown() after each test method")
+
+    #test that features are encoded as a vector tile layer with shared keys and values
+    def test_encodeLayer(self):
+        print 'test_encodeLayer(): Running actual test code ..........................'
+
+        encoder = ngdsClientMvt.TileEncoder('wells', identity, extent=4096, buffer=64)
+        assert encoder.add({'id': 7, 'geometry': {'type': 'Point', 'coordinates': [100, 200]},
+                            'properties': {'name': u'Caf\xe9 well', 'depth': -12, 'hot': True}})
+        assert encoder.add({'geometry': {'type': 'Point', 'coordinates': [150, 250]},
+                            'properties': {'name': 'other', 'depth': 35.5, 'hot': True}})
+        assert not encoder.add({'geometry': {'type': 'Point', 'coordinates': [5000, 200]}, 'properties': {}})
+
+        tile = read_message(encoder.encode())
+        layer = read_message(tile[3][0])
+        assert layer[15] == [2] and layer[1] == ['wells'] and layer[5] == [4096]
+        assert layer[3] == ['depth', 'hot', 'name']
+        values = [read_message(value) for value in layer[4]]
+        assert values[0] == {6: [23]} and values[1] == {7: [1]}
+        assert values[2] == {1: [u'Caf\xe9 well'.encode('utf-8')]} and values[3] == {3: [35.5]}
+
+        first, second = [read_message(feature) for feature in layer[2]]
+        assert first[1] == [7] and first[3] == [ngdsClientMvt.POINT]
+        assert read_packed(first[2][0]) == [0, 0, 1, 1, 2, 2]
+        assert read_packed(second[2][0]) == [0, 3, 1, 1, 2, 4]
+        assert [unzigzag(v) for v in read_packed(first[4][0])[1:]] == [100, 200]
+
+        assert ngdsClientMvt.TileEncoder('empty', identity).encode() == ''
+
+    #test that polygons are clipped to the buffered tile and wound clockwise
+    def test_clipPolygon(self):
+        print 'test_clipPolygon(): Running actual test code ..........................'
+
+        encoder = ngdsClientMvt.TileEncoder('extent', identity, extent=100, buffer=10, tolerance=0)
+        ring = [[-50, -50], [50, -50], [50, 50], [-50, 50], [-50, -50]]
+        assert encoder.add({'geometry': {'type': 'Polygon', 'coordinates': [ring[::-1]]}, 'properties': {}})
+
+        feature = read_message(read_message(read_message(encoder.encode())[3][0])[2][0])
+        commands = read_packed(feature[4][0])
+        assert commands[0] == ngdsClientMvt.MOVE_TO | 1 << 3
+        assert commands[3] == ngdsClientMvt.LINE_TO | 3 << 3
+        assert commands[-1] == ngdsClientMvt.CLOSE_PATH | 1 << 3
+
+        x = y = 0
+        points = []
+        deltas = commands[1:3] + commands[4:-1]
+        for dx, dy in zip(deltas[::2], deltas[1::2]):
+            x, y = x + unzigzag(dx), y + unzigzag(dy)
+            points.append((x, y))
+        assert sorted(points) == [(-10, -10), (-10, 50), (50, -10), (50, 50)]
+        area = sum(ax * by - bx * ay for (ax, ay), (bx, by) in zip(points, points[1:] + points[:1]))
+        assert area > 0
+
+    #test that lines leaving and re-entering the tile are split, and straight stretches simplified
+    def test_clipLine(self):
+        print 'test_clipLine(): Running actual test code ..........................'
+
+        parts = ngdsClientMvt.clip_line([(0, 5), (20, 5), (20, 15), (0, 15)], 0, 10)
+        assert parts == [[(0, 5), (10.0, 5.0)]]
+
+        parts = ngdsClientMvt.clip_line([(5, 5), (15, 5), (15, 8), (5, 8)], 0, 10)
+        assert parts == [[(5, 5), (10.0, 5.0)], [(10.0, 8.0), (5, 8)]]
+
+        assert ngdsClientMvt.simplify([(0, 0), (1, 0.1), (2, 0), (3, 5)], 0.5) == [(0, 0), (2, 0), (3, 5)]
@@ -50,13 +50,16 @@ class TestNgdsClientPlugin(object):
         print ("")
         print ("TestUM:teardown() after each test method")
 
-    #Test the method get_actions of NgdsClientPlugin Class return the {'geothermal_prospector_url'}
+    #Test the method get_actions of NgdsClientPlugin Class return the {'geothermal_prospector_url', 'geothermal_prospector_urls', 'ngds_facets', 'ngds_bbox_search'}
     def test_getActions(self):
         print 'test_getActions(): Running actual test code ..........................'
 
         result = self.oNgdsClientPlugin.get_actions()
 
         assert 'geothermal_prospector_url' in result
+        assert 'geothermal_prospector_urls' in result
+        assert 'ngds_facets' in result
+        assert 'ngds_bbox_search' in result
 
     #Test client ngds plugin is up and the response status code for all paths (routes) is 200
     def test_ngdsClientUrls(self):
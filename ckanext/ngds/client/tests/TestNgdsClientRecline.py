@@ -0,0 +1,103 @@
+import json
+
+import ckanext.ngds.client.model.recline as ngdsClientRecline
+
+DESCRIBE_FEATURE_TYPE = '''<?xml version="1.0" encoding="UTF-8"?>
+<xsd:schema xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:gml="http://www.opengis.net/gml"
+            xmlns:aasg="http://stategeothermaldata.org/uri-gin/aasg/xmlschema/boreholetemperature/"
+            targetNamespace="http://stategeothermaldata.org/uri-gin/aasg/xmlschema/boreholetemperature/">
+  <xsd:complexType name="BoreholeTemperatureType">
+    <xsd:complexContent>
+      <xsd:extension base="gml:AbstractFeatureType">
+        <xsd:sequence>
+          <xsd:element name="WellName" type="xsd:string"/>
+          <xsd:element name="County" type="xsd:string"/>
+          <xsd:element name="MeasuredTemperature" type="xsd:double"/>
+          <xsd:element name="DrillerTotalDepth" type="xsd:int"/>
+          <xsd:element name="Status">
+            <xsd:simpleType><xsd:restriction base="xsd:boolean"/></xsd:simpleType>
+          </xsd:element>
+          <xsd:element name="Shape" type="gml:PointPropertyType"/>
+        </xsd:sequence>
+      </xsd:extension>
+    </xsd:complexContent>
+  </xsd:complexType>
+  <xsd:element name="BoreholeTemperature" type="aasg:BoreholeTemperatureType"
+               substitutionGroup="gml:_Feature"/>
+</xsd:schema>'''
+
+def feature(n):
+    return {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [-110.0 - n, 33.0]},
+            'properties': {'WellName': 'Well %d' % n, 'County': ['Pima', 'Cochise'][n % 2],
+                           'MeasuredTemperature': 20.5 + n, 'DrillerTotalDepth': 100 * n}}
+
+def decode(payload):
+    records = []
+    dictionaries = {}
+    for batch in payload['batches']:
+        for name, values in batch['dictionaries'].items():
+            dictionaries.setdefault(name, []).extend(values)
+        for row in range(batch['count']):
+            record = {}
+            for name, column in batch['columns'].items():
+                if 'codes' in column:
+                    record[name] = dictionaries[name][column['codes'][row]]
+                else:
+                    record[name] = column['values'][row]
+            records.append(record)
+    return records
+
+class TestNgdsClientRecline(object):
+
+    #setup executes before each method in this class
+    def setup(self):
+        print ("")
+        print ("TestUM:setup() before each test method")
+
+    #setup executes after each method in this class
+    def teardown(self):
+        print ("")
+        print ("TestUM:teardown() after each test method")
+
+    #test that the fields of a feature type are read from a DescribeFeatureType response
+    def test_parseFeatureType(self):
+        print 'test_parseFeatureType(): Running actual test code ..........................'
+
+        fields = ngdsClientRecline.parse_feature_type(DESCRIBE_FEATURE_TYPE, 'aasg:BoreholeTemperature')
+        assert fields == [{'id': 'WellName', 'type': 'string'},
+                          {'id': 'County', 'type': 'string'},
+                          {'id': 'MeasuredTemperature', 'type': 'number'},
+                          {'id': 'DrillerTotalDepth', 'type': 'integer'},
+                          {'id': 'Status', 'type': 'boolean'},
+                          {'id': 'Shape', 'type': 'geojson'}]
+
+        try:
+            ngdsClientRecline.parse_feature_type('<xsd:schema xmlns:xsd="http://www.w3.org/2001/XMLSchema"/>', 'a:b')
+            assert False
+        except ValueError:
+            pass
+
+    #test that features survive the columnar encoding and repeated strings are dictionary encoded
+    def test_encodeColumnar(self):
+        print 'test_encodeColumnar(): Running actual test code ..........................'
+
+        fields = ngdsClientRecline.parse_feature_type(DESCRIBE_FEATURE_TYPE)
+        features = [feature(n) for n in range(25)]
+        chunks = list(ngdsClientRecline.encode_columnar(iter(features), fields, batch_size=10))
+        payload = json.loads(''.join(chunks))
+
+        assert payload['count'] == 25
+        assert [batch['count'] for batch in payload['batches']] == [10, 10, 5]
+        first, second = payload['batches'][:2]
+        assert first['dictionaries']['County'] == ['Pima', 'Cochise']
+        assert 'County' not in second['dictionaries']
+        assert 'values' in first['columns']['WellName']
+
+        records = decode(payload)
+        assert records[7]['County'] == 'Cochise'
+        assert records[7]['WellName'] == 'Well 7'
+        assert records[24]['Shape'] == features[24]['geometry']
+        assert records[3]['Status'] is None
+
+        payload = json.loads(''.join(ngdsClientRecline.encode_columnar([])))
+        assert payload == {'fields': [], 'batches': [], 'count': 0}
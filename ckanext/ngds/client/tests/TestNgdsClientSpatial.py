@@ -0,0 +1,50 @@
+import json
+
+import ckanext.ngds.client.model.spatial as ngdsClientSpatial
+
+class TestNgdsClientSpatial(object):
+
+    #setup executes before each method in this class
+    def setup(self):
+        print ("")
+        print ("TestUM:setup() before each test method")
+
+    #setup executes after each method in this class
+    def teardown(self):
+        print ("")
+        print ("TestUM:teardown() after each test method")
+
+    #test that extents are read from GeoJSON and from USGIN metadata extras
+    def test_metadataBbox(self):
+        print 'test_metadataBbox(): Running actual test code ..........................'
+
+        polygon = {'type': 'Polygon', 'coordinates': [[[-120, 35], [-110, 35], [-110, 42], [-120, 42], [-120, 35]]]}
+        assert ngdsClientSpatial.metadata_bbox({'extras_spatial': json.dumps(polygon)}) == (-120.0, 35.0, -110.0, 42.0)
+
+        md_package = {'resourceDescription': {'geographicExtent': [
+            {'westBound': -119, 'southBound': 36, 'eastBound': -114, 'northBound': 42},
+            {'westBound': -200, 'southBound': 30, 'eastBound': -115, 'northBound': 40}]}}
+        pkg_dict = {'extras': [{'key': 'md_package', 'value': json.dumps(md_package)}]}
+        assert ngdsClientSpatial.metadata_bbox(pkg_dict) == (-180.0, 30.0, -114.0, 42.0)
+
+        assert ngdsClientSpatial.metadata_bbox({'extras_spatial': 'not json'}) is None
+
+    #test that index fields and search parameters describe the same box
+    def test_searchParams(self):
+        print 'test_searchParams(): Running actual test code ..........................'
+
+        bbox = ngdsClientSpatial.parse_bbox('-120,35,-110,42')
+        fields = ngdsClientSpatial.index_fields(bbox)
+        assert fields['bbox_area'] == 70.0
+        assert fields['spatial_geom'] == '-120.0 35.0 -110.0 42.0'
+
+        params = ngdsClientSpatial.search_params(bbox)
+        assert params['fq'] == 'spatial_geom:"Intersects(-120.0 35.0 -110.0 42.0)"'
+        assert params['sort'].startswith('div(product(max(0,sub(min(maxx,-110.0),max(minx,-120.0)))')
+
+        for value in ('1,2,3', '10,0,0,10', 'a,b,c,d'):
+            try:
+                ngdsClientSpatial.parse_bbox(value)
+                assert False
+            except ValueError:
+                pass
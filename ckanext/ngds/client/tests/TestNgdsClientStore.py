@@ -0,0 +1,55 @@
+import ckanext.ngds.client.model.capabilities as ngdsClientCapabilities
+import ckanext.ngds.client.model.store as ngdsClientStore
+from ckanext.ngds.client.tests.TestNgdsClientCapabilities import FakeFetch
+import os
+import shutil
+import tempfile
+
+class TestNgdsClientStore(object):
+
+    #setup executes before each method in this class
+    def setup(self):
+        print ("")
+        print ("TestUM:setup() before each test method")
+        self.directory = tempfile.mkdtemp()
+        self.store = ngdsClientStore.CapabilitiesStore(
+            os.path.join(self.directory, 'capabilities.db'))
+
+    #setup executes after each method in this class
+    def teardown(self):
+        print ("")
+        print ("TestUM:teardown() after each test method")
+        shutil.rmtree(self.directory)
+        self.store = None
+
+    #test that a summary survives a round trip through the sqlite file
+    def test_putAndGet(self):
+        print 'test_putAndGet(): Running actual test code ..........................'
+
+        key = ('http://example.com/wms', 'WMS', '1.1.1')
+        self.store.put(key, {'layers': [{'name': 'ThermalSprings'}]}, etag='"v1"')
+        result = self.store.get(key)
+
+        assert result['summary']['layers'][0]['name'] == 'ThermalSprings'
+        assert result['etag'] == '"v1"'
+        assert self.store.get(('http://example.com/wfs', 'WFS', '1.0.0')) is None
+
+    #test that a cold cache reads summaries written by another process
+    def test_coldCacheStartsWarm(self):
+        print 'test_coldCacheStartsWarm(): Running actual test code ..........................'
+
+        warm_fetch = FakeFetch()
+        warm = ngdsClientCapabilities.CapabilitiesCache(fetch=warm_fetch,
+                                                        store=self.store)
+        warm.get('WMS', 'http://example.com/wms', '1.1.1')
+
+        cold_fetch = FakeFetch()
+        cold = ngdsClientCapabilities.CapabilitiesCache(fetch=cold_fetch,
+                                                        store=self.store)
+        entry = cold.get('WMS', 'http://example.com/wms', '1.1.1')
+
+        assert len(warm_fetch.calls) == 1
+        assert len(cold_fetch.calls) == 0
+        assert entry.service is None
+        assert entry.summary['layers'][0]['name'] == 'ThermalSprings'
+        assert entry.summary['operations']['GetMap']['formats'] == ['image/png', 'image/jpeg']
@@ -0,0 +1,49 @@
+import random
+import time
+
+import ckanext.ngds.client.model.suggest as ngdsClientSuggest
+
+class TestNgdsClientSuggest(object):
+
+    #setup executes before each method in this class
+    def setup(self):
+        print ("")
+        print ("TestUM:setup() before each test method")
+        self.index = ngdsClientSuggest.PrefixIndex([
+            ('California Volcanic Vents', 'dataset', 0.0, 'ca-volcanic-vents'),
+            ('Volcanic Vents of Nevada', 'dataset', 0.0, 'nv-volcanic-vents'),
+            ('volcanic', 'tag', 12.0, 'volcanic'),
+            ('Volcanic Vent', 'content_model', 0.0, 'Volcanic Vent'),
+            ('Well Log', 'content_model', 0.0, 'Well Log')], limit=3)
+
+    #setup executes after each method in this class
+    def teardown(self):
+        print ("")
+        print ("TestUM:teardown() after each test method")
+
+    #test that suggestions match word prefixes and are ranked by type and weight
+    def test_suggest(self):
+        print 'test_suggest(): Running actual test code ..........................'
+
+        assert [s['name'] for s in self.index.suggest('volc')] == ['Volcanic Vent', 'volcanic', 'nv-volcanic-vents']
+        assert [s['name'] for s in self.index.suggest('vents of')] == ['nv-volcanic-vents']
+        assert [s['type'] for s in self.index.suggest('W')] == ['content_model']
+        assert self.index.suggest('Cal', limit=1)[0]['value'] == 'California Volcanic Vents'
+        assert self.index.suggest('x') == []
+        assert self.index.suggest('  ') == []
+
+    #test that a large catalog answers in well under 20ms per suggestion
+    def test_speed(self):
+        print 'test_speed(): Running actual test code ..........................'
+
+        rng = random.Random(0)
+        words = ['geothermal', 'well', 'temperature', 'heat', 'flow', 'nevada', 'utah', 'gradient', 'borehole',
+                 'spring', 'fault', 'volcanic', 'seismic', 'lithology', 'gravity', 'magnetic']
+        entries = [(' '.join(rng.choice(words) for _ in range(6)) + ' %d' % n, 'dataset', 0.0, 'dataset-%d' % n)
+                   for n in range(20000)]
+        index = ngdsClientSuggest.PrefixIndex(entries)
+
+        started = time.time()
+        for prefix in ['g', 'ge', 'geo', 'heat fl', 'volcanic seis', 'bore', 'z']:
+            index.suggest(prefix)
+        assert (time.time() - started) / 7 < 0.02
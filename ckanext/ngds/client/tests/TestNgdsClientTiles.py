@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import time
+
+import ckanext.ngds.client.model.tiles as ngdsClientTiles
+
+class TestNgdsClientTiles(object):
+
+    #setup executes before each method in this class
+    def setup(self):
+        print ("")
+        print ("TestUM:setup() before each test method")
+        self.directory = tempfile.mkdtemp()
+
+    #setup executes after each method in this class
+    def teardown(self):
+        print ("")
+        print ("TestUM:teardown() after each test method")
+        shutil.rmtree(self.directory)
+
+    #test that GetMap requests for a grid tile are recognized and others are not
+    def test_tileForBbox(self):
+        print 'test_tileForBbox(): Running actual test code ..........................'
+
+        grid = ngdsClientTiles.GRIDS['EPSG:4326']
+        bbox = grid.tile_bbox(3, 4, 2)
+
+        assert bbox == (-90.0, 22.5, -67.5, 45.0)
+        assert grid.tile_for_bbox(bbox, 256, 256) == (3, 4, 2)
+        assert grid.tile_for_bbox(bbox, 512, 512) is None
+        assert grid.tile_for_bbox((-89.0, 22.5, -67.5, 45.0), 256, 256) is None
+
+        mercator = ngdsClientTiles.GRIDS['EPSG:3857']
+        assert mercator.tile_for_bbox(mercator.tile_bbox(7, 20, 50), 256, 256) == (7, 20, 50)
+        assert mercator.tiles_in_bbox((-1.0, -1.0, 1.0, 1.0), 1) == [(1, 0, 0), (1, 1, 0), (1, 0, 1), (1, 1, 1)]
+        x, y = mercator.to_wgs84(*mercator.from_wgs84(-112.5, 33.25))
+        assert abs(x + 112.5) < 1e-9 and abs(y - 33.25) < 1e-9
+
+    #test that the least recently read tiles are evicted once the cache is full
+    def test_lruEviction(self):
+        print 'test_lruEviction(): Running actual test code ..........................'
+
+        cache = ngdsClientTiles.TileCache(self.directory, max_size=300)
+        keys = [cache.make_key('http://example.com/wms', n) for n in range(3)]
+        for n, key in enumerate(keys):
+            cache.put(key, 'x' * 100)
+            os.utime(cache.path(key), (time.time() - 100 + n, time.time() - 100 + n))
+
+        assert cache.get(keys[0]) == 'x' * 100
+        cache.put(cache.make_key('http://example.com/wms', 3), 'x' * 100)
+
+        assert len(cache) == 2
+        assert cache.get(keys[0]) is not None
+        assert cache.get(keys[1]) is None
+
+    #test that tiles still being written by another process are neither counted nor evicted
+    def test_tempFiles(self):
+        print 'test_tempFiles(): Running actual test code ..........................'
+
+        cache = ngdsClientTiles.TileCache(self.directory, max_size=150)
+        key = cache.make_key('http://example.com/wms', 0)
+        cache.put(key, 'x' * 100)
+        temp = os.path.join(os.path.dirname(cache.path(key)), '.tmpwriting')
+        with open(temp, 'wb') as f:
+            f.write('x' * 1000)
+        os.utime(temp, (time.time() - 100, time.time() - 100))
+
+        assert len(cache) == 1
+        assert cache.evict() == 0
+        assert os.path.exists(temp)
@@ -0,0 +1,69 @@
+import ckanext.ngds.client.model.transport as ngdsClientTransport
+
+class TestNgdsClientTransport(object):
+
+    #setup executes before each method in this class
+    def setup(self):
+        print ("")
+        print ("TestUM:setup() before each test method")
+        self.client = ngdsClientTransport.OGCHttpClient(per_host=2, workers=4)
+
+    #setup executes after each method in this class
+    def teardown(self):
+        print ("")
+        print ("TestUM:teardown() after each test method")
+        self.client = None
+
+    #test that a host's connection slots run out and are given back
+    def test_hostLimiter(self):
+        print 'test_hostLimiter(): Running actual test code ..........................'
+
+        limiter = self.client.limiter('http://Example.com/wms?request=GetMap')
+
+        assert limiter is self.client.limiter('http://example.com/wfs')
+        assert limiter.acquire(0)
+        assert limiter.acquire(0)
+        assert not limiter.acquire(0.01)
+
+        limiter.release()
+        assert limiter.acquire(0)
+
+    #test that map keeps results in the order of its items
+    def test_map(self):
+        print 'test_map(): Running actual test code ..........................'
+
+        result = self.client.map(lambda x: x * x, range(20))
+
+        assert result == [x * x for x in range(20)]
+
+    #test that a breaker opens after repeated failures and lets one probe through
+    def test_circuitBreaker(self):
+        print 'test_circuitBreaker(): Running actual test code ..........................'
+
+        breaker = ngdsClientTransport.CircuitBreaker(threshold=2, reset_timeout=60)
+        breaker.failure()
+        assert breaker.allow()
+        breaker.failure()
+        assert not breaker.allow()
+
+        #pretend the reset timeout has passed
+        breaker.opened_at -= 60
+        assert breaker.allow()
+        assert not breaker.allow()
+
+        breaker.success()
+        assert breaker.allow()
+
+    #test that a failed URL keeps failing without going to the network
+    def test_negativeCache(self):
+        print 'test_negativeCache(): Running actual test code ..........................'
+
+        url = 'http://example.com/wms?request=GetCapabilities'
+        self.client._remember_failure(url, 'timed out')
+
+        try:
+            self.client.get(url)
+            assert False
+        except ngdsClientTransport.ServiceUnavailable:
+            pass
+        assert self.client.recent_failure('http://example.com/wfs') is None
@@ -1,6 +1,8 @@
 import datetime
 import json
 import ckanext.ngds.sysadmin.model.db as db
+import ckanext.ngds.sysadmin.model.cache as cache
+import ckanext.ngds.sysadmin.helpers as ngds_helpers
 
 from pylons import config
 import ckan.lib.base as base
@@ -123,6 +125,8 @@ class NGDSAdminController(admin.AdminController):
                     session = model.Session
                     session.add(update_db)
                     session.commit()
+                    cache.config_cache.bump()
+                    ngds_helpers.reset_decoded_settings()
                     h.redirect_to(controller=self.controller,
                                   action='data_config')
 
@@ -136,6 +140,8 @@ class NGDSAdminController(admin.AdminController):
                 session = model.Session
                 session.add(update_db)
                 session.commit()
+                cache.config_cache.bump()
+                ngds_helpers.reset_decoded_settings()
                 h.redirect_to(controller=self.controller,
                               action='data_config')
 
@@ -159,6 +165,8 @@ class NGDSAdminController(admin.AdminController):
             session = model.Session
             session.add(update_db)
             session.commit()
+            cache.config_cache.bump()
+            ngds_helpers.reset_decoded_settings()
             h.redirect_to(controller=self.controller,
                           action='operating_config')
 
@@ -168,6 +176,8 @@ class NGDSAdminController(admin.AdminController):
                 if name in data:
                     app_globals.set_global(name, data[name])
             app_globals.reset()
+            cache.config_cache.bump()
+            ngds_helpers.reset_decoded_settings()
             h.redirect_to(controller=self.controller,
                           action='style_config')
 
@@ -1,25 +1,43 @@
+import urllib
+
 from ckanext.ngds.common import plugins as p
-from ckanext.ngds.common import helpers as h
 from ckanext.ngds.common import base
-from ckanext.ngds.common import logic
-from ckanext.ngds.common import dictization_functions as df
+from ckanext.ngds.caching import cached_page
+from ckanext.ngds.sysadmin import helpers
+
+import ckan.controllers.home as home
+
+# Request parameters passed on to the search itself
+SEARCH_PARAMS = ('q', 'page', 'sort')
 
 class ViewController(base.BaseController):
 
     def homepage_search(self):
-        POST = base.request.params
-        data = logic.clean_dict(df.unflatten(logic.tuplize_dict(
-            logic.parse_params(POST))))
-        query = ''
-
-        if 'query' in data:
-            query = data['query']
-
-        if data['search-type'] == 'catalog_search':
-            controller = 'package'
-            return base.redirect(h.url_for(controller=controller, action='search',
-                             q=query))
-        else:
-            controller = 'ckanext.mapsearch.controllers.view:ViewController'
-            return base.redirect(h.url_for(controller=controller, action='render_map_search',
-                             q=query))
\ No newline at end of file
+        """
+        Answer links to the old NGDS search URL by redirecting to the catalog
+        or map search with the query.  The search box itself submits straight
+        to the search, see 'helpers.get_search_targets'.
+
+        @return: redirect to the search page
+        """
+        params = base.request.params
+        query = params.get('q', params.get('query', ''))
+        targets = helpers.get_search_targets()
+        urls = dict((search_type, url) for search_type, label, url in targets)
+        url = urls.get(params.get('search-type'), targets[0][2])
+
+        forwarded = [('q', query)] + [(key, params[key])
+                                      for key in SEARCH_PARAMS[1:]
+                                      if key in params]
+        forwarded = [(key, value.encode('utf-8')) for key, value in forwarded]
+        return base.redirect('%s?%s' % (url, urllib.urlencode(forwarded)))
+
+class HomeController(home.HomeController):
+    """
+    Vanilla CKAN homepage, rendered once for every anonymous user until a
+    dataset is created, updated or deleted or the NGDS settings change.
+    """
+
+    @cached_page(ttl=300, tags=('packages',))
+    def index(self):
+        return super(HomeController, self).index()
@@ -0,0 +1,25 @@
+'use strict';
+
+/* Points the NGDS search box at the search picked in its select, whose option
+ * values are the URLs of the searches, so the form submits straight to it.
+ *
+ * Examples
+ *
+ *   <select data-module="ngds_search_type">
+ *     <option value="/dataset">Catalog Search</option>
+ *   </select>
+ */
+ckan.module('ngds_search_type', function ($, _) {
+  return {
+    initialize: function () {
+      $.proxyAll(this, /_on/);
+      this.form = this.el.closest('form');
+      this.el.on('change', this._onChange);
+      this._onChange();
+    },
+
+    _onChange: function () {
+      this.form.attr('action', this.el.val());
+    }
+  };
+});
@@ -0,0 +1,51 @@
+'use strict';
+
+/* Suggests dataset titles, tags and content models in the NGDS search box.
+ *
+ * source - URL of the suggestion endpoint, called with the typed text as 'q'
+ *
+ * Examples
+ *
+ *   <input name="q" data-module="ngds_typeahead" data-module-source="/ngds/suggest" />
+ */
+ckan.module('ngds_typeahead', function ($, _) {
+  return {
+    options: {
+      source: '/ngds/suggest',
+      delay: 100
+    },
+
+    initialize: function () {
+      var list = $('<datalist />').attr('id', 'ngds-typeahead-' + new Date().getTime());
+      this.list = list.insertAfter(this.el);
+      this.el.attr('list', list.attr('id'));
+      this.cache = {};
+      this.el.on('input', $.proxy(this._onInput, this));
+    },
+
+    _onInput: function () {
+      var module = this;
+      var text = $.trim(this.el.val());
+      clearTimeout(this.timer);
+      if (!text) {
+        return;
+      }
+      if (this.cache[text]) {
+        return this._show(this.cache[text]);
+      }
+      this.timer = setTimeout(function () {
+        $.getJSON(module.options.source, {q: text}, function (suggestions) {
+          module.cache[text] = suggestions;
+          module._show(suggestions);
+        });
+      }, this.options.delay);
+    },
+
+    _show: function (suggestions) {
+      var list = this.list.empty();
+      $.each(suggestions, function (i, suggestion) {
+        $('<option />').attr('value', suggestion.value).appendTo(list);
+      });
+    }
+  };
+});
@@ -1,4 +1,9 @@
+import copy
+import importlib
 import json
+import logging
+import threading
+import time
 import iso8601
 
 from ckanext.ngds.common import pylons_config as config
@@ -7,31 +12,71 @@ from ckanext.ngds.common import plugins as p
 from ckanext.ngds.common import model as model
 from ckanext.ngds.common import dictization as dictization
 from ckanext.ngds.common import base as base
+from ckanext.ngds.common import helpers as ckan_helpers
 from sqlalchemy import desc
 
+import ckanext.ngds.sysadmin.model.cache as cache
+
+log = logging.getLogger(__name__)
+
+# The homepage's recent activity, computed at most once every
+# RECENT_ACTIVITY_TTL seconds per process, or again after a package has been
+# created or deleted.
+RECENT_ACTIVITY_TTL = 60
+RECENT_ACTIVITY_SETTLE = 5
+_recent_activity = {'value': None, 'expires': 0, 'settle': 0}
+_recent_activity_lock = threading.Lock()
+
+# The searches the NGDS search box offers, in order: the search type and its
+# label, the module that has to be installed for it, and the controller and
+# action that run it.
+SEARCH_TARGETS = (
+    ('catalog_search', 'Catalog Search', 'ckan.controllers.package',
+     'package', 'search'),
+    ('map_search', 'Map Search', 'ckanext.mapsearch.controllers.view',
+     'ckanext.mapsearch.controllers.view:ViewController', 'render_map_search')
+)
+_installed_search_targets = []
+
+# Values the helpers below decode from the NGDS settings, kept until the
+# settings are reloaded by 'cache.config_cache' or saved in this worker.
+_decoded = {'generation': None, 'values': {}}
+
+def _decoded_setting(key, decode, default=None):
+    values = _decoded['values']
+    if _decoded['generation'] != cache.config_cache.generation:
+        values = {}
+        _decoded['values'] = values
+        _decoded['generation'] = cache.config_cache.generation
+    if key not in values:
+        values[key] = decode(config.get(key, default))
+    return values[key]
+
+def _json(value):
+    return json.loads(value) if value else value
+
+def reset_decoded_settings():
+    _decoded['generation'] = None
 
 def data_publish_enabled():
-    value = config.get('ngds.publish', True)
-    value = p.toolkit.asbool(value)
-    return value
+    return _decoded_setting('ngds.publish', p.toolkit.asbool, True)
 
 def data_harvest_enabled():
-    value = config.get('ngds.harvest', True)
-    value = p.toolkit.asbool(value)
-    return value
+    return _decoded_setting('ngds.harvest', p.toolkit.asbool, True)
 
 def metadata_edit_enabled():
-    value = config.get('ngds.edit_metadata', True)
-    value = p.toolkit.asbool(value)
-    return value
+    return _decoded_setting('ngds.edit_metadata', p.toolkit.asbool, True)
 
+# The list is shared by every caller, so templates must not modify it.
 def get_featured_data():
-    value = config.get('ngds.featured_data', None)
-    if value:
-        value = json.loads(value)
-    return value
+    return _decoded_setting('ngds.featured_data', _json)
 
 def get_recent_activity():
+    now = time.time()
+    with _recent_activity_lock:
+        if _recent_activity['expires'] > now:
+            return copy.deepcopy(_recent_activity['value'])
+
     context = {'model': model, 'session': model.Session, 'user': base.c.user}
     activity_objects = model.Session.query(model.Activity)\
         .join(model.Package, model.Activity.object_id == model.Package.id)\
@@ -39,7 +84,67 @@ def get_recent_activity():
         .order_by(desc(model.Activity.timestamp)).limit(3).all()
     activity_dicts = dictization.model_dictize\
         .activity_list_dictize(activity_objects, context)
-    return activity_dicts
+
+    with _recent_activity_lock:
+        # Right after an invalidation, the new package's activity may not
+        # have been committed yet, so don't keep the result for long.
+        if now < _recent_activity['settle']:
+            expires = _recent_activity['settle']
+        else:
+            expires = now + int(config.get('ngds.recent_activity_ttl',
+                                           RECENT_ACTIVITY_TTL))
+        _recent_activity['value'] = activity_dicts
+        _recent_activity['expires'] = expires
+    return copy.deepcopy(activity_dicts)
+
+def invalidate_recent_activity():
+    with _recent_activity_lock:
+        _recent_activity['expires'] = 0
+        _recent_activity['settle'] = time.time() + RECENT_ACTIVITY_SETTLE
+
+def cached_snippet(template_name, ttl=300, tags=(), **kw):
+    """
+    Render a snippet like the '{% snippet %}' tag does, but keep the markup
+    for 'ttl' seconds.  The cached markup is dropped early when the NGDS
+    settings change or when one of 'tags' is invalidated through
+    'cache.fragment_cache'; the plugin invalidates 'packages' whenever a
+    dataset is created, updated or deleted.  Snippets rendered this way must
+    not depend on the current user or include fanstatic resources.
+
+    @param template_name: snippet template
+    @param ttl: seconds to keep the rendered snippet
+    @param tags: names of events that make the snippet stale
+    @param kw: variables passed on to the snippet
+    @return: markup
+    """
+    key = (template_name, ckan_helpers.lang(), tuple(sorted(kw.items())))
+    markup = cache.fragment_cache.get(key)
+    if markup is None:
+        markup = ckan_helpers.snippet(template_name, **kw)
+        cache.fragment_cache.put(key, markup, ttl, tags)
+    return markup
+
+def get_search_targets():
+    """
+    List the searches the NGDS search box offers, leaving out those whose
+    module isn't installed, with the URL each one is run at.  The box submits
+    straight to the URL of the selected search.
+
+    @return: list of (search type, label, URL) tuples, the catalog search first
+    """
+    if not _installed_search_targets:
+        for target in SEARCH_TARGETS:
+            try:
+                importlib.import_module(target[2])
+            except ImportError:
+                log.warning('%s is not installed, leaving out the %s' %
+                            (target[2], target[1]))
+                continue
+            _installed_search_targets.append(target)
+    return [(search_type, label, ckan_helpers.url_for(controller=controller,
+                                                      action=action))
+            for search_type, label, module, controller, action
+            in _installed_search_targets]
 
 def get_formatted_date(timestamp):
     return iso8601.parse_date(timestamp).strftime("%B %d, %Y")
\ No newline at end of file
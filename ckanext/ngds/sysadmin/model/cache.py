@@ -0,0 +1,230 @@
+import errno
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+import ckan.lib.app_globals as app_globals
+import ckanext.ngds.sysadmin.model.db as db
+
+log = logging.getLogger(__name__)
+
+class ConfigCache(object):
+    """
+    In-memory copy of the active 'ngds_system_info' row, with the version it
+    was read at.  Every worker checks on each request whether another worker
+    has saved new settings, and only then reads the table again:
+
+    - A stamp file on local disk is rewritten by 'bump' whenever settings are
+      saved, and every worker stats it once per request.  This reaches every
+      worker on the host without touching the database.
+    - Every 'poll_interval' seconds, the 'last_edited' column of the active
+      row is read as well, for workers on other hosts that don't share the
+      stamp file.
+
+    'generation' goes up by one every time the settings are reloaded or saved
+    in this worker, so code that derives values from them can tell when to
+    recompute.
+    """
+
+    def __init__(self, stamp_path=None, poll_interval=60):
+        self.stamp_path = stamp_path
+        self.poll_interval = poll_interval
+        self.values = {}
+        self.version = None
+        self.generation = 0
+        self._stamp = None
+        self._stamp_token = None
+        self._polled = 0
+        self._lock = threading.Lock()
+
+    def load(self, model, config, reset_globals=True):
+        """
+        Read the active configuration row and apply it to the pylons config
+        object and, once the app is running, to 'app_globals'.
+
+        @param model: base CKAN model object
+        @param config: pylons global config object
+        @param reset_globals: whether to reload 'app_globals' as well
+        @return: dictionary of data read from database table
+        """
+        # Read the stamp first, so that a save that lands while the row is
+        # being read still triggers another reload.
+        if self.stamp_path:
+            self._stamp, self._stamp_token = self._read_stamp()
+
+        values = db.init_config_show(model)
+        config.update(values)
+        if reset_globals:
+            # Settings saved through the style form live in CKAN's own
+            # 'system_info' table, and are picked up here as well.
+            app_globals.reset()
+
+        with self._lock:
+            self.values = values
+            self.version = values.get('last_edited')
+            self.generation += 1
+            self._polled = time.time()
+        return values
+
+    def _read_stamp(self):
+        try:
+            stat = os.stat(self.stamp_path)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None, None
+        stamp = (stat.st_mtime, stat.st_size, stat.st_ino)
+        if stamp == self._stamp:
+            return stamp, self._stamp_token
+        with open(self.stamp_path) as f:
+            return stamp, f.read()
+
+    def check(self, model, config):
+        """
+        Reload the configuration if another worker has saved new settings
+        since it was last loaded.  Called at the start of every request, so
+        it costs a single stat() call unless something changed.
+
+        @param model: base CKAN model object
+        @param config: pylons global config object
+        @return: True if the configuration was reloaded
+        """
+        stale = False
+
+        if self.stamp_path:
+            stamp, token = self._read_stamp()
+            if stamp != self._stamp:
+                stale = token != self._stamp_token
+                self._stamp, self._stamp_token = stamp, token
+
+        if not stale and self.poll_interval and \
+                time.time() - self._polled > self.poll_interval:
+            self._polled = time.time()
+            stale = db.config_version(model) != self.version
+
+        if stale:
+            log.debug('NGDS system configuration changed, reloading')
+            self.load(model, config)
+        return stale
+
+    def bump(self):
+        """
+        Tell every worker that the settings have changed.  Called after new
+        settings have been committed; the stamp file is replaced in one
+        rename so that readers never see it half written.
+
+        @return: nothing
+        """
+        with self._lock:
+            self.generation += 1
+        if not self.stamp_path:
+            return
+        directory = os.path.dirname(self.stamp_path)
+        try:
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            handle, temp = tempfile.mkstemp(dir=directory or None,
+                                            prefix='.stamp')
+            with os.fdopen(handle, 'w') as f:
+                f.write(uuid.uuid4().hex)
+            os.rename(temp, self.stamp_path)
+            # This worker already has the new settings, so it doesn't need to
+            # reload them when it sees its own stamp.
+            self._stamp, self._stamp_token = self._read_stamp()
+        except (IOError, OSError), e:
+            log.warning('Could not write config stamp %s: %s'
+                        % (self.stamp_path, e))
+
+class FragmentCache(object):
+    """
+    Rendered template fragments.  Each fragment is kept for its own number of
+    seconds, and is dropped early when one of the tags it was stored with is
+    invalidated or when 'config_cache' reloads the settings.  Invalidating a
+    tag with 'settle' keeps fragments rendered shortly afterwards for no more
+    than that many seconds, in case they were rendered before the change that
+    caused the invalidation was committed.
+    """
+
+    def __init__(self, config_cache):
+        self.config_cache = config_cache
+        self._fragments = {}
+        self._settle = {}
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def _check_generation(self):
+        if self._generation != self.config_cache.generation:
+            self._fragments.clear()
+            self._generation = self.config_cache.generation
+
+    def get(self, key):
+        """
+        @param key: hashable fragment key
+        @return: the rendered fragment, or None if it isn't cached
+        """
+        with self._lock:
+            self._check_generation()
+            fragment = self._fragments.get(key)
+            if fragment is None or fragment[1] <= time.time():
+                return None
+            return fragment[0]
+
+    def put(self, key, value, ttl, tags=()):
+        """
+        @param key: hashable fragment key
+        @param value: the rendered fragment
+        @param ttl: seconds to keep the fragment
+        @param tags: names of events that make the fragment stale
+        @return: nothing
+        """
+        now = time.time()
+        expires = now + ttl
+        with self._lock:
+            self._check_generation()
+            for tag in tags:
+                if self._settle.get(tag, 0) > now:
+                    expires = min(expires, self._settle[tag])
+            self._fragments[key] = (value, expires, frozenset(tags))
+
+    def invalidate(self, tag=None, settle=0):
+        """
+        Drop every fragment stored with a tag, or every fragment if called
+        without one.
+        """
+        with self._lock:
+            if tag is None:
+                self._fragments.clear()
+                return
+            for key, fragment in self._fragments.items():
+                if tag in fragment[2]:
+                    del self._fragments[key]
+            if settle:
+                self._settle[tag] = time.time() + settle
+
+# The caches are shared by every request in the process.  'response_cache'
+# holds whole pages, see 'ckanext.ngds.caching.cached_page'.
+config_cache = ConfigCache()
+fragment_cache = FragmentCache(config_cache)
+response_cache = FragmentCache(config_cache)
+
+def invalidate(tag, settle=0):
+    """
+    Drop every cached fragment and page stored with a tag.
+    """
+    fragment_cache.invalidate(tag, settle)
+    response_cache.invalidate(tag, settle)
+
+def configure(stamp_path=None, poll_interval=None):
+    """
+    Apply settings from the CKAN config file to the shared config cache.
+
+    @param stamp_path: file whose changes tell workers to reload settings
+    @param poll_interval: seconds between reads of 'last_edited', 0 disables
+    @return: nothing
+    """
+    config_cache.stamp_path = stamp_path or None
+    if poll_interval is not None:
+        config_cache.poll_interval = float(poll_interval)
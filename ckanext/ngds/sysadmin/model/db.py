@@ -3,7 +3,9 @@ import datetime
 
 from sqlalchemy import Table
 from sqlalchemy import Column
+from sqlalchemy import Index
 from sqlalchemy import types
+from sqlalchemy.engine import reflection
 from sqlalchemy.orm import class_mapper
 
 log = logging.getLogger(__name__)
@@ -56,6 +58,28 @@ def init(model):
         ngds_system_info
     )
 
+    init_activity_index(model)
+
+def init_activity_index(model):
+    """
+    Creates an index on the vanilla CKAN 'activity' table for the homepage's
+    recent activity, which reads the newest activities of one type.  Without
+    it, that query has to sort the whole table.
+
+    @param model: base CKAN model object
+    @return: nothing
+    """
+    name = 'idx_activity_type_timestamp'
+    inspector = reflection.Inspector.from_engine(model.meta.engine)
+    if name in [index['name'] for index in inspector.get_indexes('activity')]:
+        log.debug('Activity index already exists')
+        return
+
+    index = Index(name, model.activity_table.c.activity_type,
+                  model.activity_table.c.timestamp)
+    index.create(model.meta.engine)
+    log.debug('Activity index created')
+
 def init_table_populate(model, data):
     """
     Populates the database table with default configurations if we're building
@@ -88,8 +112,9 @@ def init_table_populate(model, data):
 def init_config_show(model):
     """
     Reads data from the database table and parses it into a dictionary that
-    we'll use to update the pylons global config object.  This method should
-    only every be used whe the server is booting up.
+    we'll use to update the pylons global config object.  This method is used
+    when the server is booting up and whenever 'cache.config_cache' finds that
+    another worker has saved new configurations.
 
     @param model: base CKAN model object
     @return: dictionary of data read from database table
@@ -108,4 +133,22 @@ def init_config_show(model):
     for key in mapped_table.c.keys():
         db_config[key] = getattr(table, key)
 
-    return db_config
\ No newline at end of file
+    return db_config
+
+def config_version(model):
+    """
+    Reads the time the active configuration was last edited, without loading
+    the rest of the row.  Workers compare it with the version they loaded to
+    find out whether another worker has saved new settings.
+
+    @param model: base CKAN model object
+    @return: datetime, or None if there is no active configuration
+    """
+
+    # Check for ORM
+    if ngds_system_info is None:
+        init(model)
+
+    return model.Session.query(ngds_system_info.c.last_edited)\
+        .filter(ngds_system_info.c.active_config == True)\
+        .limit(1).scalar()
@@ -1,16 +1,25 @@
+import os
+import logging
+
 import ckan.plugins as p
 import ckanext.ngds.sysadmin.model.db as db
+import ckanext.ngds.sysadmin.model.cache as cache
+import ckanext.ngds.caching as caching
 
 import ckan.lib.app_globals as app_globals
 import ckan.model as model
 
 import ckanext.ngds.sysadmin.helpers as h
 
+log = logging.getLogger(__name__)
+
 class SystemAdministrator(p.SingletonPlugin):
 
     p.implements(p.IConfigurer, inherit=True)
     p.implements(p.IRoutes, inherit=True)
     p.implements(p.ITemplateHelpers)
+    p.implements(p.IMiddleware, inherit=True)
+    p.implements(p.IPackageController, inherit=True)
 
     def update_config(self, config):
         """
@@ -45,12 +54,25 @@ class SystemAdministrator(p.SingletonPlugin):
         # default values and build ORM.  Otherwise, just build the ORM.
         db.init_table_populate(model, data)
 
+        # Stamp file that workers on this host watch for saved settings, and
+        # how often to look for settings saved on other hosts.
+        stamp_path = config.get('ngds.sysadmin.config_stamp')
+        if stamp_path is None and config.get('cache_dir'):
+            stamp_path = os.path.join(config.get('cache_dir'), 'ngds',
+                                      'sysadmin.stamp')
+        cache.configure(stamp_path=stamp_path,
+                        poll_interval=config.get('ngds.sysadmin.config_poll',
+                                                 60))
+
         # Always read the 'ngds_system_info' table upon starting the server
-        db_config = db.init_config_show(model)
+        # and update pylons global config object with the configs we just read
+        # from it.  From then on, 'make_middleware' reloads them whenever they
+        # are saved by any worker.
+        cache.config_cache.load(model, config, reset_globals=False)
 
-        # Update pylons global config object with the configs we just read from
-        # the 'ngds_system_info' table.
-        config.update(db_config)
+        # Pages rendered with these settings are cached until they change,
+        # by the actions of both NGDS plugins that use 'cached_page'.
+        caching.configure(cache.response_cache, cache.config_cache)
 
         # Add custom templates directory
         p.toolkit.add_template_directory(config, 'templates')
@@ -61,6 +83,41 @@ class SystemAdministrator(p.SingletonPlugin):
         # Register fanstatic directory for JavaScript files
         p.toolkit.add_resource('fanstatic', 'sysadmin')
 
+    def make_middleware(self, app, config):
+        """
+        Check whether the NGDS configurations have been saved by another
+        worker before every request, and reload them if they have.
+
+        @param app: WSGI application
+        @param config: Pylons global config object
+        @return: WSGI application
+        """
+        def check_config(environ, start_response):
+            try:
+                cache.config_cache.check(model, config)
+            except Exception, e:
+                log.warning('Could not check NGDS configurations: %s' % e)
+            finally:
+                # This runs outside the Pylons request cycle, which is what
+                # normally removes the session, so a check that read the
+                # database would otherwise keep its connection checked out.
+                model.Session.remove()
+            return app(environ, start_response)
+        return check_config
+
+    def after_create(self, context, pkg_dict):
+        # A new package is a new entry in the homepage's recent activity, and
+        # changes its dataset count and popular tags.
+        h.invalidate_recent_activity()
+        cache.invalidate('packages', settle=h.RECENT_ACTIVITY_SETTLE)
+
+    def after_update(self, context, pkg_dict):
+        cache.invalidate('packages', settle=h.RECENT_ACTIVITY_SETTLE)
+
+    def after_delete(self, context, pkg_dict):
+        h.invalidate_recent_activity()
+        cache.invalidate('packages', settle=h.RECENT_ACTIVITY_SETTLE)
+
     def before_map(self, map):
         # Set routes for controller
         controller = 'ckanext.ngds.sysadmin.controllers.admin:NGDSAdminController'
@@ -77,6 +134,10 @@ class SystemAdministrator(p.SingletonPlugin):
         controller = 'ckanext.ngds.sysadmin.controllers.view:ViewController'
         map.connect('ngds_homepage_search', '/ngds/search',
                     controller=controller, action='homepage_search')
+
+        # Serve the homepage from the page cache for anonymous users
+        controller = 'ckanext.ngds.sysadmin.controllers.view:HomeController'
+        map.connect('ngds_home', '/', controller=controller, action='index')
         return map
 
     def get_helpers(self):
@@ -85,5 +146,7 @@ class SystemAdministrator(p.SingletonPlugin):
                 'metadata_edit_enabled': h.metadata_edit_enabled,
                 'get_featured_data': h.get_featured_data,
                 'get_recent_activity': h.get_recent_activity,
-                'get_formatted_date': h.get_formatted_date
+                'get_formatted_date': h.get_formatted_date,
+                'cached_snippet': h.cached_snippet,
+                'get_search_targets': h.get_search_targets
                 }
\ No newline at end of file
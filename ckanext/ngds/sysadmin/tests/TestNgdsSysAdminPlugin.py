@@ -4,9 +4,53 @@ import ckanext.ngds.sysadmin.helpers as helper
 import ConfigParser
 import os
 import ckanext.ngds.sysadmin.model.db as db
+import ckanext.ngds.sysadmin.model.cache as cache
+import ckanext.ngds.caching as caching
+import tempfile
 from ckanext.ngds.common import model
 import json
 
+class FakeNamespace(object):
+
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+class FakeNeeded(object):
+
+    def resources(self):
+        return []
+
+    def need(self, resource):
+        pass
+
+class FakeQuery(object):
+    """
+    Stand-in for the recent activity query that counts how often it is run.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.runs = 0
+
+    def __call__(self, *args):
+        return self
+
+    def join(self, *args):
+        return self
+
+    def filter(self, *args):
+        return self
+
+    def order_by(self, *args):
+        return self
+
+    def limit(self, *args):
+        return self
+
+    def all(self):
+        self.runs += 1
+        return list(self.rows)
+
 class TestNgdsSysAdminPlugin(object):
 
     #setup_class executes (auto once) before anything in this class
@@ -83,6 +127,47 @@ class TestNgdsSysAdminPlugin(object):
             print "failed to connect"
             assert False
 
+    #testing old links to ngds_homepage_search redirect catalog searches to the dataset search with the query
+    def test_ngdsHomepageCatalogSearch(self):
+        print 'test_ngdsHomepageCatalogSearch(): Running actual test code ..........................'
+
+        import requests
+        import urlparse
+        query = 'q=volcanic+vents&sort=title_string+asc&search-type=catalog_search'
+        try:
+            oResponse = requests.get("http://%s%s?%s" % (self.host, self.path, query), allow_redirects=False)
+            assert oResponse.status_code in (301, 302, 303)
+            location = urlparse.urlparse(oResponse.headers['Location'])
+            assert location.path == '/dataset'
+            assert urlparse.parse_qs(location.query) == {'q': ['volcanic vents'], 'sort': ['title_string asc']}
+        except requests.ConnectionError:
+            print "failed to connect"
+            assert False
+
+    #testing old links to ngds_homepage_search redirect map searches to the map search, or the dataset search without mapsearch
+    def test_ngdsHomepageMapSearch(self):
+        print 'test_ngdsHomepageMapSearch(): Running actual test code ..........................'
+
+        import requests
+        import urlparse
+        import importlib
+        query = 'q=volcanic+vents&search-type=map_search'
+        try:
+            importlib.import_module(helper.SEARCH_TARGETS[1][2])
+            mapsearch = True
+        except ImportError:
+            mapsearch = False
+        try:
+            oResponse = requests.get("http://%s%s?%s" % (self.host, self.path, query), allow_redirects=False)
+            assert oResponse.status_code in (301, 302, 303)
+            location = urlparse.urlparse(oResponse.headers['Location'])
+            assert location.path != self.path
+            assert (location.path != '/dataset') == mapsearch
+            assert urlparse.parse_qs(location.query) == {'q': ['volcanic vents']}
+        except requests.ConnectionError:
+            print "failed to connect"
+            assert False
+
     #test changed config value on loading sysadmin plugin using Model/db method
     def test_overriddenConfigValue(self):
 
@@ -95,3 +180,176 @@ class TestNgdsSysAdminPlugin(object):
         assert json.dumps(dbConfig['ngds.publish']).strip('"') == 'True'
         assert json.dumps(dbConfig['ngds.harvest']).strip('"') == 'True'
         assert json.dumps(dbConfig['ngds.edit_metadata']).strip('"') == 'True'
+
+    #test that a saved configuration is reloaded once, and only once, by every worker
+    def test_configReload(self):
+        print 'test_configReload(): Running actual test code ..........................'
+
+        config = {}
+        worker = cache.ConfigCache(os.path.join(tempfile.mkdtemp(), 'stamp'), poll_interval=0)
+        worker.load(model, config, reset_globals=False)
+
+        assert config['ngds.publish'] == 'True'
+        assert not worker.check(model, config)
+
+        cache.ConfigCache(worker.stamp_path).bump()
+
+        assert worker.check(model, config)
+        assert not worker.check(model, config)
+        assert worker.generation == 2
+
+    #test that cached fragments are dropped by their tags and by saved settings
+    def test_fragmentCache(self):
+        print 'test_fragmentCache(): Running actual test code ..........................'
+
+        settings = cache.ConfigCache()
+        fragments = cache.FragmentCache(settings)
+        fragments.put('tags', '<div>tags</div>', 300, ['packages'])
+        fragments.put('welcome', '<div>welcome</div>', 300)
+
+        assert fragments.get('tags') == '<div>tags</div>'
+
+        fragments.invalidate('packages')
+        assert fragments.get('tags') is None
+        assert fragments.get('welcome') == '<div>welcome</div>'
+
+        settings.bump()
+        assert fragments.get('welcome') is None
+
+    #test that pages are rendered once per settings version, and that their ETag changes with the settings
+    def test_cachedPage(self):
+        print 'test_cachedPage(): Running actual test code ..........................'
+
+        settings = cache.ConfigCache()
+        settings.version = 'v1'
+        rendered = []
+
+        class Controller(object):
+            @caching.cached_page(ttl=300)
+            def render_help(self):
+                rendered.append(settings.version)
+                return u'<p>help</p>'
+
+        request = FakeNamespace(method='GET', query_string='', path='/ngds/help', if_none_match=None, headers={})
+        fake_base = FakeNamespace(request=request, c=FakeNamespace(user=None), session={},
+                                  response=FakeNamespace(status_int=200, content_type='text/html', headers={}))
+        saved = (caching.base, caching.ckan_helpers, caching.fanstatic, caching.response_cache, caching.config_cache)
+        try:
+            caching.base = fake_base
+            caching.ckan_helpers = FakeNamespace(lang=lambda: 'en')
+            caching.fanstatic = FakeNamespace(get_needed=FakeNeeded)
+
+            assert Controller().render_help() == u'<p>help</p>'
+            assert Controller().render_help() == u'<p>help</p>'
+            assert rendered == ['v1', 'v1']
+
+            caching.configure(cache.FragmentCache(settings), settings)
+            Controller().render_help()
+            etag = fake_base.response.headers['ETag']
+            assert Controller().render_help() == u'<p>help</p>'
+            assert rendered == ['v1', 'v1', 'v1']
+
+            settings.version = 'v2'
+            settings.bump()
+            Controller().render_help()
+            assert rendered == ['v1', 'v1', 'v1', 'v2']
+            assert fake_base.response.headers['ETag'] != etag
+            assert fake_base.response.headers['Surrogate-Key'] == 'ngds-config'
+        finally:
+            (caching.base, caching.ckan_helpers, caching.fanstatic, caching.response_cache,
+             caching.config_cache) = saved
+
+    #test that the recent activity is queried once, kept until it expires or a package is created, and copied out
+    def test_recentActivity(self):
+        print 'test_recentActivity(): Running actual test code ..........................'
+
+        query = FakeQuery([{'id': 'activity-1'}])
+        fake_model = FakeNamespace(Session=FakeNamespace(query=query),
+                                   Activity=FakeNamespace(object_id='object_id', activity_type='activity_type',
+                                                          timestamp='timestamp'),
+                                   Package=FakeNamespace(id='id'))
+        fake_dictization = FakeNamespace(model_dictize=FakeNamespace(
+            activity_list_dictize=lambda objects, context: [dict(o) for o in objects]))
+        saved = (helper.model, helper.dictization, helper.base, helper.config, helper.desc)
+        try:
+            helper.model, helper.dictization = fake_model, fake_dictization
+            helper.base = FakeNamespace(c=FakeNamespace(user=None))
+            helper.config = {'ngds.recent_activity_ttl': '60'}
+            helper.desc = lambda column: column
+            helper.invalidate_recent_activity()
+            helper._recent_activity['settle'] = 0
+
+            activity = helper.get_recent_activity()
+            activity[0]['id'] = 'changed by a template'
+            assert helper.get_recent_activity() == [{'id': 'activity-1'}]
+            assert query.runs == 1
+
+            query.rows.append({'id': 'activity-2'})
+            self.oNgdsSysAdmin.after_create({}, {})
+            assert len(helper.get_recent_activity()) == 2
+            assert query.runs == 2
+            assert helper._recent_activity['expires'] <= helper._recent_activity['settle']
+        finally:
+            helper.model, helper.dictization, helper.base, helper.config, helper.desc = saved
+            helper.invalidate_recent_activity()
+
+    #test that the index behind the recent activity query is created once
+    def test_activityIndex(self):
+        print 'test_activityIndex(): Running actual test code ..........................'
+
+        from sqlalchemy.engine import reflection
+        db.init_activity_index(model)
+        db.init_activity_index(model)
+
+        inspector = reflection.Inspector.from_engine(model.meta.engine)
+        indexes = dict((index['name'], index['column_names']) for index in inspector.get_indexes('activity'))
+        assert indexes['idx_activity_type_timestamp'] == ['activity_type', 'timestamp']
+
+    #test that featured data and feature flags are decoded once per settings version
+    def test_decodedSettings(self):
+        print 'test_decodedSettings(): Running actual test code ..........................'
+
+        saved = helper.config
+        try:
+            helper.config = {'ngds.publish': 'false', 'ngds.featured_data': '[{"name": "heat-flow"}]'}
+            helper.reset_decoded_settings()
+            assert helper.data_publish_enabled() is False
+            assert helper.data_harvest_enabled() is True
+            assert helper.get_featured_data() == [{'name': 'heat-flow'}]
+
+            helper.config = {'ngds.publish': 'true', 'ngds.featured_data': '[]'}
+            assert helper.data_publish_enabled() is False
+            assert helper.get_featured_data() is helper.get_featured_data()
+
+            cache.config_cache.bump()
+            assert helper.data_publish_enabled() is True
+            assert helper.get_featured_data() == []
+
+            helper.config = {'ngds.publish': 'false'}
+            helper.reset_decoded_settings()
+            assert helper.data_publish_enabled() is False
+            assert helper.get_featured_data() is None
+        finally:
+            helper.config = saved
+            helper.reset_decoded_settings()
+
+    #test that the search box is given the URL of every installed search, the catalog search first
+    def test_searchTargets(self):
+        print 'test_searchTargets(): Running actual test code ..........................'
+
+        import importlib
+        try:
+            importlib.import_module(helper.SEARCH_TARGETS[1][2])
+            mapsearch = True
+        except ImportError:
+            mapsearch = False
+
+        saved = helper.ckan_helpers.url_for
+        try:
+            helper.ckan_helpers.url_for = lambda controller, action: '/%s/%s' % (controller, action)
+            targets = helper.get_search_targets()
+            assert targets[0] == ('catalog_search', 'Catalog Search', '/package/search')
+            assert [target[0] for target in targets] == ['catalog_search', 'map_search'][:1 + mapsearch]
+            assert helper.get_search_targets() == targets
+        finally:
+            helper.ckan_helpers.url_for = saved
@@ -30,5 +30,9 @@ setup(
 
     # NGDS UI plugin
     ngds_client=ckanext.ngds.client.plugin:NGDSClient
+
+    [paste.paster_command]
+    ngds-ogc=ckanext.ngds.client.commands:OGCCommand
+    ngds-index=ckanext.ngds.client.commands:IndexCommand
     """,
 )